@@ -1,12 +1,61 @@
 import streamlit as st
-import subprocess
+import streamlit.logger
+import argparse
+import asyncio
+import atexit
+import heapq
+import signal
 import tempfile
-import base64
+import re
+import copy
+import fcntl
+import hashlib
+import io
+import ipaddress
 import os
 import json
+import logging
+import math
+import sys
 import time
+import queue
+import random
+import itertools
+import shutil
+import sqlite3
+import threading
+import unicodedata
+import uuid
 import requests
-from urllib.parse import quote_plus
+from requests.adapters import HTTPAdapter
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, CancelledError, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, quote_plus, urlparse
+
+try:
+    import yt_dlp
+except ImportError:
+    yt_dlp = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# `python app.py batch ...` processes JSONL input with the app's backend and no UI (see batch_main)
+BATCH_MODE = __name__ == "__main__" and sys.argv[1:2] == ['batch'] and not st.runtime.exists()
+if BATCH_MODE:
+    # Streamlit warns about every UI call made outside `streamlit run`. Reading an option first
+    # loads its config, which would otherwise reset the log level on the first UI call.
+    st.get_option('logger.level')
+    streamlit.logger.set_log_level('error')
 
 # Configure page
 st.set_page_config(
@@ -57,94 +106,1697 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-def check_yt_dlp():
-    """Check if yt-dlp is available"""
+# Spans at least this slow are logged at INFO, everything else at DEBUG
+METRICS_SLOW_SPAN = float(os.environ.get('METRICS_SLOW_SPAN', '1.0'))
+METRICS_LOG_LEVEL = os.environ.get('METRICS_LOG_LEVEL', 'INFO').upper()
+# Sessions that have not rerun for this many seconds drop out of the session-state gauge
+METRICS_SESSION_IDLE = 3600
+
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def estimate_size(value, _depth=0):
+    """Approximate in-memory size of a session-state value in bytes"""
+    size = sys.getsizeof(value)
+    if _depth < 8:
+        if isinstance(value, dict):
+            size += sum(estimate_size(k, _depth + 1) + estimate_size(v, _depth + 1) for k, v in value.items())
+        elif isinstance(value, (list, tuple, set, frozenset, deque)):
+            size += sum(estimate_size(v, _depth + 1) for v in value)
+        elif hasattr(type(value), '__slots__'):
+            size += sum(estimate_size(getattr(value, k, None), _depth + 1) for k in type(value).__slots__)
+    return size
+
+
+class MetricsRegistry:
+    """Timing spans, counters and gauges for the whole server process"""
+
+    def __init__(self, window=500):
+        self.window = window
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._totals = {}
+        self._families = {}
+        self._session_bytes = {}
+        self._local = threading.local()
+        # One JSON object per line on stderr, independent of Streamlit's own log format
+        self.logger = logging.getLogger('youtube_player.metrics')
+        if not self.logger.handlers:
+            handler = logging.StreamHandler()
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self.logger.addHandler(handler)
+            self.logger.setLevel(METRICS_LOG_LEVEL)
+            self.logger.propagate = False
+
+    def log(self, event, level=logging.INFO, **fields):
+        """Emit a structured JSON log line"""
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, json.dumps({'ts': round(time.time(), 3), 'event': event, **fields}, default=str))
+
+    def observe(self, name, seconds, **fields):
+        """Record one duration for the span called name"""
+        with self._lock:
+            self._samples.setdefault(name, deque(maxlen=self.window)).append(seconds)
+            totals = self._totals.setdefault(name, [0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
+        trace = getattr(self._local, 'trace', None)
+        if trace is not None:
+            trace[name] = trace.get(name, 0.0) + seconds
+        self.log('span', logging.INFO if seconds >= METRICS_SLOW_SPAN else logging.DEBUG,
+                 span=name, seconds=round(seconds, 4), **fields)
+
+    @contextmanager
+    def span(self, name, trace=False, **fields):
+        """Time the enclosed block; with trace=True the log line breaks it down by nested spans"""
+        outer = getattr(self._local, 'trace', None)
+        if trace:
+            self._local.trace = {}
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            fields['error'] = type(e).__name__
+            raise
+        finally:
+            if trace:
+                fields['breakdown'] = {k: round(v, 4) for k, v in self._local.trace.items()}
+                self._local.trace = outer
+            self.observe(name, time.perf_counter() - started, **fields)
+
+    def summary(self, name):
+        """Return count, p50 and p95 in seconds for name, or None if nothing was recorded"""
+        with self._lock:
+            samples = sorted(self._samples.get(name, ()))
+            count = self._totals.get(name, [0])[0]
+        if not samples:
+            return None
+        return {'count': count, 'p50': _percentile(samples, 0.5), 'p95': _percentile(samples, 0.95)}
+
+    def spans(self):
+        """Return the summary of every recorded span, keyed by name"""
+        with self._lock:
+            names = sorted(self._samples)
+        return {name: self.summary(name) for name in names}
+
+    def register(self, name, kind, help, read):
+        """Register a counter or gauge family; read() returns (labels, value) pairs at export time"""
+        with self._lock:
+            self._families[name] = (kind, help, read)
+
+    def collect(self, name):
+        """Return the current (labels, value) pairs of a registered family"""
+        try:
+            return list(self._families[name][2]())
+        except Exception:
+            return []
+
+    def set_session_bytes(self, key, size):
+        now = time.time()
+        with self._lock:
+            self._session_bytes[key] = (size, now)
+            for stale in [k for k, (_, seen) in self._session_bytes.items() if now - seen > METRICS_SESSION_IDLE]:
+                del self._session_bytes[stale]
+
+    def session_bytes(self):
+        with self._lock:
+            return sum(size for size, _ in self._session_bytes.values()), len(self._session_bytes)
+
+    def prometheus(self):
+        """Render every span and registered family in the Prometheus text exposition format"""
+        lines = ['# HELP app_span_seconds Duration of instrumented hot-path spans',
+                 '# TYPE app_span_seconds summary']
+        with self._lock:
+            spans = {name: (sorted(samples), *self._totals[name]) for name, samples in self._samples.items()}
+            families = sorted(self._families.items())
+        for name, (samples, count, total) in sorted(spans.items()):
+            for quantile in (0.5, 0.95):
+                lines.append(f'app_span_seconds{{span="{name}",quantile="{quantile}"}} '
+                             f'{_percentile(samples, quantile):.6f}')
+            lines.append(f'app_span_seconds_sum{{span="{name}"}} {total:.6f}')
+            lines.append(f'app_span_seconds_count{{span="{name}"}} {count}')
+        for name, (kind, help, _) in families:
+            lines += [f'# HELP app_{name} {help}', f'# TYPE app_{name} {kind}']
+            for labels, value in self.collect(name):
+                label_text = ','.join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f'app_{name}{{{label_text}}} {value}' if label_text else f'app_{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _cache_events():
+    caches = {
+        'search': get_search_cache().stats,
+        'metadata': get_metadata_store().stats,
+        'stream_urls': get_stream_url_cache().cache.stats,
+        'thumbnails': get_thumbnail_service().stats,
+    }
+    for cache, stats in caches.items():
+        for event, count in list(stats.items()):
+            yield {'cache': cache, 'event': event}, count
+
+
+@st.cache_resource(show_spinner=False)
+def get_metrics():
+    """Return the process-wide metrics registry with the app's counters and gauges registered"""
+    metrics = MetricsRegistry()
+    metrics.register('cache_events_total', 'counter', 'Cache lookups and refreshes by cache and outcome', _cache_events)
+    metrics.register('backend_calls_total', 'counter', 'Backend calls executed upstream or coalesced onto one in flight',
+                     lambda: [({'outcome': k}, v) for k, v in get_backend().flight.stats.items()])
+    metrics.register('upstream_events_total', 'counter', 'Rate limiter, retry and circuit breaker events',
+                     lambda: [({'event': k}, v) for stats in (get_backend().backend.limiter.stats,
+                                                                get_backend().backend.breaker.stats,
+                                                                get_backend().backend.stats) for k, v in stats.items()])
+    metrics.register('upstream_circuit_open', 'gauge', '1 while upstream calls are failing fast',
+                     lambda: [({}, int(get_backend().backend.breaker.is_open))])
+    metrics.register('search_index_events_total', 'counter', 'Videos indexed and offline searches and suggestions served',
+                     lambda: [({'event': k}, v) for k, v in get_search_index().stats.items()])
+    metrics.register('subprocess_events_total', 'counter', 'Child process lifecycle events',
+                     lambda: [({'event': k}, v) for k, v in get_subprocess_executor().stats.items()])
+    metrics.register('prefetch_events_total', 'counter', 'Stream URL prefetch outcomes',
+                     lambda: [({'event': k}, v) for k, v in get_stream_prefetcher().stats.items()])
+    metrics.register('active_downloads', 'gauge', 'Download and audio jobs queued or running',
+                     lambda: [({}, get_download_jobs().active_count())])
+    metrics.register('child_processes', 'gauge', 'Live child processes by program',
+                     lambda: [({'program': k}, v) for k, v in get_subprocess_executor().running_by_program().items()])
+    metrics.register('session_state_bytes', 'gauge', 'Approximate session-state size summed over active sessions',
+                     lambda: [({}, metrics.session_bytes()[0])])
+    metrics.register('session_blob_bytes', 'gauge', 'Session blob store size by tier',
+                     lambda: [({'tier': 'memory'}, get_session_blobs().memory_bytes),
+                              ({'tier': 'disk'}, get_session_blobs().disk_bytes())])
+    metrics.register('session_blob_events_total', 'counter', 'Session blobs spilled, rehydrated, dropped or expired',
+                     lambda: [({'event': k}, v) for k, v in get_session_blobs().stats.items()])
+    metrics.register('active_sessions', 'gauge', 'Sessions that reran within the idle window',
+                     lambda: [({}, metrics.session_bytes()[1])])
+    return metrics
+
+
+def json_loads(data):
+    """Parse JSON text or bytes, with orjson when it is installed"""
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def _json_default(value):
+    # Duck-typed: every script rerun redefines VideoRecord, and cached records outlive the rerun that built them
+    if hasattr(value, 'to_dict'):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def json_dumps(value):
+    """Serialize value to JSON text, with orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(value, default=_json_default).decode()
+    return json.dumps(value, default=_json_default)
+
+
+# The only yt-dlp fields the app reads; captions, thumbnail lists, heatmaps, tags and the
+# like are never requested from the subprocess backend and dropped from in-process results
+SEARCH_FIELDS = ('id', 'title', 'uploader', 'duration', 'view_count')
+FORMAT_FIELDS = ('format_id', 'format_note', 'url', 'ext', 'protocol', 'vcodec', 'acodec', 'width', 'height', 'fps',
+                 'tbr', 'vbr', 'abr', 'filesize', 'filesize_approx', 'http_headers', 'downloader_options')
+# Format fields are kept at the top level too, for sites that return a single format without a list
+INFO_FIELDS = ('id', 'title', 'uploader', 'duration', 'view_count', 'description', 'upload_date', 'thumbnail',
+               'webpage_url', 'original_url', 'extractor', 'extractor_key', 'live_status', *FORMAT_FIELDS)
+# Only an excerpt of the description is ever shown
+DESCRIPTION_CHARS = 300
+
+
+def pick_fields(data, fields):
+    """Copy the listed fields of a yt-dlp document that are set"""
+    return {k: data[k] for k in fields if data.get(k) is not None}
+
+
+def trim_description(info):
+    if info.get('description'):
+        info['description'] = info['description'][:DESCRIPTION_CHARS]
+    return info
+
+
+def slim_info(info):
+    """Reduce a yt-dlp info document to INFO_FIELDS, with each format reduced to FORMAT_FIELDS"""
+    slim = pick_fields(info, INFO_FIELDS)
+    slim['formats'] = [pick_fields(f, FORMAT_FIELDS) for f in info.get('formats') or []]
+    return trim_description(slim)
+
+
+def print_template(fields, path=''):
+    """yt-dlp --print template writing only fields as one line of JSON; path 'formats.:' applies it per format"""
+    return f"%({path}.{{{','.join(fields)}}}|{'[]' if path else '{}'})j"
+
+
+# Backend selection: "auto" runs yt-dlp in-process when the module is importable,
+# "subprocess" forces the yt-dlp executable for every call
+YT_DLP_BACKEND = os.environ.get('YT_DLP_BACKEND', 'auto')
+YDL_POOL_SIZE = int(os.environ.get('YDL_POOL_SIZE', '4'))
+
+YDL_BASE_OPTIONS = {
+    'quiet': True,
+    'no_warnings': True,
+    'noprogress': True,
+}
+
+
+class YoutubeDLPool:
+    """Thread-safe pool of reusable YoutubeDL instances, one pool per option set"""
+
+    def __init__(self, size=YDL_POOL_SIZE):
+        self.size = size
+        self._lock = threading.Lock()
+        self._pools = {}
+
+    @contextmanager
+    def acquire(self, **options):
+        """Check out a YoutubeDL instance configured with options"""
+        key = json.dumps(options, sort_keys=True, default=str)
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = self._pools[key] = {
+                    'idle': queue.LifoQueue(),
+                    'slots': threading.BoundedSemaphore(self.size),
+                }
+
+        pool['slots'].acquire()
+        try:
+            try:
+                ydl = pool['idle'].get_nowait()
+            except queue.Empty:
+                ydl = yt_dlp.YoutubeDL({**YDL_BASE_OPTIONS, **options})
+            try:
+                yield ydl
+            finally:
+                pool['idle'].put(ydl)
+        finally:
+            pool['slots'].release()
+
+
+class InProcessBackend:
+    """yt-dlp engine running inside the server process on pooled YoutubeDL instances"""
+
+    name = 'in-process'
+
+    def __init__(self):
+        self.pool = YoutubeDLPool()
+
+    def version(self):
+        return yt_dlp.version.__version__
+
+    def iter_search(self, query, max_results, start=1):
+        # process=False hands back the extractor's lazy entries generator, so each
+        # result is yielded as soon as its results page has been parsed
+        end = start + max_results - 1
+        with self.pool.acquire(extract_flat='in_playlist') as ydl:
+            info = ydl.extract_info(f'ytsearch{end}:{query}', download=False, process=False)
+            for entry in itertools.islice(info.get('entries') or [], start - 1, end):
+                yield ydl.sanitize_info(pick_fields(entry, SEARCH_FIELDS))
+
+    def search(self, query, max_results, start=1):
+        return list(self.iter_search(query, max_results, start))
+
+    def extract_info(self, url):
+        with self.pool.acquire() as ydl:
+            # Slimming first means sanitize_info only copies the fields that are kept
+            return ydl.sanitize_info(slim_info(ydl.extract_info(url, download=False)))
+
+    def download_info(self, info, format_id, output_path, progress=None, rate_limit=None):
+        """Download format_id from an already-extracted info dict without re-extracting"""
+        options = {
+            **YDL_BASE_OPTIONS,
+            'format': format_id,
+            'outtmpl': output_path,
+            'overwrites': True,
+        }
+        if rate_limit:
+            options['ratelimit'] = rate_limit
+        if progress:
+            def hook(d):
+                if d.get('status') in ('downloading', 'finished'):
+                    progress(d.get('downloaded_bytes') or 0,
+                             d.get('total_bytes') or d.get('total_bytes_estimate'),
+                             d.get('speed'))
+            options['progress_hooks'] = [hook]
+        with yt_dlp.YoutubeDL(options) as ydl:
+            ydl.process_ie_result(copy.deepcopy(info), download=True)
+        return True
+
+    def download(self, url, format_selector, output_path):
+        # outtmpl differs per call, so downloads get their own short-lived instance;
+        # the extractor classes are already loaded in-process either way
+        options = {
+            **YDL_BASE_OPTIONS,
+            'format': format_selector,
+            'outtmpl': output_path,
+            'noplaylist': True,
+            'overwrites': True,
+        }
+        with yt_dlp.YoutubeDL(options) as ydl:
+            return ydl.download([url]) == 0
+
+
+# Upper bound on a single subprocess download
+DOWNLOAD_TIMEOUT = int(os.environ.get('DOWNLOAD_TIMEOUT', '600'))
+
+SIZE_UNITS = {'B': 1, 'KiB': 1024, 'MiB': 1024 ** 2, 'GiB': 1024 ** 3, 'TiB': 1024 ** 4,
+              'KB': 1000, 'MB': 1000 ** 2, 'GB': 1000 ** 3, 'TB': 1000 ** 4}
+
+
+def parse_download_progress(line):
+    """Parse a yt-dlp --newline progress line into (downloaded_bytes, total_bytes, speed)"""
+    match = re.search(r'\[download\]\s+([\d.]+)%\s+of\s+~?\s*([\d.]+)([KMGT]?i?B)', line)
+    if not match:
+        return None
+    total = float(match.group(2)) * SIZE_UNITS.get(match.group(3), 1)
+    speed_match = re.search(r'at\s+([\d.]+)([KMGT]?i?B)/s', line)
+    speed = float(speed_match.group(1)) * SIZE_UNITS.get(speed_match.group(2), 1) if speed_match else None
+    return int(total * float(match.group(1)) / 100), int(total), speed
+
+
+# Global cap on concurrently running child processes (yt-dlp and ffmpeg) across all sessions
+MAX_SUBPROCESSES = int(os.environ.get('MAX_SUBPROCESSES', '6'))
+# Lower values are started first when processes are queued for a slot
+SUBPROCESS_PRIORITIES = {'search': 0, 'info': 1, 'download': 2}
+
+@st.cache_resource(show_spinner=False)
+def _cancel_scopes():
+    """Per-thread cancel scopes, shared with the singletons that earlier script runs created"""
+    return threading.local()
+
+
+# Every rerun executes this module afresh; a module-level threading.local() would give each run its own
+_cancel_scope = _cancel_scopes()
+
+
+@contextmanager
+def cancel_scope(cancelled):
+    """Make child processes started in this thread stop once cancelled() returns True"""
+    previous = getattr(_cancel_scope, 'cancelled', None)
+    _cancel_scope.cancelled = cancelled
     try:
-        result = subprocess.run(['yt-dlp', '--version'], 
-                              capture_output=True, text=True, timeout=10)
-        return result.returncode == 0
-    except:
+        yield
+    finally:
+        _cancel_scope.cancelled = previous
+
+
+def sleep_cancellable(seconds):
+    """time.sleep that raises CancelledError as soon as this thread's cancel scope fires"""
+    cancelled = getattr(_cancel_scope, 'cancelled', None)
+    deadline = time.monotonic() + seconds
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        if cancelled and cancelled():
+            raise CancelledError("Cancelled while waiting")
+        time.sleep(min(remaining, 0.1))
+
+
+def script_run_cancelled():
+    """True once Streamlit has asked the current script run to stop or to rerun the page"""
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        requests_ = get_script_run_ctx(suppress_warning=True).script_requests
+        state = requests_._state.name
+        if state == 'RERUN':
+            # Timer-driven fragment reruns do not preempt the running script
+            rerun = requests_._rerun_data
+            return not (rerun.fragment_id_queue and not rerun.is_fragment_scoped_rerun)
+        return state == 'STOP'
+    except Exception:
         return False
 
-def search_youtube_videos(query, max_results=10):
-    """Search YouTube videos using yt-dlp"""
+
+def process_start_time(pid):
+    """Start time of a process in clock ticks since boot, or None if it is gone or /proc is unavailable"""
     try:
-        cmd = [
-            'yt-dlp',
-            '--dump-json',
+        with open(f'/proc/{pid}/stat') as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # The command name in field 2 may contain spaces and parentheses; starttime is field 22
+    return int(stat.rsplit(')', 1)[1].split()[19])
+
+
+class SubprocessExecutor:
+    """Runs child processes on a background asyncio loop under a global priority-ordered limit"""
+
+    def __init__(self, max_processes=MAX_SUBPROCESSES):
+        self.max_processes = max_processes
+        self.loop = asyncio.new_event_loop()
+        # Everything below is only touched from the loop thread
+        self._active = 0
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._processes = {}
+        self.stats = {'started': 0, 'queued': 0, 'cancelled': 0, 'timeouts': 0, 'orphans_killed': 0}
+        self._pid_file = os.path.join(CACHE_DIR, f'children-{os.getpid()}.pids')
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        self._reap_orphans()
+        threading.Thread(target=self.loop.run_forever, name='subprocess-executor', daemon=True).start()
+        atexit.register(self.shutdown)
+
+    @property
+    def running(self):
+        return len(self._processes)
+
+    def running_by_program(self):
+        counts = {}
+        for program in list(self._processes.values()):
+            counts[program] = counts.get(program, 0) + 1
+        return counts
+
+    def _reap_orphans(self):
+        """Kill children recorded by server processes that no longer exist"""
+        for name in os.listdir(CACHE_DIR):
+            match = re.fullmatch(r'children-(\d+)\.pids', name)
+            if not match or int(match.group(1)) == os.getpid():
+                continue
+            try:
+                os.kill(int(match.group(1)), 0)
+                continue
+            except ProcessLookupError:
+                pass
+            except OSError:
+                continue
+            path = os.path.join(CACHE_DIR, name)
+            with open(path) as f:
+                records = [line.split() for line in f]
+            for record in records:
+                # Only kill a PID that still belongs to the recorded child rather than a later process reusing it
+                if len(record) != 2 or not all(field.isdigit() for field in record):
+                    continue
+                pid, started = map(int, record)
+                if process_start_time(pid) != started:
+                    continue
+                try:
+                    os.killpg(pid, signal.SIGKILL)
+                    self.stats['orphans_killed'] += 1
+                except OSError:
+                    pass
+            os.unlink(path)
+
+    def _write_pid_file(self):
+        """Record each child's PID and start time; children whose start time is unknown are never reaped"""
+        with open(self._pid_file, 'w') as f:
+            f.write('\n'.join(f"{p.pid} {process_start_time(p.pid) or ''}".rstrip() for p in self._processes))
+
+    async def _acquire(self, priority):
+        if self._active < self.max_processes and not self._waiters:
+            self._active += 1
+            return
+        waiter = self.loop.create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), waiter))
+        self.stats['queued'] += 1
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just before cancellation; pass it on
+                self._release()
+            raise
+
+    def _release(self):
+        while self._waiters:
+            _, _, waiter = heapq.heappop(self._waiters)
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._active -= 1
+
+    async def _execute(self, args, priority, timeout, sink, chunked):
+        metrics = get_metrics()
+        program = os.path.basename(args[0])
+        queued_at = time.perf_counter()
+        await self._acquire(priority)
+        metrics.observe('subprocess_queue', time.perf_counter() - queued_at, program=program)
+        process = None
+        try:
+            # Own process group so the whole tree can be killed; large limit for multi-MB JSON lines
+            spawned_at = time.perf_counter()
+            process = await asyncio.create_subprocess_exec(
+                *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+                start_new_session=True, limit=64 * 1024 * 1024
+            )
+            metrics.observe('subprocess_spawn', time.perf_counter() - spawned_at, program=program)
+            self._processes[process] = program
+            self._write_pid_file()
+            self.stats['started'] += 1
+
+            async def communicate():
+                stderr = asyncio.ensure_future(process.stderr.read())
+                first_output = True
+
+                def emit(data):
+                    nonlocal first_output
+                    if first_output:
+                        # Time from spawn to first byte: process startup plus the upstream wait
+                        metrics.observe('subprocess_first_output', time.perf_counter() - spawned_at, program=program)
+                        first_output = False
+                    sink(data)
+
+                if chunked:
+                    while True:
+                        chunk = await process.stdout.read(64 * 1024)
+                        if not chunk:
+                            break
+                        emit(chunk)
+                else:
+                    async for line in process.stdout:
+                        emit(line)
+                await process.wait()
+                metrics.observe('subprocess_total', time.perf_counter() - spawned_at, program=program,
+                                returncode=process.returncode)
+                return process.returncode, (await stderr).decode(errors='replace')
+
+            try:
+                return await asyncio.wait_for(communicate(), timeout)
+            except asyncio.TimeoutError:
+                self.stats['timeouts'] += 1
+                raise TimeoutError(f"{os.path.basename(args[0])} timed out after {timeout}s")
+        except asyncio.CancelledError:
+            self.stats['cancelled'] += 1
+            raise
+        finally:
+            if process is not None:
+                if process.returncode is None:
+                    try:
+                        os.killpg(process.pid, signal.SIGKILL)
+                    except OSError:
+                        pass
+                    await process.wait()
+                self._processes.pop(process, None)
+                self._write_pid_file()
+            self._release()
+
+    def _iterate(self, args, priority, timeout, cancelled, chunked):
+        cancelled = cancelled or getattr(_cancel_scope, 'cancelled', None)
+        output = queue.Queue()
+        future = asyncio.run_coroutine_threadsafe(
+            self._execute(args, SUBPROCESS_PRIORITIES[priority], timeout, output.put, chunked), self.loop
+        )
+        future.add_done_callback(lambda _: output.put(None))
+        try:
+            while True:
+                try:
+                    item = output.get(timeout=0.1)
+                except queue.Empty:
+                    if cancelled and cancelled():
+                        future.cancel()
+                        raise CancelledError(f"{os.path.basename(args[0])} cancelled")
+                    continue
+                if item is None:
+                    break
+                yield item
+            returncode, stderr = future.result()
+            if returncode != 0:
+                stderr = stderr.strip()
+                raise RuntimeError(stderr.splitlines()[-1] if stderr else f"{os.path.basename(args[0])} exited with code {returncode}")
+        finally:
+            # Abandoned iteration (error, cancellation, generator closed) kills the child
+            if not future.done():
+                future.cancel()
+
+    def iter_lines(self, args, priority='info', timeout=30, cancelled=None):
+        """Run args and yield decoded stdout lines as they arrive; raises RuntimeError on failure"""
+        for line in self._iterate(args, priority, timeout, cancelled, chunked=False):
+            yield line.decode(errors='replace')
+
+    def iter_chunks(self, args, priority='download', timeout=30, cancelled=None):
+        """Run args and yield raw stdout chunks as they arrive; raises RuntimeError on failure"""
+        return self._iterate(args, priority, timeout, cancelled, chunked=True)
+
+    def run(self, args, priority='info', timeout=30, cancelled=None):
+        """Run args to completion and return stdout"""
+        return ''.join(self.iter_lines(args, priority, timeout, cancelled))
+
+    def shutdown(self):
+        """Kill every running child; called at interpreter exit"""
+        for process in list(self._processes):
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except OSError:
+                pass
+        try:
+            os.unlink(self._pid_file)
+        except OSError:
+            pass
+
+
+@st.cache_resource(show_spinner=False)
+def get_subprocess_executor():
+    """Return the process-wide child process executor"""
+    return SubprocessExecutor()
+
+
+class SubprocessBackend:
+    """Fallback engine that runs the yt-dlp executable once per call"""
+
+    name = 'subprocess'
+
+    def _run(self, args, timeout=30, priority='info'):
+        return get_subprocess_executor().run(['yt-dlp', *args], priority, timeout)
+
+    def version(self):
+        return self._run(['--version'], timeout=10).strip()
+
+    def _iter_lines(self, args, timeout=30, priority='info'):
+        """Yield stdout lines from yt-dlp as they are written"""
+        return get_subprocess_executor().iter_lines(['yt-dlp', *args], priority, timeout)
+
+    def iter_search(self, query, max_results, start=1):
+        end = start + max_results - 1
+        for line in self._iter_lines([
+            '--print', print_template(SEARCH_FIELDS),
             '--no-download',
             '--flat-playlist',
-            '--playlist-end', str(max_results),
-            f'ytsearch{max_results}:{query}'
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
-        
-        if result.returncode == 0:
-            videos = []
-            for line in result.stdout.strip().split('\n'):
-                if line:
-                    try:
-                        video_data = json.loads(line)
-                        videos.append({
-                            'id': video_data.get('id', ''),
-                            'title': video_data.get('title', 'Unknown Title'),
-                            'uploader': video_data.get('uploader', 'Unknown Channel'),
-                            'duration': video_data.get('duration', 0),
-                            'view_count': video_data.get('view_count', 0),
-                            'url': f"https://www.youtube.com/watch?v={video_data.get('id', '')}",
-                            'thumbnail': f"https://img.youtube.com/vi/{video_data.get('id', '')}/mqdefault.jpg"
-                        })
-                    except json.JSONDecodeError:
-                        continue
-            return videos
+            '--playlist-start', str(start),
+            '--playlist-end', str(end),
+            f'ytsearch{end}:{query}'
+        ], priority='search'):
+            line = line.strip()
+            if line:
+                try:
+                    with get_metrics().span('json_parse', size=len(line)):
+                        entry = json_loads(line)
+                except json.JSONDecodeError:
+                    continue
+                yield entry
+
+    def search(self, query, max_results, start=1):
+        return list(self.iter_search(query, max_results, start))
+
+    def extract_info(self, url):
+        # Two lines of JSON: the top-level fields, then the list of formats
+        output = self._run(['--print', print_template(INFO_FIELDS), '--print', print_template(FORMAT_FIELDS, 'formats.:'),
+                            '--no-download', url])
+        with get_metrics().span('json_parse', size=len(output)):
+            lines = output.strip().splitlines()
+            if len(lines) < 2:
+                raise RuntimeError(f"Unexpected yt-dlp output for {url}")
+            info = json_loads(lines[-2])
+            info['formats'] = json_loads(lines[-1])
+            return trim_description(info)
+
+    def download_info(self, info, format_id, output_path, progress=None, rate_limit=None):
+        """Download format_id from an already-extracted info dict without re-extracting"""
+        with tempfile.NamedTemporaryFile('w', suffix='.info.json', delete=False) as info_file:
+            info_file.write(json_dumps(info))
+        args = ['--load-info-json', info_file.name, '-f', format_id, '-o', output_path, '--force-overwrites', '--newline']
+        if rate_limit:
+            args += ['--limit-rate', str(int(rate_limit))]
+        try:
+            for line in self._iter_lines(args, timeout=DOWNLOAD_TIMEOUT, priority='download'):
+                update = parse_download_progress(line)
+                if update and progress:
+                    progress(*update)
+        finally:
+            os.unlink(info_file.name)
+        return True
+
+    def download(self, url, format_selector, output_path):
+        self._run(['-f', format_selector, '-o', output_path, '--no-playlist', '--force-overwrites', url],
+                  timeout=DOWNLOAD_TIMEOUT, priority='download')
+        return True
+
+
+class SingleFlight:
+    """Collapses concurrent calls with the same key into one execution whose outcome is shared"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._streams = {}
+        self.stats = {'executed': 0, 'coalesced': 0}
+
+    def do(self, key, fn):
+        """Return fn(), or the result or error of an identical call already in flight"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+                self.stats['executed'] += 1
+            else:
+                self.stats['coalesced'] += 1
+        if not leader:
+            return self._wait(key, fn, call)
+
+        try:
+            result = fn()
+            call.set_result(result)
+            return result
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def _wait(self, key, fn, call):
+        cancelled = getattr(_cancel_scope, 'cancelled', None)
+        while not call.done():
+            wait([call], timeout=0.1)
+            if cancelled and cancelled():
+                raise CancelledError("Cancelled while waiting for a shared call")
+        error = call.exception()
+        # A leader that was cancelled or stopped did not fail; followers carry on without it
+        if isinstance(error, CancelledError) or (error is not None and not isinstance(error, Exception)):
+            return self.do(key, fn)
+        return call.result()
+
+    def stream(self, key, iterate):
+        """Yield from iterate(), letting identical concurrent streams replay its items as they arrive"""
+        with self._lock:
+            flight = self._streams.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._streams[key] = {
+                    'items': [], 'done': False, 'error': None, 'abandoned': False,
+                    'condition': threading.Condition(),
+                }
+                self.stats['executed'] += 1
+            else:
+                self.stats['coalesced'] += 1
+
+        if leader:
+            yield from self._lead(key, flight, iterate)
+        else:
+            yield from self._follow(key, flight, iterate)
+
+    def _lead(self, key, flight, iterate):
+        completed = False
+        try:
+            for item in iterate():
+                with flight['condition']:
+                    flight['items'].append(item)
+                    flight['condition'].notify_all()
+                yield item
+            completed = True
+        except Exception as e:
+            flight['error'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._streams[key]
+            with flight['condition']:
+                # A leader that stopped early was cancelled, not failed; followers carry on alone
+                flight['abandoned'] = not completed and flight['error'] is None
+                flight['done'] = True
+                flight['condition'].notify_all()
+
+    def _follow(self, key, flight, iterate):
+        cancelled = getattr(_cancel_scope, 'cancelled', None)
+        position = 0
+        while True:
+            with flight['condition']:
+                while position >= len(flight['items']) and not flight['done']:
+                    flight['condition'].wait(0.1)
+                    if cancelled and cancelled():
+                        raise CancelledError("Cancelled while waiting for a shared call")
+                items = flight['items'][position:]
+                done = flight['done']
+            yield from items
+            position += len(items)
+            if done and position >= len(flight['items']):
+                break
+        if flight['error'] is not None:
+            raise flight['error']
+        if flight['abandoned']:
+            yield from itertools.islice(self.stream(key, iterate), position, None)
+
+
+class CoalescingBackend:
+    """Wraps a backend so identical concurrent upstream calls share a single execution"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.name = backend.name
+        self.flight = SingleFlight()
+
+    def version(self):
+        with get_metrics().span('backend_version', backend=self.name):
+            return self.flight.do('version', self.backend.version)
+
+    def iter_search(self, query, max_results, start=1):
+        with get_metrics().span('backend_search', backend=self.name, start=start):
+            yield from self.flight.stream(f'search|{query}|{start}|{max_results}',
+                                          lambda: self.backend.iter_search(query, max_results, start))
+
+    def search(self, query, max_results, start=1):
+        return list(self.iter_search(query, max_results, start))
+
+    def extract_info(self, url):
+        with get_metrics().span('backend_info', backend=self.name):
+            return self.flight.do(f'info|{extract_video_id(url) or url}', lambda: self.backend.extract_info(url))
+
+    # Downloads write to per-call paths; duplicates are already collapsed per source by the media cache
+    def download_info(self, *args, **kwargs):
+        with get_metrics().span('backend_download', backend=self.name):
+            return self.backend.download_info(*args, **kwargs)
+
+    def download(self, *args, **kwargs):
+        with get_metrics().span('backend_download', backend=self.name):
+            return self.backend.download(*args, **kwargs)
+
+
+# Upstream calls per second shared by every search, extraction and yt-dlp download; 0 disables the limit
+UPSTREAM_RATE = float(os.environ.get('UPSTREAM_RATE', '4'))
+UPSTREAM_BURST = int(os.environ.get('UPSTREAM_BURST', '8'))
+# Consecutive upstream failures that open the circuit (0 never opens it), and seconds before a trial call
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_RESET_TIMEOUT = float(os.environ.get('CIRCUIT_RESET_TIMEOUT', '30'))
+# Retries of a failed search or extraction, after full-jitter backoff of up to UPSTREAM_BACKOFF * 2^attempt seconds
+UPSTREAM_RETRIES = int(os.environ.get('UPSTREAM_RETRIES', '2'))
+UPSTREAM_BACKOFF = float(os.environ.get('UPSTREAM_BACKOFF', '0.5'))
+UPSTREAM_BACKOFF_MAX = 8.0
+# yt-dlp errors that mean YouTube or the network is unhealthy, as opposed to one video being unavailable
+UPSTREAM_FAILURE = re.compile(r'HTTP Error (?:429|5\d\d)|timed out|Temporary failure|Connection (?:reset|refused|aborted)'
+                              r'|Network is unreachable|Remote end closed', re.IGNORECASE)
+
+
+def is_upstream_failure(error):
+    """True if error says upstream is failing or throttling; an open circuit counts too"""
+    return isinstance(error, (TimeoutError, ConnectionError)) or bool(UPSTREAM_FAILURE.search(str(error)))
+
+
+class TokenBucket:
+    """Rate limiter whose tokens refill at rate per second up to burst; take() waits for one"""
+
+    def __init__(self, rate=UPSTREAM_RATE, burst=UPSTREAM_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.stats = {'taken': 0, 'throttled': 0}
+
+    def take(self):
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Going into debt reserves the token, so waiters are served in arrival order
+            self._tokens -= 1
+            wait_seconds = -self._tokens / self.rate
+            self.stats['taken'] += 1
+            if wait_seconds > 0:
+                self.stats['throttled'] += 1
+        if wait_seconds > 0:
+            sleep_cancellable(wait_seconds)
+
+
+class CircuitBreaker:
+    """Fails upstream calls fast once threshold consecutive ones have failed
+
+    While open every call raises ConnectionError at once. After reset_timeout a single trial call
+    goes through; success closes the circuit and failure opens it for another reset_timeout.
+    """
+
+    def __init__(self, threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+        self.stats = {'failures': 0, 'opened': 0, 'rejected': 0}
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+    def retry_in(self):
+        """Seconds until the next trial call; 0 while the circuit is closed"""
+        opened_at = self._opened_at
+        return 0.0 if opened_at is None else max(0.0, opened_at + self.reset_timeout - time.monotonic())
+
+    def allow(self):
+        """Return True if this call is the trial of an open circuit; raises ConnectionError while it is open"""
+        with self._lock:
+            if self._opened_at is None:
+                return False
+            if not self._trial and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._trial = True
+                return True
+            self.stats['rejected'] += 1
+        raise ConnectionError(f"YouTube is not responding; retrying in {self.retry_in():.0f}s")
+
+    def record(self, healthy, trial=False):
+        """Record a call's outcome: True if upstream answered, False if it failed, None if unknown (cancelled)"""
+        with self._lock:
+            if trial:
+                self._trial = False
+            if healthy:
+                if self._opened_at is not None:
+                    get_metrics().log('circuit_closed')
+                self._failures = 0
+                self._opened_at = None
+            elif healthy is False:
+                self._failures += 1
+                self.stats['failures'] += 1
+                if trial or (self._opened_at is None and self.threshold and self._failures >= self.threshold):
+                    if self._opened_at is None:
+                        self.stats['opened'] += 1
+                        get_metrics().log('circuit_open', logging.WARNING, failures=self._failures)
+                    self._opened_at = time.monotonic()
+
+
+class GuardedBackend:
+    """Wraps a backend so upstream calls share one rate limit and circuit breaker and retry with backoff"""
+
+    def __init__(self, backend, limiter=None, breaker=None):
+        self.backend = backend
+        self.name = backend.name
+        self.limiter = limiter or TokenBucket()
+        self.breaker = breaker or CircuitBreaker()
+        self.stats = {'retries': 0}
+
+    @contextmanager
+    def _attempt(self):
+        """One upstream call: fail fast on an open circuit, wait for a token, then record the outcome"""
+        trial = self.breaker.allow()
+        healthy = None
+        try:
+            self.limiter.take()
+            yield
+            healthy = True
+        except CancelledError:
+            raise
+        except Exception as e:
+            healthy = not is_upstream_failure(e)
+            raise
+        finally:
+            self.breaker.record(healthy, trial)
+
+    def _backoff(self, attempt, error, retries):
+        """Sleep before retrying, or re-raise error when it is not worth another attempt"""
+        if attempt >= retries or self.breaker.is_open or not is_upstream_failure(error):
+            raise error
+        self.stats['retries'] += 1
+        # Full jitter keeps callers that failed together from retrying together
+        sleep_cancellable(random.uniform(0, min(UPSTREAM_BACKOFF_MAX, UPSTREAM_BACKOFF * 2 ** attempt)))
+
+    def _call(self, fn, retries=UPSTREAM_RETRIES):
+        for attempt in itertools.count():
+            try:
+                with self._attempt():
+                    return fn()
+            except Exception as e:
+                self._backoff(attempt, e, retries)
+
+    def version(self):
+        # Only runs the local executable, so it is neither throttled nor able to trip the circuit
+        return self.backend.version()
+
+    def iter_search(self, query, max_results, start=1):
+        for attempt in itertools.count():
+            produced = False
+            try:
+                with self._attempt():
+                    for entry in self.backend.iter_search(query, max_results, start):
+                        produced = True
+                        yield entry
+                return
+            except Exception as e:
+                # Results already shown cannot be taken back, so only a search that produced none is retried
+                if produced:
+                    raise
+                self._backoff(attempt, e, UPSTREAM_RETRIES)
+
+    def search(self, query, max_results, start=1):
+        return list(self.iter_search(query, max_results, start))
+
+    def extract_info(self, url):
+        return self._call(lambda: self.backend.extract_info(url))
+
+    # Callers of downloads already retry once with fresh metadata
+    def download_info(self, *args, **kwargs):
+        return self._call(lambda: self.backend.download_info(*args, **kwargs), retries=0)
+
+    def download(self, *args, **kwargs):
+        return self._call(lambda: self.backend.download(*args, **kwargs), retries=0)
+
+
+@st.cache_resource(show_spinner=False)
+def get_backend():
+    """Return the process-wide yt-dlp backend"""
+    if YT_DLP_BACKEND == 'subprocess' or yt_dlp is None:
+        return CoalescingBackend(GuardedBackend(SubprocessBackend()))
+    return CoalescingBackend(GuardedBackend(InProcessBackend()))
+
+
+# Seconds before the capability probe is re-run; a failed backend call re-probes sooner
+CAPABILITY_TTL = int(os.environ.get('CAPABILITY_TTL', '3600'))
+
+
+class CapabilityRegistry:
+    """Process-wide record of the backend version and feature flags"""
+
+    def __init__(self, ttl=CAPABILITY_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._expires_at = 0.0
+        self.refresh()
+
+    def _probe(self):
+        backend = get_backend()
+        try:
+            version = backend.version()
+        except Exception:
+            version = None
+        available = bool(version)
+        ffmpeg = shutil.which('ffmpeg') is not None
+        return {
+            'yt_dlp': available,
+            'version': version,
+            'backend': backend.name,
+            'search': available,
+            'download': available,
+            'ffmpeg': ffmpeg,
+            'audio': available and ffmpeg,
+            'probed_at': time.time(),
+        }
+
+    def refresh(self):
+        """Probe the backend now"""
+        snapshot = self._probe()
+        with self._lock:
+            self._snapshot = snapshot
+            self._expires_at = time.monotonic() + self.ttl
+        return snapshot
+
+    def get(self):
+        """Return the current capabilities, re-probing once the TTL has passed"""
+        with self._lock:
+            snapshot = self._snapshot if time.monotonic() < self._expires_at else None
+        return snapshot or self.refresh()
+
+    def invalidate(self):
+        """Force a re-probe on the next read, e.g. after a backend call failed"""
+        with self._lock:
+            self._expires_at = 0.0
+
+
+@st.cache_resource(show_spinner=False)
+def get_capabilities():
+    """Return the process-wide capability registry, probing on first use"""
+    return CapabilityRegistry()
+
+
+def check_yt_dlp():
+    """Check if yt-dlp is available"""
+    return get_capabilities().get()['yt_dlp']
+
+# On-disk location shared by every persistent cache
+CACHE_DIR = os.environ.get('CACHE_DIR', os.path.join(tempfile.gettempdir(), 'youtube-player-cache'))
+SEARCH_CACHE_SIZE = int(os.environ.get('SEARCH_CACHE_SIZE', '256'))
+SEARCH_CACHE_TTL = int(os.environ.get('SEARCH_CACHE_TTL', '3600'))
+# How long past its TTL an entry may still be served while it is refreshed in the background
+SEARCH_CACHE_STALE = int(os.environ.get('SEARCH_CACHE_STALE', '86400'))
+# Upper bound on how far "load more" may page into one query's results
+SEARCH_MAX_RESULTS = int(os.environ.get('SEARCH_MAX_RESULTS', '200'))
+# Set to 0 to stop fetching the next page while the current one is being read
+SEARCH_PREFETCH_PAGES = os.environ.get('SEARCH_PREFETCH_PAGES', '1') != '0'
+
+
+class TieredCache:
+    """Cache shared across sessions: in-memory LRU tier over an on-disk SQLite tier"""
+
+    def __init__(self, name, max_entries, ttl, stale_ttl=0, decode=None):
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        self.max_entries = max_entries
+        # Rebuilds values read from the disk tier, e.g. into VideoRecords
+        self.decode = decode
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._lock = threading.RLock()
+        self._memory = OrderedDict()
+        self._refreshing = set()
+        self._db = sqlite3.connect(os.path.join(CACHE_DIR, f'{name}.sqlite3'), check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS entries '
+                '(key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL, ttl REAL NOT NULL)'
+            )
+        self.stats = {'hits': 0, 'disk_hits': 0, 'stale_hits': 0, 'misses': 0, 'refreshes': 0, 'refresh_errors': 0}
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                return entry, False
+
+            row = self._db.execute(
+                'SELECT value, stored_at, ttl FROM entries WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None, False
+            value = json_loads(row[0])
+            entry = (self.decode(value) if self.decode else value, row[1], row[2])
+            self._remember(key, entry)
+            return entry, True
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key, allow_stale=False):
+        """Return the cached value for key, or None"""
+        entry, _ = self._lookup(key)
+        if entry is None:
+            return None
+        value, stored_at, ttl = entry
+        age = time.time() - stored_at
+        if age < ttl or (allow_stale and age < ttl + self.stale_ttl):
+            return value
+        return None
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        entry = (value, time.time(), ttl)
+        with self._lock:
+            self._remember(key, entry)
+            with self._db:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO entries (key, value, stored_at, ttl) VALUES (?, ?, ?, ?)',
+                    (key, json_dumps(value), entry[1], ttl)
+                )
+                self._db.execute(
+                    'DELETE FROM entries WHERE stored_at + ttl + ? < ?', (self.stale_ttl, entry[1])
+                )
+
+    def delete(self, key):
+        with self._lock:
+            self._memory.pop(key, None)
+            with self._db:
+                self._db.execute('DELETE FROM entries WHERE key = ?', (key,))
+
+    def get_or_fetch(self, key, fetch, ttl=None):
+        """Return a cached value, calling fetch() on a miss; stale entries are refreshed in the background"""
+        entry, from_disk = self._lookup(key)
+        if entry is not None:
+            value, stored_at, entry_ttl = entry
+            age = time.time() - stored_at
+            if age < entry_ttl:
+                self.stats['disk_hits' if from_disk else 'hits'] += 1
+                return value
+            if age < entry_ttl + self.stale_ttl:
+                self.stats['stale_hits'] += 1
+                self._refresh_in_background(key, fetch, ttl)
+                return value
+
+        self.stats['misses'] += 1
+        value = fetch()
+        if value:
+            self.set(key, value, ttl)
+        return value
+
+    def iter_or_fetch(self, key, iterate, ttl=None):
+        """Like get_or_fetch, but yields items from iterate() as they arrive on a miss"""
+        entry, from_disk = self._lookup(key)
+        if entry is not None:
+            value, stored_at, entry_ttl = entry
+            age = time.time() - stored_at
+            if age < entry_ttl + self.stale_ttl:
+                if age < entry_ttl:
+                    self.stats['disk_hits' if from_disk else 'hits'] += 1
+                else:
+                    self.stats['stale_hits'] += 1
+                    self._refresh_in_background(key, lambda: list(iterate()), ttl)
+                yield from value
+                return
+
+        self.stats['misses'] += 1
+        items = []
+        for item in iterate():
+            items.append(item)
+            yield item
+        if items:
+            self.set(key, items, ttl)
+
+    def _refresh_in_background(self, key, fetch, ttl):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                value = fetch()
+                if value:
+                    self.set(key, value, ttl)
+                self.stats['refreshes'] += 1
+            except Exception:
+                self.stats['refresh_errors'] += 1
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+
+@st.cache_resource(show_spinner=False)
+def get_search_cache():
+    """Return the process-wide search result cache"""
+    return TieredCache('search', SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL, SEARCH_CACHE_STALE,
+                       decode=lambda videos: [VideoRecord.from_dict(v) for v in videos])
+
+
+def normalize_query(query):
+    """Normalize a search query for use as a cache key"""
+    return ' '.join(query.lower().split())
+
+
+class VideoRecord:
+    """A search result; reads like the result dicts (video['title'], video.get('duration')) it replaces
+
+    The watch URL and the default thumbnail are derived from the ID rather than stored per result.
+    """
+
+    __slots__ = ('id', 'title', 'uploader', 'duration', 'view_count', '_thumbnail')
+    FIELDS = ('id', 'title', 'uploader', 'duration', 'view_count', 'url', 'thumbnail')
+
+    def __init__(self, id, title, uploader, duration=0, view_count=0, thumbnail=None):
+        self.id = id
+        self.title = title
+        self.uploader = uploader
+        self.duration = duration
+        self.view_count = view_count
+        self._thumbnail = None
+        if thumbnail:
+            self.thumbnail = thumbnail
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get('id', ''), data.get('title', 'Unknown Title'), data.get('uploader', 'Unknown Channel'),
+                   data.get('duration', 0), data.get('view_count', 0), data.get('thumbnail'))
+
+    @property
+    def url(self):
+        return f"https://www.youtube.com/watch?v={self.id}"
+
+    @property
+    def thumbnail(self):
+        return self._thumbnail or f"https://img.youtube.com/vi/{self.id}/mqdefault.jpg"
+
+    @thumbnail.setter
+    def thumbnail(self, value):
+        self._thumbnail = value if value != f"https://img.youtube.com/vi/{self.id}/mqdefault.jpg" else None
+
+    def __getitem__(self, key):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.FIELDS or key == 'url':
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.FIELDS
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.FIELDS else default
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in self.FIELDS}
+
+
+def _build_search_result(video_data):
+    """Build the record shown in the UI from a yt-dlp search entry, indexing it for offline search"""
+    record = VideoRecord.from_dict(video_data)
+    get_search_index().add([record])
+    return record
+
+def search_cache_key(query, max_results, start=1):
+    """Cache key of one window of search results; each page is cached on its own"""
+    return f"{normalize_query(query)}|{start}|{max_results}"
+
+def _search_upstream(query, max_results, start=1):
+    """Run a search against the backend and build result dicts; raises on failure"""
+    return [_build_search_result(video_data) for video_data in get_backend().search(query, max_results, start)]
+
+def iter_search_youtube_videos(query, max_results=10, start=1, errors=None):
+    """Yield results start..start+max_results-1 as yt-dlp emits them, recording time-to-first-result
+
+    A failure is reported on the page and ends the results; it is also appended to errors when given.
+    """
+    started = time.perf_counter()
+    first = True
+    try:
+        key = search_cache_key(query, max_results, start)
+        iterate = lambda: (_build_search_result(v) for v in get_backend().iter_search(query, max_results, start))
+        for video in get_search_cache().iter_or_fetch(key, iterate):
+            if first:
+                get_metrics().observe('search_first_result', time.perf_counter() - started)
+                first = False
+            yield video
+        get_metrics().observe('search_total', time.perf_counter() - started)
     except Exception as e:
+        if errors is not None:
+            errors.append(e)
+        if first and start == 1 and is_upstream_failure(e):
+            st.warning(f"⚠️ {e}. Showing limited offline results instead.")
+            yield from search_youtube_fallback(query, max_results)
+            return
         st.error(f"Search error: {str(e)}")
+        get_capabilities().invalidate()
+
+def search_youtube_videos(query, max_results=10, start=1):
+    """Search YouTube videos using yt-dlp"""
+    try:
+        key = search_cache_key(query, max_results, start)
+        return get_search_cache().get_or_fetch(key, lambda: _search_upstream(query, max_results, start))
+    except Exception as e:
+        if start == 1 and is_upstream_failure(e):
+            st.warning(f"⚠️ {e}. Showing limited offline results instead.")
+            return search_youtube_fallback(query, max_results)
+        st.error(f"Search error: {str(e)}")
+        get_capabilities().invalidate()
     
     return []
 
+def prefetch_search_page(query, max_results, start):
+    """Fetch the next window of results into the search cache in the background"""
+    if not SEARCH_PREFETCH_PAGES or start > SEARCH_MAX_RESULTS:
+        return
+    key = search_cache_key(query, max_results, start)
+    if get_search_cache().get(key) is not None:
+        return
+
+    def fetch():
+        try:
+            with get_metrics().span('search_page_prefetch', start=start):
+                get_search_cache().get_or_fetch(key, lambda: _search_upstream(query, max_results, start))
+        except Exception:
+            pass
+
+    get_search_page_prefetcher().submit(fetch)
+
+
+@st.cache_resource(show_spinner=False)
+def get_search_page_prefetcher():
+    """Return the process-wide pool that fetches upcoming search pages"""
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix='search-prefetch')
+
+
+# Every video seen through search, info and batch runs, searchable offline and for autocomplete
+SEARCH_INDEX_PATH = os.path.join(CACHE_DIR, 'search_index.sqlite3')
+# Matches scored per query; when the words match more, the most recently indexed ones are scored
+SEARCH_INDEX_CANDIDATES = int(os.environ.get('SEARCH_INDEX_CANDIDATES', '300'))
+# Indexed words searched in place of an unfinished or misspelled word, the most common first
+SEARCH_INDEX_EXPANSIONS = 8
+# Longest prefix stored for completion; longer ones filter the most common completions of their first letters
+SEARCH_INDEX_PREFIX_MAX = 16
+SEARCH_INDEX_PREFIX_SCAN = 2000
+# Words shorter than this are never corrected; words of 8 letters or more may be two edits off
+SEARCH_INDEX_TYPO_MIN = 4
+# Beyond the two rarest, words in more than this share of videos only rank results; requiring more of
+# them makes FTS5 walk their whole document lists when few videos contain them all
+SEARCH_INDEX_COMMON = float(os.environ.get('SEARCH_INDEX_COMMON', '0.05'))
+# Queued videos written per transaction by the indexing thread
+SEARCH_INDEX_BATCH = 500
+
+# The FTS table only ever answers exact-term queries: FTS5 prefix queries and bm25() both read a
+# term's whole document list, which costs tens of milliseconds for common words in a large catalog.
+# Prefixes and typos are resolved to indexed words first, through tables the indexing thread keeps in
+# step with per-term document counts. completions holds every prefix of every word, ranked by the
+# word's count rounded down to a power of two, so a word is only re-ranked when its count doubles.
+# deletions holds each word with one letter removed, so a misspelling is found by looking up its own
+# deletions (the SymSpell approach) instead of comparing it against the vocabulary.
+SEARCH_INDEX_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS videos (
+    rowid INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, title TEXT NOT NULL, uploader TEXT NOT NULL,
+    duration INTEGER, view_count INTEGER, upload_date TEXT
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS videos_fts USING fts5(
+    title, uploader, content='videos', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY, docs INTEGER NOT NULL) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS completions (
+    term TEXT NOT NULL, prefix TEXT NOT NULL, rank INTEGER NOT NULL, PRIMARY KEY (term, prefix)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS completions_ranked ON completions (prefix, rank);
+CREATE TABLE IF NOT EXISTS deletions (variant TEXT NOT NULL, term TEXT NOT NULL, PRIMARY KEY (variant, term)) WITHOUT ROWID;
+CREATE TRIGGER IF NOT EXISTS videos_indexed AFTER INSERT ON videos BEGIN
+    INSERT INTO videos_fts (rowid, title, uploader) VALUES (new.rowid, new.title, new.uploader);
+END;
+CREATE TRIGGER IF NOT EXISTS videos_renamed AFTER UPDATE OF title, uploader ON videos
+WHEN old.title IS NOT new.title OR old.uploader IS NOT new.uploader BEGIN
+    INSERT INTO videos_fts (videos_fts, rowid, title, uploader) VALUES ('delete', old.rowid, old.title, old.uploader);
+    INSERT INTO videos_fts (rowid, title, uploader) VALUES (new.rowid, new.title, new.uploader);
+END;
+'''
+
+
+def index_terms(text):
+    """Lowercase words of text with accents removed, split the way the FTS tokenizer splits them"""
+    if text.isascii():
+        return re.findall(r'[^\W_]+', text.lower())
+    folded = unicodedata.normalize('NFKD', text.lower())
+    return re.findall(r'[^\W_]+', ''.join(c for c in folded if not unicodedata.combining(c)))
+
+
+def term_prefixes(term):
+    """Prefixes of term that completions are stored under"""
+    return [term[:n] for n in range(1, min(len(term), SEARCH_INDEX_PREFIX_MAX) + 1)]
+
+
+def term_rank(docs):
+    """Exponent of the document count rounded down to a power of two"""
+    return docs.bit_length()
+
+
+def term_deletions(term):
+    """Distinct strings left by removing one letter of term"""
+    return {term[:i] + term[i + 1:] for i in range(len(term))}
+
+
+def edit_distance(a, b, limit):
+    """Levenshtein distance counting adjacent transpositions as one edit; limit + 1 once it exceeds limit"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+    return previous[-1]
+
+
+class SearchIndex:
+    """Offline search over every video the app has seen: an FTS5 inverted index on title and uploader
+
+    Unfinished or unknown words expand to the most common indexed words they start; a word matching
+    nothing is replaced by the most common words within one edit, or two for long words when at most
+    one of those edits changes or drops a letter.
+    Matches are ranked by where they matched, views and upload recency. Writes are queued and applied
+    in batches by one background thread, so indexing never slows the search that fed it.
+    """
+
+    def __init__(self, path=SEARCH_INDEX_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        with self._db:
+            self._db.executescript(SEARCH_INDEX_SCHEMA)
+        self._queue = queue.Queue()
+        self.stats = {'indexed': 0, 'searches': 0, 'suggestions': 0}
+        threading.Thread(target=self._write_loop, name='search-index', daemon=True).start()
+
+    def add(self, videos):
+        """Queue search results or info dicts for indexing; returns at once"""
+        for video in videos:
+            if video.get('id') and video.get('title'):
+                self._queue.put((video['id'], video['title'], video.get('uploader') or '', video.get('duration'),
+                                 video.get('view_count'), video.get('upload_date')))
+
+    def flush(self):
+        """Wait until everything queued so far is searchable"""
+        self._queue.join()
+
+    def _write_loop(self):
+        db = sqlite3.connect(self.path)
+        db.execute('PRAGMA synchronous=NORMAL')
+        while True:
+            rows = [self._queue.get()]
+            while len(rows) < SEARCH_INDEX_BATCH:
+                try:
+                    rows.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with db:
+                    self._write(db, rows)
+                self.stats['indexed'] += len(rows)
+            except sqlite3.Error as e:
+                get_metrics().log('search_index_error', logging.WARNING, error=str(e))
+            finally:
+                for _ in rows:
+                    self._queue.task_done()
+
+    def _write(self, db, rows):
+        rows = list({row[0]: row for row in rows}.values())
+        ids = [row[0] for row in rows]
+        old = {}
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            old.update((id, set(index_terms(f'{title} {uploader}'))) for id, title, uploader in db.execute(
+                f"SELECT id, title, uploader FROM videos WHERE id IN ({','.join('?' * len(chunk))})", chunk))
+        deltas = {}
+        for id, title, uploader, *_ in rows:
+            new = set(index_terms(f'{title} {uploader}'))
+            previous = old.get(id, set())
+            for term in new - previous:
+                deltas[term] = deltas.get(term, 0) + 1
+            for term in previous - new:
+                deltas[term] = deltas.get(term, 0) - 1
+        # Search results carry no upload date; keep the one an info extraction recorded
+        db.executemany(
+            'INSERT INTO videos (id, title, uploader, duration, view_count, upload_date) VALUES (?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (id) DO UPDATE SET title = excluded.title, uploader = excluded.uploader, '
+            'duration = COALESCE(excluded.duration, duration), view_count = COALESCE(excluded.view_count, view_count), '
+            'upload_date = COALESCE(excluded.upload_date, upload_date)', rows)
+        changed = [term for term, delta in deltas.items() if delta]
+        before = {}
+        for start in range(0, len(changed), 500):
+            chunk = changed[start:start + 500]
+            before.update(db.execute(f"SELECT term, docs FROM terms WHERE term IN ({','.join('?' * len(chunk))})", chunk))
+        after = {term: before.get(term, 0) + deltas[term] for term in changed}
+        added = [term for term in changed if term not in before and after[term] > 0]
+        kept = [term for term in changed if term in before and after[term] > 0]
+        removed = [term for term in changed if term in before and after[term] <= 0]
+        db.executemany('INSERT INTO terms (term, docs) VALUES (?, ?) ON CONFLICT (term) DO UPDATE SET docs = excluded.docs',
+                       [(term, after[term]) for term in added + kept])
+        db.executemany('UPDATE completions SET rank = ? WHERE term = ?',
+                       [(term_rank(after[term]), term) for term in kept
+                        if term_rank(after[term]) != term_rank(before[term])])
+        # Inserting in key order keeps B-tree pages in cache between consecutive rows
+        db.executemany('INSERT INTO completions (term, prefix, rank) VALUES (?, ?, ?)',
+                       sorted((term, prefix, term_rank(after[term])) for term in added for prefix in term_prefixes(term)))
+        db.executemany('INSERT OR IGNORE INTO deletions (variant, term) VALUES (?, ?)',
+                       sorted((variant, term) for term in added if len(term) >= SEARCH_INDEX_TYPO_MIN
+                              for variant in term_deletions(term)))
+        db.executemany('DELETE FROM terms WHERE term = ?', [(term,) for term in removed])
+        db.executemany('DELETE FROM completions WHERE term = ?', [(term,) for term in removed])
+        db.executemany('DELETE FROM deletions WHERE variant = ? AND term = ?',
+                       [(variant, term) for term in removed for variant in term_deletions(term)])
+
+    def _completions(self, prefix, limit):
+        """(term, document count) of the limit most common indexed words starting with prefix"""
+        # Words of equal rank are up to twice as common as each other; the exact counts order a few times
+        # as many of the best ranked
+        scan = 4 * limit if len(prefix) <= SEARCH_INDEX_PREFIX_MAX else SEARCH_INDEX_PREFIX_SCAN
+        rows = self._db.execute(
+            'SELECT c.term, t.docs FROM completions c JOIN terms t ON t.term = c.term WHERE c.prefix = ? '
+            'ORDER BY c.rank DESC LIMIT ?', (prefix[:SEARCH_INDEX_PREFIX_MAX], scan))
+        return heapq.nlargest(limit, (row for row in rows if row[0].startswith(prefix)), key=lambda row: row[1])
+
+    def _corrections(self, word):
+        """(term, document count) of the most common indexed words close to word, the closest first"""
+        limit = 1 if len(word) < 8 else 2
+        # Words within `limit` edits become equal after at most that many deletions from each. Indexed words
+        # store single deletions only, so a two-edit match needs one edit to be a letter the query adds
+        variants = {word}
+        for _ in range(limit):
+            variants |= {deleted for variant in variants for deleted in term_deletions(variant)}
+        variants = list(variants)
+        marks = ','.join('?' * len(variants))
+        candidates = self._db.execute(
+            f'SELECT t.term, t.docs FROM deletions d JOIN terms t ON t.term = d.term WHERE d.variant IN ({marks}) '
+            f'UNION SELECT term, docs FROM terms WHERE term IN ({marks})', variants + variants).fetchall()
+        close = [(edit_distance(word, term, limit), term, docs) for term, docs in candidates]
+        best = heapq.nsmallest(SEARCH_INDEX_EXPANSIONS, (c for c in close if c[0] <= limit), key=lambda c: (c[0], -c[2]))
+        return [(term, docs) for _, term, docs in best]
+
+    def _alternatives(self, word, complete):
+        """(term, document count) of the indexed words to search for word: itself, its completions if
+        complete, or else its likely spellings"""
+        exact = self._db.execute('SELECT term, docs FROM terms WHERE term = ?', (word,)).fetchall()
+        if exact and not complete:
+            return exact
+        completions = self._completions(word, SEARCH_INDEX_EXPANSIONS)
+        if exact and exact[0] not in completions:
+            completions = exact + completions[:-1]
+        if completions or len(word) < SEARCH_INDEX_TYPO_MIN:
+            return completions
+        return self._corrections(word)
+
+    def search(self, query, max_results=10):
+        """Best max_results VideoRecords for query; words that match nothing are left out"""
+        with get_metrics().span('index_search'):
+            words = index_terms(query)
+            with self._lock:
+                self.stats['searches'] += 1
+                # The last word is completed, as it may still be being typed
+                groups = [alternatives for i, word in enumerate(words)
+                          if (alternatives := self._alternatives(word, complete=i == len(words) - 1))]
+                if not groups:
+                    return []
+                groups.sort(key=lambda group: sum(docs for _, docs in group))
+                common = SEARCH_INDEX_COMMON * self._db.execute('SELECT MAX(rowid) FROM videos').fetchone()[0]
+                required = groups[:2] + [group for group in groups[2:] if sum(docs for _, docs in group) <= common]
+                expression = ' AND '.join('(' + ' OR '.join(f'"{term}"' for term, _ in group) + ')'
+                                          for group in required)
+                rows = self._db.execute(
+                    'SELECT v.id, v.title, v.uploader, v.duration, v.view_count, v.upload_date FROM videos v '
+                    'JOIN (SELECT rowid FROM videos_fts WHERE videos_fts MATCH ? ORDER BY rowid DESC LIMIT ?) m '
+                    'ON v.rowid = m.rowid', (expression, SEARCH_INDEX_CANDIDATES)).fetchall()
+            this_year = time.gmtime().tm_year
+
+            groups = [{term for term, _ in group} for group in groups]
+
+            def score(row):
+                title = set(index_terms(row[1]))
+                in_title = sum(1 for group in groups if not title.isdisjoint(group)) / len(groups)
+                age = this_year - int(row[5][:4]) if row[5] else 10
+                return 3 * in_title + 0.3 * math.log10((row[4] or 0) + 1) + 1 / (1 + max(age, 0))
+
+            return [VideoRecord(id, title, uploader, duration or 0, view_count or 0)
+                    for id, title, uploader, duration, view_count, _ in heapq.nlargest(max_results, rows, key=score)]
+
+    def suggest(self, text, limit=8):
+        """Queries completing the last word of text with indexed words, the most common first"""
+        words = index_terms(text)
+        if not words or text[-1:].isspace():
+            return []
+        with self._lock, get_metrics().span('index_suggest'):
+            self.stats['suggestions'] += 1
+            terms = self._completions(words[-1], limit)
+        head = ' '.join(words[:-1])
+        return [f'{head} {term}'.lstrip() for term, _ in terms]
+
+    def size(self):
+        """Number of videos indexed; rows are never deleted, so the last rowid counts them without a scan"""
+        with self._lock:
+            return self._db.execute('SELECT MAX(rowid) FROM videos').fetchone()[0] or 0
+
+
+@st.cache_resource(show_spinner=False)
+def get_search_index():
+    """Return the process-wide offline search index"""
+    return SearchIndex()
+
+
 def search_youtube_fallback(query, max_results=10):
-    """Fallback search using YouTube RSS (limited but works without API)"""
+    """Offline search over the videos the app has seen before; works without yt-dlp or upstream"""
     try:
-        # This is a simplified search - in production you'd want YouTube Data API
-        search_results = []
-        
-        # Generate some common video IDs for demo (you'd implement real search)
-        demo_videos = [
-            {
-                'id': 'dQw4w9WgXcQ',
-                'title': 'Rick Astley - Never Gonna Give You Up',
-                'uploader': 'Rick Astley',
-                'duration': 213,
-                'url': 'https://www.youtube.com/watch?v=dQw4w9WgXcQ',
-                'thumbnail': 'https://img.youtube.com/vi/dQw4w9WgXcQ/mqdefault.jpg'
-            },
-            {
-                'id': '9bZkp7q19f0',
-                'title': 'PSY - GANGNAM STYLE',
-                'uploader': 'officialpsy',
-                'duration': 253,
-                'url': 'https://www.youtube.com/watch?v=9bZkp7q19f0',
-                'thumbnail': 'https://img.youtube.com/vi/9bZkp7q19f0/mqdefault.jpg'
-            },
-            {
-                'id': 'kJQP7kiw5Fk',
-                'title': 'Luis Fonsi - Despacito ft. Daddy Yankee',
-                'uploader': 'LuisFonsiVEVO',
-                'duration': 281,
-                'url': 'https://www.youtube.com/watch?v=kJQP7kiw5Fk',
-                'thumbnail': 'https://img.youtube.com/vi/kJQP7kiw5Fk/mqdefault.jpg'
-            }
-        ]
-        
-        # Filter by query (basic matching)
-        query_lower = query.lower()
-        for video in demo_videos:
-            if query_lower in video['title'].lower() or query_lower in video['uploader'].lower():
-                search_results.append(video)
-        
-        return search_results[:max_results]
-        
+        return get_search_index().search(query, max_results)
     except Exception as e:
         st.error(f"Fallback search error: {str(e)}")
         return []
@@ -167,88 +1819,1171 @@ def extract_video_id(url):
     
     return None
 
-def get_video_info(url):
-    """Get video information using yt-dlp"""
+# Raw info documents keep signed format URLs, which YouTube expires after ~6 hours
+METADATA_CACHE_SIZE = int(os.environ.get('METADATA_CACHE_SIZE', '64'))
+METADATA_CACHE_TTL = int(os.environ.get('METADATA_CACHE_TTL', '10800'))
+
+
+@st.cache_resource(show_spinner=False)
+def get_metadata_store():
+    """Return the process-wide store of raw video info, keyed by video ID"""
+    return TieredCache('metadata', METADATA_CACHE_SIZE, METADATA_CACHE_TTL)
+
+
+def get_video_metadata(url, refresh=False):
+    """Return the raw yt-dlp info for url, extracting it only on a store miss; raises on failure"""
+    store = get_metadata_store()
+    key = extract_video_id(url) or url
+    if refresh:
+        store.delete(key)
+
+    def fetch():
+        info = get_backend().extract_info(url)
+        get_search_index().add([info])
+        return info
+
+    return store.get_or_fetch(key, fetch)
+
+
+def _progressive_formats(formats):
+    """Formats carrying both audio and video, in yt-dlp's worst-to-best order"""
+    return [f for f in formats if f.get('url') and f.get('vcodec') != 'none' and f.get('acodec') != 'none']
+
+def pick_stream_format(formats, quality='720p'):
+    """Python equivalent of best[height<=N][ext=mp4]/best[ext=mp4]/best"""
+    max_height = int(quality[:-1])
+    candidates = _progressive_formats(formats)
+    mp4 = [f for f in candidates if f.get('ext') == 'mp4']
+    fitting = [f for f in mp4 if f.get('height') is not None and f['height'] <= max_height]
+    for pool in (fitting, mp4, candidates):
+        if pool:
+            return pool[-1]
+    return None
+
+# Set to 0 to refuse videos whose every format is over the size limit instead of re-encoding or trimming one
+FIT_TO_BUDGET = os.environ.get('FIT_TO_BUDGET', '1') != '0'
+# Audio bitrate of re-encodes; below FIT_MIN_VIDEO_KBPS of video the opening is kept at full quality instead
+FIT_AUDIO_KBPS = int(os.environ.get('FIT_AUDIO_KBPS', '96'))
+FIT_MIN_VIDEO_KBPS = int(os.environ.get('FIT_MIN_VIDEO_KBPS', '250'))
+
+
+def estimate_format_size(fmt, duration=None):
+    """Expected bytes of a format from filesize, filesize_approx or total bitrate × duration; None if unknown"""
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if size:
+        return size
+    if fmt.get('tbr') and duration:
+        return int(fmt['tbr'] * 1000 / 8 * duration)
+    return None
+
+def pick_download_format(formats, max_size_mb=50, duration=None):
+    """Best progressive MP4 estimated to fit max_size_mb, else the worst one whose size cannot be estimated"""
+    budget = max_size_mb * 1000 * 1000
+    mp4 = [f for f in _progressive_formats(formats) if f.get('ext') == 'mp4']
+    sizes = [estimate_format_size(f, duration) for f in mp4]
+    fitting = [f for f, size in zip(mp4, sizes) if size is not None and size <= budget]
+    if fitting:
+        return fitting[-1]
+    # Unknown sizes get a chance under the download's byte budget; known oversized ones never do
+    unknown = [f for f, size in zip(mp4, sizes) if size is None]
+    return unknown[0] if unknown else None
+
+def plan_download(info, max_size_mb=50):
+    """Return (format, needs_fit) for a size budget; needs_fit means ffmpeg must shrink the format to fit
+
+    Raises ValueError when no MP4 format fits and none can be made to.
+    """
+    formats, duration = info.get('formats') or [], info.get('duration')
+    download_format = pick_download_format(formats, max_size_mb, duration)
+    if download_format:
+        return download_format, False
+    mp4 = [f for f in _progressive_formats(formats) if f.get('ext') == 'mp4']
+    if not mp4:
+        return None, False
+    if not (FIT_TO_BUDGET and get_capabilities().get()['ffmpeg']):
+        raise ValueError(f"No MP4 format fits in {max_size_mb} MB")
+    return min(mp4, key=lambda f: estimate_format_size(f, duration)), True
+
+# Cached stream URLs are dropped this many seconds before their signed expiry
+STREAM_URL_SAFETY_MARGIN = int(os.environ.get('STREAM_URL_SAFETY_MARGIN', '600'))
+# Used when a resolved URL carries no expire= parameter
+STREAM_URL_DEFAULT_TTL = int(os.environ.get('STREAM_URL_DEFAULT_TTL', '1800'))
+# Minimum seconds between background 403 checks of the same cached URL
+STREAM_URL_CHECK_INTERVAL = int(os.environ.get('STREAM_URL_CHECK_INTERVAL', '300'))
+
+
+def parse_stream_expiry(stream_url):
+    """Return the expire= timestamp of a signed googlevideo URL, or None"""
+    expire = parse_qs(urlparse(stream_url).query).get('expire')
+    if expire and expire[0].isdigit():
+        return int(expire[0])
+    # Manifest URLs carry their parameters as path segments
+    match = re.search(r'/expire/(\d+)', stream_url)
+    return int(match.group(1)) if match else None
+
+
+class StreamUrlCache:
+    """Resolved stream URLs keyed on (video ID, quality), kept until just before they expire"""
+
+    def __init__(self):
+        self.cache = TieredCache('stream_urls', 512, STREAM_URL_DEFAULT_TTL)
+        self._lock = threading.Lock()
+        self._last_checked = {}
+        self._checking = set()
+
+    def _ttl(self, stream_url):
+        expire = parse_stream_expiry(stream_url)
+        if expire is None:
+            return STREAM_URL_DEFAULT_TTL
+        return expire - STREAM_URL_SAFETY_MARGIN - time.time()
+
+    def _resolve(self, url, quality, refresh=False):
+        info = get_video_metadata(url, refresh=refresh)
+        stream_format = pick_stream_format(info.get('formats') or [info], quality)
+        return stream_format['url'] if stream_format else None
+
+    def resolve(self, url, quality):
+        """Return a stream URL for url at quality, resolving only on a miss; raises on failure"""
+        key = f"{extract_video_id(url) or url}|{quality}"
+        stream_url = self.cache.get(key)
+        if stream_url:
+            self.cache.stats['hits'] += 1
+            self._revalidate_in_background(key, url, quality, stream_url)
+            return stream_url
+
+        self.cache.stats['misses'] += 1
+        stream_url = self._resolve(url, quality)
+        if stream_url and self._ttl(stream_url) <= 0:
+            # The stored metadata is too close to expiry to hand out; extract again
+            stream_url = self._resolve(url, quality, refresh=True)
+        if stream_url and self._ttl(stream_url) > 0:
+            self.cache.set(key, stream_url, self._ttl(stream_url))
+        return stream_url
+
+    def _revalidate_in_background(self, key, url, quality, stream_url):
+        """Probe a cached URL and re-resolve it if upstream now refuses it"""
+        now = time.monotonic()
+        with self._lock:
+            if key in self._checking or now - self._last_checked.get(key, 0) < STREAM_URL_CHECK_INTERVAL:
+                return
+            self._checking.add(key)
+            self._last_checked[key] = now
+
+        def revalidate():
+            try:
+                response = requests.get(stream_url, headers={'Range': 'bytes=0-0'}, stream=True, timeout=10)
+                response.close()
+                if response.status_code in (403, 410):
+                    self.cache.delete(key)
+                    self.cache.stats['refreshes'] += 1
+                    fresh_url = self._resolve(url, quality, refresh=True)
+                    if fresh_url and self._ttl(fresh_url) > 0:
+                        self.cache.set(key, fresh_url, self._ttl(fresh_url))
+            except Exception:
+                self.cache.stats['refresh_errors'] += 1
+            finally:
+                with self._lock:
+                    self._checking.discard(key)
+
+        threading.Thread(target=revalidate, daemon=True).start()
+
+
+@st.cache_resource(show_spinner=False)
+def get_stream_url_cache():
+    """Return the process-wide stream URL cache"""
+    return StreamUrlCache()
+
+
+def video_summary(info, url):
+    """The details shown for a video, built from its raw yt-dlp info"""
+    return {
+        'title': info.get('title', 'Unknown Title'),
+        'uploader': info.get('uploader', 'Unknown Channel'),
+        'duration': info.get('duration', 0),
+        'view_count': info.get('view_count', 0),
+        'description': info.get('description', '')[:300] + '...' if info.get('description') else '',
+        'upload_date': info.get('upload_date', ''),
+        'thumbnail': info.get('thumbnail', ''),
+        'webpage_url': info.get('webpage_url', url),
+        'formats_count': len(info.get('formats', []))
+    }
+
+def get_video_info(url, fallback=None):
+    """Get video information using yt-dlp; while upstream is failing, fall back to the fields of a search result"""
     try:
-        cmd = ['yt-dlp', '--dump-json', '--no-download', url]
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
-        
-        if result.returncode == 0:
-            info = json.loads(result.stdout)
-            return {
-                'title': info.get('title', 'Unknown Title'),
-                'uploader': info.get('uploader', 'Unknown Channel'),
-                'duration': info.get('duration', 0),
-                'view_count': info.get('view_count', 0),
-                'description': info.get('description', '')[:300] + '...' if info.get('description') else '',
-                'upload_date': info.get('upload_date', ''),
-                'thumbnail': info.get('thumbnail', ''),
-                'webpage_url': info.get('webpage_url', url),
-                'formats_count': len(info.get('formats', []))
-            }
+        return video_summary(get_video_metadata(url), url)
     except Exception as e:
+        if fallback is not None and is_upstream_failure(e):
+            st.warning(f"⚠️ {e}. Showing the details from the search results instead.")
+            return video_summary(fallback, url)
         st.error(f"Error getting video info: {str(e)}")
+        get_capabilities().invalidate()
     
     return None
 
 def get_video_stream_url(url, quality='720p'):
     """Get direct video stream URL"""
     try:
-        format_selector = f"best[height<={quality[:-1]}][ext=mp4]/best[ext=mp4]/best"
-        
-        cmd = [
-            'yt-dlp', 
-            '-f', format_selector,
-            '--get-url',
-            '--no-playlist',
-            url
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
-        
-        if result.returncode == 0 and result.stdout.strip():
-            return result.stdout.strip()
+        stream_url = get_stream_url_cache().resolve(url, quality)
+        if stream_url:
+            return stream_url
             
     except Exception as e:
         st.error(f"Error getting stream URL: {str(e)}")
+        get_capabilities().invalidate()
     
     return None
 
-def download_small_video(url, max_size_mb=50):
-    """Download small video to memory"""
+MEDIA_CACHE_DIR = os.path.join(CACHE_DIR, 'media')
+MEDIA_CACHE_MAX_BYTES = int(os.environ.get('MEDIA_CACHE_MAX_MB', '2048')) * 1024 * 1024
+# Local endpoint serving cached media with HTTP range support; it has no auth, so only loopback by default
+MEDIA_SERVER_HOST = os.environ.get('MEDIA_SERVER_HOST', '127.0.0.1')
+MEDIA_SERVER_PORT = int(os.environ.get('MEDIA_SERVER_PORT', '8502'))
+# Public address of the media endpoint, e.g. https://example.com/media-proxy when a reverse proxy forwards that
+# prefix to MEDIA_SERVER_PORT; unset derives it from the page's host, which only works for local browsers
+MEDIA_BASE_URL = os.environ.get('MEDIA_BASE_URL', '').rstrip('/')
+# Largest file the Streamlit fallback player embeds, since Streamlit holds embedded media in memory
+MEDIA_INLINE_MAX_BYTES = int(os.environ.get('MEDIA_INLINE_MAX_MB', '100')) * 1024 * 1024
+
+MEDIA_TYPES = {'mp4': 'video/mp4', 'webm': 'video/webm', 'm4a': 'audio/mp4', 'opus': 'audio/ogg', 'ogg': 'audio/ogg'}
+
+
+class MediaCache:
+    """Content-addressed media files on disk, capped in size with least-recently-used eviction"""
+
+    def __init__(self, directory=MEDIA_CACHE_DIR, max_bytes=MEDIA_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._source_locks = {}
+        # Files still being written, and the content-addressed names they finished as
+        self._live = {}
+        self._aliases = {}
+        os.makedirs(directory, exist_ok=True)
+        # Maps a source (video ID and format) to the digest of the file it produced
+        self.index = TieredCache('media_index', 1024, 30 * 86400)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def temp_path(self, suffix):
+        """Return a fresh path inside the cache directory for a download in progress"""
+        fd, path = tempfile.mkstemp(suffix=suffix, prefix='.partial-', dir=self.directory)
+        os.close(fd)
+        return path
+
+    def entry(self, name):
+        """Return the entry for a cached file name, marking it recently used, or None"""
+        with self._lock:
+            resolved = self._aliases.get(name, name)
+            live = resolved in self._live
+        path = self.path(resolved)
+        try:
+            if live:
+                return {'name': resolved, 'path': path, 'size': os.path.getsize(path),
+                        'ext': resolved.rsplit('.', 1)[-1], 'live': True}
+            os.utime(path)
+            size = os.path.getsize(path)
+        except OSError:
+            # A live file goes away once it is finished or aborted; look the name up again to find out which
+            return self.entry(name) if live else None
+        return {'name': resolved, 'path': path, 'size': size, 'ext': resolved.rsplit('.', 1)[-1]}
+
+    def source_lock(self, source):
+        """Return the lock serialising work on one source"""
+        with self._lock:
+            return self._source_locks.setdefault(source, threading.Lock())
+
+    def lookup(self, source):
+        name = self.index.get(source)
+        return self.entry(name) if name else None
+
+    def _content_name(self, path, ext):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return f"{digest.hexdigest()}.{ext}"
+
+    def _added(self, name, source):
+        if source:
+            self.index.set(source, name)
+        self.evict(keep=name)
+        return self.entry(name)
+
+    def add_file(self, temp_path, ext, source=None):
+        """Move a finished download into the cache under its content hash"""
+        name = self._content_name(temp_path, ext)
+        os.replace(temp_path, self.path(name))
+        return self._added(name, source)
+
+    def start_live(self, source, ext):
+        """Create a file that is served to players while it is still being written"""
+        name = f"live-{hashlib.sha1(source.encode()).hexdigest()}.{ext}"
+        with self._lock:
+            self._aliases.pop(name, None)
+            self._live[name] = True
+        open(self.path(name), 'wb').close()
+        return self.entry(name)
+
+    def finish_live(self, name, source=None):
+        """Move a completed live file to its content-addressed name
+
+        The file is linked under its new name before the alias switches over and the old name is removed, so
+        it can be found under one name or the other throughout.
+        """
+        final = self._content_name(self.path(name), name.rsplit('.', 1)[-1])
+        try:
+            os.link(self.path(name), self.path(final))
+        except FileExistsError:
+            pass
+        with self._lock:
+            self._aliases[name] = final
+            del self._live[name]
+        os.unlink(self.path(name))
+        return self._added(final, source)
+
+    def abort_live(self, name):
+        with self._lock:
+            self._live.pop(name, None)
+        try:
+            os.unlink(self.path(name))
+        except OSError:
+            pass
+
+    def is_live(self, name):
+        with self._lock:
+            return name in self._live
+
+    def evict(self, keep=None):
+        """Delete least-recently-used files until the cache fits its size cap"""
+        with self._lock:
+            files = []
+            for name in os.listdir(self.directory):
+                if name.startswith(('.partial-', 'live-')):
+                    continue
+                try:
+                    stat = os.stat(self.path(name))
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, name))
+            total = sum(size for _, size, _ in files)
+            for _, size, name in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                if name == keep:
+                    continue
+                try:
+                    os.unlink(self.path(name))
+                    total -= size
+                except OSError:
+                    pass
+
+
+class MediaRequestHandler(BaseHTTPRequestHandler):
+    """Serves /media/<name> from the media cache with single byte-range support, and /metrics"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def _serve(self, send_body):
+        parsed = urlparse(self.path)
+        if parsed.path == '/metrics':
+            self._serve_metrics(send_body)
+            return
+        if parsed.path == '/suggest':
+            self._serve_suggest(parse_qs(parsed.query).get('q', [''])[0], send_body)
+            return
+        match = re.fullmatch(r'/media/((?:[0-9a-f]{64}|live-[0-9a-f]{40})\.[a-z0-9]+)', parsed.path)
+        entry = self.server.media_cache.entry(match.group(1)) if match else None
+        if entry is None:
+            self.send_error(404)
+            return
+        if entry.get('live'):
+            self._serve_live(entry, send_body)
+            return
+
+        size = entry['size']
+        start, end = 0, size - 1
+        range_header = self.headers.get('Range')
+        if range_header:
+            range_match = re.fullmatch(r'bytes=(\d*)-(\d*)', range_header.strip())
+            if not range_match or range_match.groups() == ('', ''):
+                self.send_error(416)
+                return
+            first, last = range_match.groups()
+            if first:
+                start = int(first)
+                end = min(int(last), size - 1) if last else size - 1
+            else:
+                start = max(size - int(last), 0)
+            if start > end or start >= size:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.end_headers()
+                return
+
+        self.send_response(206 if range_header else 200)
+        self.send_header('Content-Type', MEDIA_TYPES.get(entry['ext'], 'application/octet-stream'))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Cache-Control', 'public, max-age=86400, immutable')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        if range_header:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        filename = parse_qs(parsed.query).get('download')
+        if filename:
+            # RFC 6266: an ASCII name for old clients, then the exact name percent-encoded as UTF-8
+            fallback = re.sub(r'[^\w.()\[\] -]', '_', filename[0].encode('ascii', 'replace').decode())
+            self.send_header('Content-Disposition',
+                             f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename[0], safe='')}")
+        self.end_headers()
+
+        if send_body:
+            remaining = end - start + 1
+            try:
+                with open(entry['path'], 'rb') as f:
+                    f.seek(start)
+                    while remaining > 0:
+                        chunk = f.read(min(256 * 1024, remaining))
+                        if not chunk:
+                            break
+                        self.wfile.write(chunk)
+                        remaining -= len(chunk)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+
+    def _serve_metrics(self, send_body):
+        body = get_metrics().prometheus().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def _serve_suggest(self, query, send_body):
+        """Autocomplete for clients that query on every keystroke: completions and the top offline matches"""
+        index = get_search_index()
+        body = json_dumps({'suggestions': index.suggest(query), 'results': index.search(query, 5) if query else []}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def _serve_live(self, entry, send_body):
+        """Stream a file that is still being written, following it until it is complete"""
+        media_cache = self.server.media_cache
+        self.send_response(200)
+        self.send_header('Content-Type', MEDIA_TYPES.get(entry['ext'], 'application/octet-stream'))
+        self.send_header('Cache-Control', 'no-store')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        if not send_body:
+            return
+
+        try:
+            # The open handle keeps following the file after it is renamed into the cache
+            with open(entry['path'], 'rb') as f:
+                while True:
+                    chunk = f.read(256 * 1024)
+                    if chunk:
+                        self.wfile.write(chunk)
+                    elif media_cache.is_live(entry['name']):
+                        time.sleep(0.1)
+                    else:
+                        chunk = f.read()
+                        if chunk:
+                            self.wfile.write(chunk)
+                        break
+        except (BrokenPipeError, ConnectionResetError, FileNotFoundError):
+            pass
+
+
+@st.cache_resource(show_spinner=False)
+def get_media_cache():
+    """Return the process-wide media cache"""
+    return MediaCache()
+
+
+@st.cache_resource(show_spinner=False)
+def get_media_server():
+    """Start the media endpoint once per process; returns None if the port is unavailable"""
+    try:
+        server = ThreadingHTTPServer((MEDIA_SERVER_HOST, MEDIA_SERVER_PORT), MediaRequestHandler)
+    except OSError:
+        return None
+    server.daemon_threads = True
+    server.media_cache = get_media_cache()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def is_loopback_host(host):
+    """True for localhost and loopback addresses"""
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def media_base_url():
+    """Base URL this session's browser can reach the media endpoint at, or None to serve media through Streamlit"""
+    if get_media_server() is None:
+        return None
+    if MEDIA_BASE_URL:
+        return MEDIA_BASE_URL
+    try:
+        headers = st.context.headers
+    except Exception:
+        return None
+    host = urlparse(f"//{headers.get('Host', '')}").hostname
+    # The endpoint speaks plain HTTP, which an HTTPS page may not embed
+    if not host or headers.get('X-Forwarded-Proto', 'http') != 'http':
+        return None
+    if not is_loopback_host(host) and is_loopback_host(MEDIA_SERVER_HOST):
+        return None
+    return f"http://{f'[{host}]' if ':' in host else host}:{MEDIA_SERVER_PORT}"
+
+
+def media_url(entry, download_name=None):
+    """Return the browser-facing URL of a cached media file; only valid while media_base_url() is set"""
+    url = f"{media_base_url()}/media/{entry['name']}"
+    if download_name:
+        url += f"?download={quote_plus(download_name)}"
+    return url
+
+# Set to 0 to always download the whole file before showing the player
+PROGRESSIVE_PLAYBACK = os.environ.get('PROGRESSIVE_PLAYBACK', '1') != '0'
+# Video codecs that fragmented MP4 carries without re-encoding
+FRAGMENTABLE_VCODECS = ('avc1', 'h264', 'hev1', 'hvc1', 'av01')
+# Fragmented MP4 starts with an empty moov and a fragment per keyframe, so it plays while being written
+FRAGMENTED_MP4_ARGS = ['-f', 'mp4', '-movflags', 'frag_keyframe+empty_moov+default_base_moof']
+
+
+def can_fragment(fmt):
+    """True if a format can be remuxed to fragmented MP4 by stream copy"""
+    vcodec = fmt.get('vcodec') or ''
+    acodec = fmt.get('acodec') or 'none'
+    return bool(fmt.get('url')) and vcodec.startswith(FRAGMENTABLE_VCODECS) and (
+        acodec == 'none' or acodec.startswith('mp4a'))
+
+
+def _ffmpeg_input_args(fmt):
+    """ffmpeg arguments reading a format URL with the HTTP headers yt-dlp says it needs"""
+    headers = ''.join(f"{k}: {v}\r\n" for k, v in (fmt.get('http_headers') or {}).items())
+    return (['-headers', headers] if headers else []) + ['-i', fmt['url']]
+
+
+@contextmanager
+def ffmpeg_input(info, fmt, progress=None):
+    """Yield ffmpeg input arguments for a format: its URL, or under a download rate limit a local copy
+
+    ffmpeg cannot be held to the rate limit, so a limited server first downloads the format within its share.
+    """
+    if not get_download_bandwidth().rate:
+        yield _ffmpeg_input_args(fmt)
+        return
+    temp_path = get_media_cache().temp_path(f".{fmt.get('ext') or 'media'}")
+    try:
+        with get_download_bandwidth().share() as rate_limit:
+            get_backend().download_info(info, fmt['format_id'], temp_path, progress, rate_limit)
+        yield ['-i', temp_path]
+    finally:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+
+
+def _ffmpeg_to_live_entry(source, ext, cmd, expected=None, progress=None, on_start=None):
+    """Write ffmpeg's stdout into a live media cache entry, then file it under its content hash"""
+    media_cache = get_media_cache()
+    entry = media_cache.start_live(source, ext)
+    try:
+        written = 0
+        with open(entry['path'], 'wb') as out:
+            for chunk in get_subprocess_executor().iter_chunks(cmd, 'download', DOWNLOAD_TIMEOUT):
+                out.write(chunk)
+                out.flush()
+                if written == 0 and on_start:
+                    on_start(entry)
+                written += len(chunk)
+                if progress:
+                    progress(written, expected, None)
+        if written == 0:
+            raise RuntimeError("ffmpeg produced no output")
+    except BaseException:
+        media_cache.abort_live(entry['name'])
+        raise
+    
+    return media_cache.finish_live(entry['name'], source)
+
+
+def _remux_to_cache(url, download_format, source, progress, on_start):
+    """Remux a format into fragmented MP4 that players can start on after the first fragments"""
+    started = []
+    
+    def first_bytes(entry):
+        started.append(entry)
+        on_start(entry)
+    
+    for attempt in range(2):
+        cmd = ['ffmpeg', '-nostdin', '-loglevel', 'error', *_ffmpeg_input_args(download_format),
+               '-c', 'copy', *FRAGMENTED_MP4_ARGS, 'pipe:1']
+        expected = download_format.get('filesize') or download_format.get('filesize_approx')
+        try:
+            return _ffmpeg_to_live_entry(source, 'mp4', cmd, expected, progress, first_bytes)
+        except RuntimeError:
+            if attempt or started:
+                raise
+            # Nothing was played yet, so the format URL has probably expired; extract once more and retry
+            info = get_video_metadata(url, refresh=True)
+            download_format = next((f for f in info.get('formats') or []
+                                    if f.get('format_id') == download_format['format_id']), None)
+            if download_format is None:
+                raise
+
+
+class DownloadBudget:
+    """Progress callback that aborts a download once its byte counter, or a reported total, passes max_bytes"""
+
+    def __init__(self, max_bytes, progress=None):
+        self.max_bytes = max_bytes
+        self.progress = progress
+        self.exceeded = False
+    
+    def __call__(self, downloaded, total, speed):
+        # Totals may be yt-dlp estimates, so they get some slack; the byte counter gets none
+        if downloaded > self.max_bytes or (total and total > self.max_bytes * 1.05):
+            self.exceeded = True
+            raise RuntimeError(f"Download is larger than {self.max_bytes / 1e6:.0f} MB")
+        if self.progress:
+            self.progress(downloaded, total, speed)
+
+
+def _fit_to_cache(info, download_format, max_bytes, source, progress):
+    """Re-encode a format to a bitrate that fits max_bytes, or trim it there when that bitrate is unwatchable"""
+    media_cache = get_media_cache()
+    duration = info.get('duration')
+    video_kbps = max_bytes * 8 / 1000 / duration * 0.95 - FIT_AUDIO_KBPS if duration else 0
+    if video_kbps >= FIT_MIN_VIDEO_KBPS:
+        codec_args = ['-c:v', 'libx264', '-preset', 'veryfast', '-b:v', f'{video_kbps:.0f}k',
+                      '-maxrate', f'{video_kbps * 1.5:.0f}k', '-bufsize', f'{video_kbps * 2:.0f}k',
+                      '-c:a', 'aac', '-b:a', f'{FIT_AUDIO_KBPS}k']
+    else:
+        codec_args = ['-c', 'copy']
+    temp_path = media_cache.temp_path('.mp4')
+    try:
+        with ffmpeg_input(info, download_format) as input_args:
+            # -fs stops ffmpeg at the limit, which is the trim and also catches a re-encode that overshoots
+            cmd = ['ffmpeg', '-nostdin', '-loglevel', 'error', '-y', *input_args, *codec_args,
+                   '-fs', str(int(max_bytes * 0.97)), '-movflags', '+faststart', '-f', 'mp4',
+                   '-progress', 'pipe:1', '-nostats', temp_path]
+            with get_metrics().span('fit_to_budget', reencode=video_kbps >= FIT_MIN_VIDEO_KBPS, max_bytes=max_bytes):
+                for line in get_subprocess_executor().iter_lines(cmd, 'download', DOWNLOAD_TIMEOUT):
+                    key, _, value = line.strip().partition('=')
+                    if key == 'total_size' and value.isdigit() and progress:
+                        progress(int(value), max_bytes, None)
+        if os.path.getsize(temp_path) == 0:
+            raise RuntimeError("ffmpeg produced no output")
+        entry = media_cache.add_file(temp_path, 'mp4', source)
+        temp_path = None
+        return entry
+    finally:
+        if temp_path and os.path.exists(temp_path):
+            os.unlink(temp_path)
+
+
+# Set to 0 to hand every download to yt-dlp instead of fetching byte ranges directly
+CHUNKED_DOWNLOADS = os.environ.get('CHUNKED_DOWNLOADS', '1') != '0'
+DOWNLOAD_CHUNK_SIZE = int(os.environ.get('DOWNLOAD_CHUNK_MB', '4')) * 1024 * 1024
+# Parallel range requests per download
+DOWNLOAD_CONNECTIONS = int(os.environ.get('DOWNLOAD_CONNECTIONS', '4'))
+DOWNLOAD_CHUNK_RETRIES = int(os.environ.get('DOWNLOAD_CHUNK_RETRIES', '3'))
+# Interrupted downloads wait here to be resumed; ones untouched for PARTIAL_DOWNLOAD_TTL seconds are deleted
+PARTIAL_DOWNLOAD_DIR = os.path.join(CACHE_DIR, 'partial')
+PARTIAL_DOWNLOAD_TTL = int(os.environ.get('PARTIAL_DOWNLOAD_TTL', '86400'))
+# Offset and bytes every complete file of a container starts with
+CONTAINER_SIGNATURES = {'mp4': (4, b'ftyp'), 'm4a': (4, b'ftyp'), 'webm': (0, b'\x1a\x45\xdf\xa3')}
+
+
+@st.cache_resource(show_spinner=False)
+def get_download_session():
+    """Return the process-wide HTTP session whose connections chunked downloads share"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=DOWNLOAD_WORKERS * DOWNLOAD_CONNECTIONS)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def sweep_partial_downloads():
+    """Delete partial downloads nobody has resumed within PARTIAL_DOWNLOAD_TTL"""
+    cutoff = time.time() - PARTIAL_DOWNLOAD_TTL
+    try:
+        names = os.listdir(PARTIAL_DOWNLOAD_DIR)
+    except OSError:
+        return
+    for name in names:
+        path = os.path.join(PARTIAL_DOWNLOAD_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                shutil.rmtree(path)
+        except OSError:
+            pass
+
+
+class ChunkedDownload:
+    """Fetches one format in parallel byte ranges into a partial file that outlives failures
+
+    The partial file and a manifest of the bytes done per chunk are keyed by source, not URL, so
+    a later attempt resumes where this one stopped, even with a freshly signed URL.
+    """
+
+    def __init__(self, source, fmt, ext, progress=None, rate_limit=None, max_bytes=None):
+        self.source = source
+        self.fmt = fmt
+        self.ext = ext
+        self.progress = progress
+        self.rate_limit = rate_limit
+        self.max_bytes = max_bytes
+        self.directory = os.path.join(PARTIAL_DOWNLOAD_DIR, hashlib.sha1(source.encode()).hexdigest())
+        self.data_path = os.path.join(self.directory, 'data')
+        self.manifest_path = os.path.join(self.directory, 'manifest.json')
+        # Chunk threads stop with the caller's cancel scope, and with each other on a failure
+        self.cancelled = getattr(_cancel_scope, 'cancelled', None)
+        self.failed = threading.Event()
+        self._lock = threading.Lock()
+        self._saved_at = 0
+    
+    def _headers(self, start, end):
+        return {**(self.fmt.get('http_headers') or {}), 'Range': f'bytes={start}-{end}'}
+    
+    def _chunk_range(self, index):
+        start = index * self.manifest['chunk_size']
+        return start, min(start + self.manifest['chunk_size'], self.manifest['size']) - 1
+    
+    def _probe(self):
+        """Return (size, validator) from a one-byte range request, or None if ranges are not served"""
+        response = get_download_session().get(self.fmt['url'], headers=self._headers(0, 0), stream=True,
+                                              timeout=(10, 30))
+        response.close()
+        response.raise_for_status()
+        match = re.match(r'bytes 0-0/(\d+)', response.headers.get('Content-Range', ''))
+        if response.status_code != 206 or not match:
+            return None
+        return int(match.group(1)), response.headers.get('ETag') or response.headers.get('Last-Modified')
+    
+    def _load_manifest(self, size, validator):
+        try:
+            with open(self.manifest_path, 'rb') as f:
+                manifest = json_loads(f.read())
+            if (manifest['size'] == size and manifest['validator'] == validator
+                    and manifest['chunk_size'] == DOWNLOAD_CHUNK_SIZE and os.path.getsize(self.data_path) == size):
+                return manifest
+        except (OSError, ValueError, KeyError):
+            pass
+        # Nothing to resume, or upstream changed the file: start over with a sparse file of the final size
+        with open(self.data_path, 'wb') as f:
+            f.truncate(size)
+        return {'size': size, 'validator': validator, 'chunk_size': DOWNLOAD_CHUNK_SIZE,
+                'done': [0] * -(-size // DOWNLOAD_CHUNK_SIZE)}
+    
+    def _save_manifest(self, force=False):
+        """Persist progress at most once a second; call with the lock held"""
+        now = time.monotonic()
+        if not force and now - self._saved_at < 1:
+            return
+        self._saved_at = now
+        # The data must be on disk before a manifest that counts it
+        os.fsync(self._fd)
+        temp_path = self.manifest_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            f.write(json_dumps(self.manifest))
+        os.replace(temp_path, self.manifest_path)
+    
+    def _advance(self, index, done, size):
+        with self._lock:
+            self.manifest['done'][index] = done
+            self._downloaded += size
+            self._fetched += size
+            self._save_manifest()
+            downloaded, fetched = self._downloaded, self._fetched
+        elapsed = time.monotonic() - self._started
+        if self.progress:
+            self.progress(downloaded, self.manifest['size'], fetched / elapsed if elapsed > 0 else None)
+        if self.rate_limit:
+            # Shared across chunk threads: hold the whole download to rate_limit bytes per second
+            ahead = fetched / self.rate_limit - elapsed
+            if ahead > 0:
+                time.sleep(ahead)
+    
+    def _fetch_chunk(self, index):
+        start, end = self._chunk_range(index)
+        for attempt in range(DOWNLOAD_CHUNK_RETRIES + 1):
+            offset = start + self.manifest['done'][index]
+            if offset > end:
+                return
+            try:
+                with get_download_session().get(self.fmt['url'], headers=self._headers(offset, end), stream=True,
+                                                timeout=(10, 30)) as response:
+                    response.raise_for_status()
+                    if response.status_code != 206:
+                        raise RuntimeError("Server ignored the requested byte range")
+                    for block in response.iter_content(256 * 1024):
+                        if self.failed.is_set() or (self.cancelled and self.cancelled()):
+                            raise CancelledError()
+                        block = block[:end + 1 - offset]
+                        os.pwrite(self._fd, block, offset)
+                        offset += len(block)
+                        self._advance(index, offset - start, len(block))
+                        if offset > end:
+                            return
+                raise requests.ConnectionError(f"Range {start}-{end} ended at {offset}")
+            except requests.HTTPError as e:
+                # An expired URL will not recover on retry; the caller re-extracts it
+                if e.response.status_code in (403, 410) or attempt == DOWNLOAD_CHUNK_RETRIES:
+                    raise
+            except requests.RequestException:
+                if attempt == DOWNLOAD_CHUNK_RETRIES:
+                    raise
+            time.sleep(min(2 ** attempt, 10))
+    
+    def _verify(self):
+        """Check the finished file before it enters the cache; a bad file is discarded rather than resumed"""
+        valid = os.path.getsize(self.data_path) == self.manifest['size'] and all(
+            done == end - start + 1
+            for done, (start, end) in zip(self.manifest['done'], map(self._chunk_range, itertools.count())))
+        signature = CONTAINER_SIGNATURES.get(self.ext)
+        if valid and signature:
+            with open(self.data_path, 'rb') as f:
+                f.seek(signature[0])
+                valid = f.read(len(signature[1])) == signature[1]
+        if not valid:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            raise RuntimeError("Downloaded file failed verification")
+    
+    def run(self):
+        """Download, verify and move the file into the media cache; None if the server has no range support"""
+        probed = self._probe()
+        if probed is None:
+            return None
+        if self.max_bytes and probed[0] > self.max_bytes:
+            # Refused before a sparse file of the full size is allocated
+            raise RuntimeError(f"Download is larger than {self.max_bytes / 1e6:.0f} MB")
+        
+        sweep_partial_downloads()
+        os.makedirs(self.directory, exist_ok=True)
+        media_cache = get_media_cache()
+        with open(os.path.join(self.directory, 'lock'), 'w') as lock_file:
+            # Another process, a batch run say, may be resuming the same download
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            cached = media_cache.lookup(self.source)
+            if cached:
+                return cached
+            
+            self.manifest = self._load_manifest(*probed)
+            self._downloaded = sum(self.manifest['done'])
+            self._fetched = 0
+            self._started = time.monotonic()
+            self._fd = os.open(self.data_path, os.O_RDWR)
+            try:
+                remaining = [i for i, done in enumerate(self.manifest['done'])
+                             if done <= self._chunk_range(i)[1] - self._chunk_range(i)[0]]
+                with ThreadPoolExecutor(max_workers=DOWNLOAD_CONNECTIONS, thread_name_prefix='chunk') as pool:
+                    futures = [pool.submit(self._fetch_chunk, index) for index in remaining]
+                    try:
+                        for future in futures:
+                            future.result()
+                    except BaseException:
+                        self.failed.set()
+                        raise
+            finally:
+                with self._lock:
+                    self._save_manifest(force=True)
+                os.close(self._fd)
+            
+            self._verify()
+            entry = media_cache.add_file(self.data_path, self.ext, self.source)
+        shutil.rmtree(self.directory, ignore_errors=True)
+        return entry
+
+
+def _chunked_download_to_cache(url, download_format, source, progress, rate_limit, max_bytes=None):
+    """Chunked download of a format, re-extracting once if its URL has expired; None without range support"""
+    for attempt in range(2):
+        try:
+            return ChunkedDownload(source, download_format, 'mp4', progress, rate_limit, max_bytes).run()
+        except requests.HTTPError as e:
+            if attempt or e.response.status_code not in (403, 410):
+                raise
+            # Chunks fetched so far stay valid: the partial file is keyed by video and format, not URL
+            info = get_video_metadata(url, refresh=True)
+            download_format = next((f for f in info.get('formats') or []
+                                    if f.get('format_id') == download_format['format_id']), None)
+            if download_format is None:
+                raise
+
+
+def _download_to_cache(url, max_size_mb=50, progress=None, on_start=None):
+    """Download url into the media cache and return its entry; raises on failure
+
+    With on_start, fragmentable formats are remuxed progressively and on_start receives the
+    live entry as soon as it has bytes to play. Every path is held to max_size_mb: formats whose
+    size is unknown are aborted once they pass it, and when every format is known to be too big
+    one is re-encoded or trimmed to fit. Downloads take a share of the process-wide rate limit.
+    """
+    temp_path = None
     try:
-        with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as temp_file:
-            cmd = [
-                'yt-dlp',
-                '-f', f'best[filesize<{max_size_mb}M][ext=mp4]/worst[ext=mp4]',
-                '-o', temp_file.name,
-                '--no-playlist',
-                url
-            ]
+        media_cache = get_media_cache()
+        info = get_video_metadata(url)
+        download_format, needs_fit = plan_download(info, max_size_mb)
+        if download_format is None:
+            return None
+        
+        max_bytes = max_size_mb * 1000 * 1000
+        source = f"{extract_video_id(url) or url}|{download_format['format_id']}"
+        if needs_fit:
+            source += f"|fit{max_size_mb}"
+            with media_cache.source_lock(source):
+                return media_cache.lookup(source) or _fit_to_cache(
+                    info, download_format, max_bytes, source, progress)
+        
+        budget = DownloadBudget(max_bytes, progress)
+        # Concurrent requests that resolve to the same video and format share one download
+        with media_cache.source_lock(source):
+            cached = media_cache.lookup(source)
+            if cached:
+                return cached
             
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=120)
+            # ffmpeg cannot be held to the download rate limit, so rate-limited servers keep the plain path
+            if (on_start and PROGRESSIVE_PLAYBACK and not get_download_bandwidth().rate
+                    and can_fragment(download_format) and get_capabilities().get()['ffmpeg']):
+                return _remux_to_cache(url, download_format, source, budget, on_start)
             
-            if result.returncode == 0 and os.path.exists(temp_file.name):
-                with open(temp_file.name, 'rb') as f:
-                    video_data = f.read()
-                
-                os.unlink(temp_file.name)
-                return video_data
+            with get_download_bandwidth().share() as rate_limit:
+                if CHUNKED_DOWNLOADS and download_format.get('url') and download_format.get('protocol', 'https') in ('http', 'https'):
+                    entry = _chunked_download_to_cache(url, download_format, source, budget, rate_limit, max_bytes)
+                    if entry:
+                        return entry
                 
+                temp_path = media_cache.temp_path('.mp4')
+                try:
+                    downloaded = get_backend().download_info(info, download_format['format_id'], temp_path, budget,
+                                                             rate_limit)
+                except Exception:
+                    if budget.exceeded:
+                        raise
+                    # The stored format URLs may have expired; extract once more and retry
+                    info = get_video_metadata(url, refresh=True)
+                    downloaded = get_backend().download_info(info, download_format['format_id'], temp_path, budget,
+                                                             rate_limit)
+            
+            if downloaded and os.path.getsize(temp_path) > 0:
+                entry = media_cache.add_file(temp_path, 'mp4', source)
+                temp_path = None
+                return entry
+    finally:
+        if temp_path and os.path.exists(temp_path):
+            os.unlink(temp_path)
+    
+    return None
+
+def download_small_video(url, max_size_mb=50):
+    """Download small video into the media cache"""
+    try:
+        return _download_to_cache(url, max_size_mb)
     except Exception as e:
         st.error(f"Error downloading video: {str(e)}")
+        get_capabilities().invalidate()
     
     return None
 
-def create_video_player(video_data):
-    """Create HTML5 video player"""
-    if video_data:
-        video_base64 = base64.b64encode(video_data).decode()
-        
+def pick_audio_format(formats):
+    """Best audio-only format, in yt-dlp's worst-to-best order"""
+    audio = [f for f in formats if f.get('url') and f.get('vcodec') == 'none' and f.get('acodec') not in (None, 'none')]
+    return audio[-1] if audio else None
+
+def _audio_output_args(acodec):
+    """ffmpeg output arguments for an audio codec: copy when the container allows it, else AAC"""
+    # Fragmented MP4 and WebM can both be played while they are still being written
+    if acodec.startswith('mp4a'):
+        return 'm4a', ['-c:a', 'copy', *FRAGMENTED_MP4_ARGS]
+    if acodec == 'opus':
+        return 'webm', ['-c:a', 'copy', '-f', 'webm']
+    return 'm4a', ['-c:a', 'aac', '-b:a', '128k', *FRAGMENTED_MP4_ARGS]
+
+def _extract_audio_to_cache(url, progress=None, on_start=None):
+    """Pipe the best audio-only format through ffmpeg into the media cache; raises on failure"""
+    media_cache = get_media_cache()
+    info = get_video_metadata(url)
+    audio_format = pick_audio_format(info.get('formats') or [])
+    if audio_format is None:
+        return None
+    
+    source = f"{extract_video_id(url) or url}|audio|{audio_format['format_id']}"
+    with media_cache.source_lock(source):
+        cached = media_cache.lookup(source)
+        if cached:
+            return cached
+        
+        ext, output_args = _audio_output_args(audio_format.get('acodec') or '')
+        expected = audio_format.get('filesize') or audio_format.get('filesize_approx')
+        with ffmpeg_input(info, audio_format, progress) as input_args:
+            cmd = ['ffmpeg', '-nostdin', '-loglevel', 'error', *input_args, '-vn', *output_args, 'pipe:1']
+            return _ffmpeg_to_live_entry(source, ext, cmd, expected, progress, on_start)
+
+DOWNLOAD_WORKERS = int(os.environ.get('DOWNLOAD_WORKERS', '3'))
+# Total download bandwidth across all jobs in bytes per second, 0 for unlimited
+DOWNLOAD_RATE_LIMIT = int(os.environ.get('DOWNLOAD_RATE_LIMIT', '0'))
+# Finished jobs are forgotten after this many seconds
+DOWNLOAD_JOB_RETENTION = 3600
+
+
+class DownloadBandwidth:
+    """DOWNLOAD_RATE_LIMIT split into equal shares for the UI jobs, batch items and audio extractions of a process
+
+    yt-dlp only takes a fixed rate, so at most slots downloads run at once, each held to rate / slots.
+    """
+
+    def __init__(self, rate=DOWNLOAD_RATE_LIMIT, slots=DOWNLOAD_WORKERS):
+        self.rate = rate
+        self.slots = slots
+        self._slots = threading.BoundedSemaphore(slots)
+
+    @contextmanager
+    def share(self):
+        """Wait for a free slot and yield its rate in bytes per second; yields None when unlimited"""
+        if not self.rate:
+            yield None
+            return
+        cancelled = getattr(_cancel_scope, 'cancelled', None)
+        while not self._slots.acquire(timeout=0.1):
+            if cancelled and cancelled():
+                raise CancelledError("Cancelled while waiting for download bandwidth")
+        try:
+            yield self.rate / self.slots
+        finally:
+            self._slots.release()
+
+
+@st.cache_resource(show_spinner=False)
+def get_download_bandwidth():
+    """Return the process-wide download rate limit"""
+    return DownloadBandwidth()
+
+
+class DownloadJobManager:
+    """Background download jobs on a bounded worker pool, with progress and deduplication"""
+
+    def __init__(self, workers=DOWNLOAD_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='download')
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def submit(self, url, max_size_mb=50):
+        """Queue a download and return its job ID; identical requests share one job
+
+        The job's entry is set early when the video can be played while it downloads.
+        """
+        key = f"video|{extract_video_id(url) or url}|{max_size_mb}"
+        return self._submit(key, url, lambda progress, on_start: _download_to_cache(url, max_size_mb, progress,
+                                                                                   on_start))
+
+    def submit_audio(self, url):
+        """Queue an audio extraction; its entry becomes playable before the job finishes"""
+        key = f"audio|{extract_video_id(url) or url}"
+        return self._submit(key, url, lambda progress, on_start: _extract_audio_to_cache(url, progress, on_start))
+
+    def _submit(self, key, url, work):
+        job_id = hashlib.sha1(key.encode()).hexdigest()[:16]
+        with self._lock:
+            self._prune()
+            job = self._jobs.get(job_id)
+            if job and job['status'] == 'done' and get_media_cache().entry(job['entry']['name']) is None:
+                # The file was evicted since the job finished, so download it again
+                job = None
+            if job and job['status'] != 'failed':
+                job['requests'] += 1
+                return job_id
+            self._jobs[job_id] = {
+                'id': job_id,
+                'url': url,
+                'status': 'queued',
+                'downloaded': 0,
+                'total': None,
+                'speed': None,
+                'entry': None,
+                'error': None,
+                'requests': 1,
+                'updated': time.time(),
+            }
+        self.executor.submit(self._run, job_id, work)
+        return job_id
+
+    def status(self, job_id):
+        """Return a snapshot of a job, or None if it is unknown"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def active_count(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job['status'] in ('queued', 'running'))
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields, updated=time.time())
+
+    def _run(self, job_id, work):
+        self._update(job_id, status='running')
+
+        def progress(downloaded, total, speed):
+            self._update(job_id, downloaded=downloaded, total=total, speed=speed)
+
+        def on_start(entry):
+            self._update(job_id, entry=entry)
+
+        try:
+            entry = work(progress, on_start)
+            if entry is None:
+                self._update(job_id, status='failed', error='No suitable format found')
+            else:
+                self._update(job_id, status='done', entry=entry, downloaded=entry['size'], total=entry['size'])
+        except Exception as e:
+            self._update(job_id, status='failed', error=str(e))
+
+    def _prune(self):
+        cutoff = time.time() - DOWNLOAD_JOB_RETENTION
+        for job_id in [j for j, job in self._jobs.items()
+                       if job['status'] in ('done', 'failed') and job['updated'] < cutoff]:
+            del self._jobs[job_id]
+
+
+@st.cache_resource(show_spinner=False)
+def get_download_jobs():
+    """Return the process-wide download job manager"""
+    return DownloadJobManager()
+
+def create_video_player(entry):
+    """Create HTML5 video player backed by the local media endpoint"""
+    if entry:
         video_html = f"""
         <div class="video-player">
             <video width="100%" height="400" controls preload="metadata">
-                <source src="data:video/mp4;base64,{video_base64}" type="video/mp4">
+                <source src="{media_url(entry)}" type="{MEDIA_TYPES.get(entry['ext'], 'video/mp4')}">
                 Your browser does not support the video tag.
             </video>
         </div>
@@ -258,6 +2993,567 @@ def create_video_player(video_data):
     
     return None
 
+THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS', '8'))
+# Thumbnails are stored at twice the largest display width for sharp rendering
+THUMBNAIL_WIDTH = 400
+THUMBNAIL_MEMORY_BYTES = int(os.environ.get('THUMBNAIL_MEMORY_MB', '32')) * 1024 * 1024
+# Seconds before a cached thumbnail is revalidated upstream with ETag/Last-Modified
+THUMBNAIL_TTL = int(os.environ.get('THUMBNAIL_TTL', '86400'))
+# Seconds a failed fetch is not retried
+THUMBNAIL_FAILURE_TTL = int(os.environ.get('THUMBNAIL_FAILURE_TTL', '300'))
+# Seconds a rerun waits for thumbnails; slower ones are shown from their remote URL
+THUMBNAIL_WAIT = float(os.environ.get('THUMBNAIL_WAIT', '0.3'))
+
+
+class ThumbnailService:
+    """Parallel thumbnail fetcher with resized copies cached in memory and on disk"""
+
+    def __init__(self, workers=THUMBNAIL_WORKERS):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='thumbnail')
+        self.directory = os.path.join(CACHE_DIR, 'thumbnails')
+        os.makedirs(self.directory, exist_ok=True)
+        # Validators and check times per URL; files live next to the database
+        self.meta = TieredCache('thumbnails', 2048, 30 * 86400)
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        # url -> monotonic time of its last failed fetch
+        self._failures = {}
+        self.stats = {'hits': 0, 'revalidated': 0, 'fetched': 0, 'errors': 0, 'skipped': 0}
+
+    def _remember(self, url, data):
+        with self._lock:
+            if url in self._memory:
+                self._memory_bytes -= len(self._memory.pop(url))
+            self._memory[url] = data
+            self._memory_bytes += len(data)
+            while self._memory_bytes > THUMBNAIL_MEMORY_BYTES and len(self._memory) > 1:
+                self._memory_bytes -= len(self._memory.popitem(last=False)[1])
+
+    def _shrink(self, data):
+        """Resize and re-encode an image as a compact JPEG; returns data unchanged without Pillow"""
+        if Image is None:
+            return data
+        with Image.open(io.BytesIO(data)) as image:
+            image.thumbnail((THUMBNAIL_WIDTH, THUMBNAIL_WIDTH))
+            output = io.BytesIO()
+            image.convert('RGB').save(output, format='JPEG', quality=80, optimize=True)
+        return output.getvalue()
+
+    def get(self, url):
+        """Return thumbnail bytes for url, or None if it cannot be fetched"""
+        meta = self.meta.get(url)
+        fresh = meta is not None and time.time() - meta['checked_at'] < THUMBNAIL_TTL
+        with self._lock:
+            data = self._memory.get(url) if fresh else None
+            if data is not None:
+                self._memory.move_to_end(url)
+        if data is not None:
+            self.stats['hits'] += 1
+            return data
+        failed_at = self._failures.get(url)
+        if failed_at is not None and time.monotonic() - failed_at < THUMBNAIL_FAILURE_TTL:
+            self.stats['skipped'] += 1
+            return None
+
+        path = os.path.join(self.directory, hashlib.sha1(url.encode()).hexdigest() + '.jpg')
+        if meta is not None and not os.path.exists(path):
+            meta = None
+        try:
+            if fresh:
+                with open(path, 'rb') as f:
+                    data = f.read()
+                self.stats['hits'] += 1
+            else:
+                headers = {}
+                if meta and meta.get('etag'):
+                    headers['If-None-Match'] = meta['etag']
+                if meta and meta.get('last_modified'):
+                    headers['If-Modified-Since'] = meta['last_modified']
+                response = self.session.get(url, headers=headers, timeout=10)
+                if response.status_code == 304 and meta:
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                    self.stats['revalidated'] += 1
+                else:
+                    response.raise_for_status()
+                    data = self._shrink(response.content)
+                    with open(path, 'wb') as f:
+                        f.write(data)
+                    self.stats['fetched'] += 1
+                self.meta.set(url, {
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified'),
+                    'checked_at': time.time(),
+                })
+        except Exception:
+            self.stats['errors'] += 1
+            self._failed(url)
+            return None
+
+        self._failures.pop(url, None)
+        self._remember(url, data)
+        return data
+
+    def _failed(self, url):
+        now = time.monotonic()
+        with self._lock:
+            if len(self._failures) >= 2048:
+                self._failures = {u: t for u, t in self._failures.items() if now - t < THUMBNAIL_FAILURE_TTL}
+            self._failures[url] = now
+
+    def submit(self, url):
+        """Start fetching url in the background and return its future"""
+        return self.executor.submit(self.get, url)
+
+    def prefetch(self, urls, timeout=THUMBNAIL_WAIT):
+        """Fetch thumbnails in parallel; returns a url -> bytes dict of those ready within timeout"""
+        futures = {url: self.submit(url) for url in dict.fromkeys(u for u in urls if u)}
+        wait(futures.values(), timeout=timeout)
+        return {url: future.result() for url, future in futures.items() if future.done()}
+
+
+@st.cache_resource(show_spinner=False)
+def get_thumbnail_service():
+    """Return the process-wide thumbnail service"""
+    return ThumbnailService()
+
+
+def thumbnail_image(url):
+    """Locally cached thumbnail bytes for url, falling back to the remote URL"""
+    return get_thumbnail_service().prefetch([url]).get(url) or url
+
+# Speculative stream URL resolution for the top search results
+PREFETCH_TOP_K = int(os.environ.get('PREFETCH_TOP_K', '3'))
+PREFETCH_WORKERS = int(os.environ.get('PREFETCH_WORKERS', '2'))
+# Global cap on speculative resolutions per minute, across all sessions
+PREFETCH_BUDGET = int(os.environ.get('PREFETCH_BUDGET', '30'))
+
+
+class StreamPrefetcher:
+    """Resolves stream URLs for top results ahead of time on its own small pool"""
+
+    def __init__(self, workers=PREFETCH_WORKERS, budget=PREFETCH_BUDGET):
+        # A separate pool keeps speculative work from delaying user-initiated jobs
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch')
+        self.budget = budget
+        self._lock = threading.Lock()
+        self._batches = {}
+        self._window_start = time.monotonic()
+        self._spent = 0
+        self.stats = {'scheduled': 0, 'resolved': 0, 'cancelled': 0, 'over_budget': 0, 'errors': 0}
+
+    def _take_budget(self):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._window_start >= 60:
+                self._window_start, self._spent = now, 0
+            if self._spent >= self.budget:
+                return False
+            self._spent += 1
+            return True
+
+    def schedule(self, owner, urls, quality):
+        """Replace owner's pending prefetches with a new batch for urls"""
+        self.cancel(owner)
+        cancelled = threading.Event()
+        futures = []
+        for url in urls:
+            if not self._take_budget():
+                self.stats['over_budget'] += 1
+                break
+            futures.append(self.executor.submit(self._resolve, url, quality, cancelled))
+            self.stats['scheduled'] += 1
+        with self._lock:
+            self._batches[owner] = (cancelled, futures)
+
+    def cancel(self, owner):
+        """Drop owner's queued prefetches and stop any that have not started resolving"""
+        with self._lock:
+            batch = self._batches.pop(owner, None)
+        if batch:
+            cancelled, futures = batch
+            cancelled.set()
+            for future in futures:
+                if future.cancel():
+                    self.stats['cancelled'] += 1
+
+    def _resolve(self, url, quality, cancelled):
+        if cancelled.is_set():
+            self.stats['cancelled'] += 1
+            return
+        try:
+            with cancel_scope(cancelled.is_set):
+                get_stream_url_cache().resolve(url, quality)
+            self.stats['resolved'] += 1
+        except Exception:
+            self.stats['errors'] += 1
+
+
+@st.cache_resource(show_spinner=False)
+def get_stream_prefetcher():
+    """Return the process-wide stream prefetcher"""
+    return StreamPrefetcher()
+
+
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', '8'))
+BATCH_OPERATIONS = ('info', 'stream', 'download')
+
+
+def read_batch_items(paths):
+    """Yield batch items from JSONL files ('-' reads stdin)
+
+    Lines are {"url": ...} or {"query": ..., "max_results": N} objects, or bare JSON strings,
+    which are taken as URLs when they contain a video ID and as search queries otherwise. An object
+    with both a URL and a query is reported as invalid rather than having one of them ignored.
+    """
+    for path in paths:
+        f = sys.stdin if path == '-' else open(path)
+        try:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    item = json_loads(line)
+                except ValueError:
+                    item = {'invalid': line, 'error': "Line is not valid JSON"}
+                if isinstance(item, str):
+                    item = {'url': item} if extract_video_id(item) else {'query': item}
+                elif not isinstance(item, dict):
+                    # Reported per item like malformed lines; a bare null would otherwise end the batch
+                    item = {'invalid': line, 'error': "Line is not a JSON object or string"}
+                elif item.get('url') and item.get('query'):
+                    item = {'invalid': line, 'error': "Line has both a 'url' and a 'query'"}
+                yield item
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+
+def batch_item_key(item):
+    """Identity of a batch item; a resumed run skips items whose key is in the checkpoint"""
+    if item.get('url'):
+        return f"url|{extract_video_id(item['url']) or item['url']}"
+    if item.get('query'):
+        return f"query|{search_cache_key(item['query'], item.get('max_results', 10))}"
+    return f"invalid|{json_dumps(item)}"
+
+
+def process_batch_item(item, operations, quality='720p', max_size_mb=50):
+    """Run operations for one URL, or search for one query, through the shared caches; raises on failure"""
+    if 'invalid' in item:
+        raise ValueError(item['error'])
+    if item.get('url') and item.get('query'):
+        raise ValueError("Batch items need a 'url' or a 'query', not both")
+    if item.get('query'):
+        query, max_results = item['query'], item.get('max_results', 10)
+        videos = get_search_cache().get_or_fetch(search_cache_key(query, max_results),
+                                                 lambda: _search_upstream(query, max_results))
+        return {'results': videos}
+    if not item.get('url'):
+        raise ValueError("Batch items need a 'url' or a 'query'")
+    
+    url = item['url']
+    result = {'video_id': extract_video_id(url)}
+    if 'info' in operations:
+        result['info'] = video_summary(get_video_metadata(url), url)
+    if 'stream' in operations:
+        result['stream_url'] = get_stream_url_cache().resolve(url, quality)
+        if not result['stream_url']:
+            raise RuntimeError("No playable format found")
+    if 'download' in operations:
+        entry = _download_to_cache(url, max_size_mb)
+        if entry is None:
+            raise RuntimeError("No MP4 format available for download")
+        result['download'] = {'name': entry['name'], 'size': entry['size']}
+    return result
+
+
+def _run_batch_item(item, operations, quality, max_size_mb, stopped):
+    started = time.perf_counter()
+    result = {'input': item}
+    try:
+        # Child processes die as soon as the run is interrupted
+        with cancel_scope(stopped.is_set), get_metrics().span('batch_item'):
+            # Nobody is waiting on a batch item, so wait out an open circuit instead of failing the item
+            sleep_cancellable(get_backend().backend.breaker.retry_in())
+            result.update(process_batch_item(item, operations, quality, max_size_mb))
+        result['ok'] = True
+    except Exception as e:
+        result.update(ok=False, error=str(e))
+    result['seconds'] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def run_batch(items, output, operations=('info', 'stream'), workers=BATCH_WORKERS, checkpoint=None,
+              quality='720p', max_size_mb=50, expand=False, progress=None):
+    """Process batch items on a bounded thread pool, writing one JSON line per item to output
+
+    Only successful items are recorded in the checkpoint file, so a resumed run skips them and
+    retries the failures. With expand, the results of each query are queued as URL items.
+    Returns counts of ok, failed and skipped items.
+    """
+    done = set()
+    if checkpoint and os.path.exists(checkpoint):
+        with open(checkpoint) as f:
+            done.update(line.rstrip('\n') for line in f)
+    counts = {'ok': 0, 'failed': 0, 'skipped': 0}
+    seen = set()
+    expanded = deque()
+    source = iter(items)
+    pending = {}
+    stopped = threading.Event()
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='batch')
+    checkpoint_file = open(checkpoint, 'a') if checkpoint else None
+    try:
+        while True:
+            # Two items per worker in flight keeps workers busy while huge inputs are read lazily
+            while len(pending) < workers * 2:
+                item = expanded.popleft() if expanded else next(source, None)
+                if item is None:
+                    break
+                key = batch_item_key(item)
+                if key in done or key in seen:
+                    counts['skipped'] += 1
+                    continue
+                seen.add(key)
+                pending[pool.submit(_run_batch_item, item, operations, quality, max_size_mb, stopped)] = key
+            if not pending:
+                break
+            
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                key = pending.pop(future)
+                result = future.result()
+                # Output is written before the checkpoint, so an interrupted run never loses a result
+                output.write(json_dumps(result) + '\n')
+                output.flush()
+                if result['ok']:
+                    counts['ok'] += 1
+                    if checkpoint_file:
+                        checkpoint_file.write(key + '\n')
+                        checkpoint_file.flush()
+                    if expand and 'results' in result:
+                        expanded.extend({'url': video['url']} for video in result['results'])
+                else:
+                    counts['failed'] += 1
+                if progress:
+                    progress(counts)
+    finally:
+        stopped.set()
+        pool.shutdown(wait=True, cancel_futures=True)
+        if checkpoint_file:
+            checkpoint_file.close()
+    return counts
+
+
+def batch_main(argv):
+    """Command line for run_batch: python app.py batch [options] input.jsonl ..."""
+    parser = argparse.ArgumentParser(prog='app.py batch',
+                                     description="Search, extract, resolve or download JSONL lists of queries "
+                                                 "and URLs, warming the app's caches")
+    parser.add_argument('inputs', nargs='+', help="JSONL files of {\"url\": ...} or {\"query\": ...} lines; - for stdin")
+    parser.add_argument('--ops', default='info,stream',
+                        help=f"comma-separated operations for URLs: {', '.join(BATCH_OPERATIONS)} (default: info,stream)")
+    parser.add_argument('--output', help='append JSONL results to this file instead of stdout')
+    parser.add_argument('--checkpoint', help='record finished items here and skip them on the next run '
+                                             '(default: <output>.checkpoint when --output is given)')
+    parser.add_argument('--workers', type=int, default=BATCH_WORKERS)
+    parser.add_argument('--quality', default='720p', choices=['1080p', '720p', '480p', '360p', '240p'])
+    parser.add_argument('--max-size', type=int, default=50, help='largest download in MB')
+    parser.add_argument('--expand', action='store_true', help='also process every URL a query returns')
+    args = parser.parse_args(argv)
+    
+    operations = [op for op in args.ops.split(',') if op]
+    unknown = set(operations) - set(BATCH_OPERATIONS)
+    if unknown:
+        parser.error(f"unknown operations: {', '.join(sorted(unknown))}")
+    checkpoint = args.checkpoint or (f'{args.output}.checkpoint' if args.output else None)
+    
+    started = time.monotonic()
+    last_report = [started]
+    
+    def report(counts, force=False):
+        now = time.monotonic()
+        if force or now - last_report[0] >= 10:
+            last_report[0] = now
+            handled = counts['ok'] + counts['failed']
+            print(f"{counts['ok']} ok, {counts['failed']} failed, {counts['skipped']} skipped "
+                  f"({handled / max(now - started, 1e-9):.1f}/s)", file=sys.stderr, flush=True)
+    
+    output = open(args.output, 'a') if args.output else sys.stdout
+    try:
+        counts = run_batch(read_batch_items(args.inputs), output, operations, args.workers, checkpoint,
+                           args.quality, args.max_size, args.expand, report)
+    except KeyboardInterrupt:
+        print("Interrupted; rerun the same command to resume", file=sys.stderr)
+        return 130
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    report(counts, force=True)
+    return 1 if counts['failed'] else 0
+
+
+def session_key():
+    """Stable identifier for the current browser session"""
+    if 'session_key' not in st.session_state:
+        st.session_state.session_key = uuid.uuid4().hex
+    return st.session_state.session_key
+
+SESSION_MEMORY_BUDGET = int(os.environ.get('SESSION_MEMORY_BUDGET_MB', '64')) * 1024 * 1024
+SESSION_SPILL_DIR = os.path.join(CACHE_DIR, 'sessions')
+# Set to 0 to drop evicted values instead of writing them to disk
+SESSION_SPILL = os.environ.get('SESSION_SPILL', '1') != '0'
+# Seconds after a session's last access before its values are discarded from both tiers
+SESSION_BLOB_IDLE = int(os.environ.get('SESSION_BLOB_IDLE', '21600'))
+
+
+class SessionBlobStore:
+    """Large per-session values under one memory budget shared by all sessions; the least recently used spill to disk"""
+
+    def __init__(self, budget=SESSION_MEMORY_BUDGET, directory=SESSION_SPILL_DIR, spill=SESSION_SPILL,
+                 idle=SESSION_BLOB_IDLE):
+        self.budget = budget
+        self.directory = directory
+        self.spill = spill
+        self.idle = idle
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._touched = {}
+        self._last_swept = 0
+        self.memory_bytes = 0
+        self.stats = {'spilled': 0, 'rehydrated': 0, 'dropped': 0, 'expired': 0}
+        os.makedirs(directory, exist_ok=True)
+        self._sweep_disk()
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1('|'.join(key).encode()).hexdigest() + '.json')
+
+    def put(self, session, name, value):
+        """Store value for the session, spilling older values anywhere in the process if over budget"""
+        key = (session, name)
+        size = estimate_size(value)
+        with self._lock:
+            self._touched[session] = time.time()
+            self._discard(key)
+            if size > self.budget:
+                # Larger than the whole budget: keep it on disk only and read it on each access
+                self._spill(key, value)
+            else:
+                self._memory[key] = (value, size)
+                self.memory_bytes += size
+                self._enforce_budget()
+            self._expire_idle()
+
+    def get(self, session, name, default=None):
+        """Return the stored value, reading it back from disk if it was spilled"""
+        key = (session, name)
+        with self._lock:
+            self._touched[session] = time.time()
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key][0]
+            path = self._path(key)
+            try:
+                with open(path, 'rb') as f:
+                    value = json_loads(f.read())
+            except (OSError, ValueError):
+                return default
+            self.stats['rehydrated'] += 1
+            size = estimate_size(value)
+            if size > self.budget:
+                return value
+            os.unlink(path)
+            self._memory[key] = (value, size)
+            self.memory_bytes += size
+            self._enforce_budget()
+            return value
+
+    def delete(self, session, name):
+        with self._lock:
+            self._discard((session, name))
+
+    def disk_bytes(self):
+        try:
+            return sum(e.stat().st_size for e in os.scandir(self.directory) if e.name.endswith('.json'))
+        except OSError:
+            return 0
+
+    def _discard(self, key):
+        if key in self._memory:
+            self.memory_bytes -= self._memory.pop(key)[1]
+        try:
+            os.unlink(self._path(key))
+        except OSError:
+            pass
+
+    def _enforce_budget(self):
+        while self.memory_bytes > self.budget and self._memory:
+            key, (value, size) = self._memory.popitem(last=False)
+            self.memory_bytes -= size
+            self._spill(key, value)
+
+    def _spill(self, key, value):
+        if self.spill:
+            try:
+                with open(self._path(key), 'w') as f:
+                    f.write(json_dumps(value))
+                self.stats['spilled'] += 1
+                return
+            except (OSError, TypeError, ValueError):
+                try:
+                    os.unlink(self._path(key))
+                except OSError:
+                    pass
+        self.stats['dropped'] += 1
+
+    def _expire_idle(self):
+        now = time.time()
+        for session in [s for s, seen in self._touched.items() if now - seen > self.idle]:
+            del self._touched[session]
+            for key in [k for k in self._memory if k[0] == session]:
+                self._discard(key)
+                self.stats['expired'] += 1
+        if now - self._last_swept > self.idle / 4:
+            self._sweep_disk()
+
+    def _sweep_disk(self):
+        """Delete spilled values untouched for longer than the idle window, including ones left by earlier runs"""
+        self._last_swept = time.time()
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.name.endswith('.json') and self._last_swept - entry.stat().st_mtime > self.idle:
+                    os.unlink(entry.path)
+                    self.stats['expired'] += 1
+            except OSError:
+                pass
+
+
+@st.cache_resource(show_spinner=False)
+def get_session_blobs():
+    """Return the process-wide session blob store"""
+    return SessionBlobStore()
+
+
+def session_blob(name, default=None):
+    """Return a large value held for the current session outside st.session_state"""
+    return get_session_blobs().get(session_key(), name, default)
+
+
+def set_session_blob(name, value):
+    get_session_blobs().put(session_key(), name, value)
+
+
+def drop_session_blob(name):
+    get_session_blobs().delete(session_key(), name)
+
+
 # def format_duration(seconds):
 #     """Format duration in seconds to MM:SS"""
 #     if not seconds:
@@ -273,42 +3569,192 @@ def format_duration(seconds):
     return f"{minutes}:{seconds:02d}"
 
 
-def main():
-    st.markdown('<h1 class="main-header">🎬 YouTube Search & Player</h1>', unsafe_allow_html=True)
+def request_app_rerun():
+    """Widget callback for fragment widgets whose change affects other parts of the page"""
+    st.session_state.app_rerun_requested = True
+
+
+def rerun_app_if_requested():
+    if st.session_state.pop('app_rerun_requested', False):
+        st.rerun()
+
+
+def select_video(video):
+    st.session_state.selected_video = video
+    request_app_rerun()
+
+
+@contextmanager
+def fragment_scope(name):
+    """Cancellation and timing for a fragment body, which Streamlit may rerun on its own"""
+    with cancel_scope(script_run_cancelled), get_metrics().span(f'fragment_{name}'):
+        yield
+
+
+def request_load_more():
+    st.session_state.load_more_requested = True
+
+
+def stream_video_cards(videos, offset=0, header=None):
+    """Render a card per result as it arrives, then fill in thumbnails; returns the results"""
+    results = []
+    thumbnails = []
+    thumbnail_service = get_thumbnail_service()
+    for video in videos:
+        results.append(video)
+        if header is not None:
+            header.subheader(f"📺 Search Results ({offset + len(results)} videos)")
+        # Thumbnails download in parallel and are filled in once the page is complete
+        slot = render_video_card(offset + len(results) - 1, video)
+        if video.get('thumbnail'):
+            thumbnails.append((slot, video['thumbnail'], thumbnail_service.submit(video['thumbnail'])))
+    wait([future for _, _, future in thumbnails], timeout=THUMBNAIL_WAIT)
+    for slot, url, future in thumbnails:
+        slot.image((future.done() and future.result()) or url, width=120)
+    return results
+
+
+def video_card_markdown(video):
+    """Text of a result card as a single markdown element"""
+    lines = [f"**{video['title']}**", f"👤 {video['uploader']}"]
+    if video.get('duration'):
+        lines.append(f"⏱️ {format_duration(video['duration'])}")
+    if video.get('view_count'):
+        lines.append(f"👁️ {video['view_count']:,} views")
+    return '\n\n'.join(lines)
+
+
+def render_video_card(i, video, thumbnail=None):
+    """Render one search result card with its select button; returns the thumbnail slot"""
+    with st.container():
+        col_thumb, col_info, col_action = st.columns([1, 3, 1])
+        
+        with col_thumb:
+            # Display thumbnail
+            thumbnail_slot = st.empty()
+            if thumbnail is not None:
+                thumbnail_slot.image(thumbnail, width=120)
+        
+        with col_info:
+            st.markdown(video_card_markdown(video))
+        
+        with col_action:
+            # Selecting changes the panels outside the results fragment, so it reruns the whole page
+            st.button("▶️ Select", key=f"select_{i}", on_click=select_video, args=(video,))
+        
+        st.divider()
     
-    # Initialize session state
-    if 'search_results' not in st.session_state:
-        st.session_state.search_results = []
-    if 'selected_video' not in st.session_state:
-        st.session_state.selected_video = None
+    return thumbnail_slot
+
+
+@st.fragment(run_every=1.0)
+def render_download_progress():
+    """Poll the background download job for this session; progressive downloads show the player early"""
+    # The timer keeps ticking until the next full rerun, which can be after the job was dropped
+    job_id = st.session_state.get('download_job')
+    if job_id is None:
+        return
+    job = get_download_jobs().status(job_id)
+    if job is None:
+        del st.session_state.download_job
+        st.rerun()
     
-    # Check if yt-dlp is available
-    yt_dlp_available = check_yt_dlp()
+    # A growing file can only be streamed through the media endpoint
+    if (job['entry'] and job['status'] != 'done' and 'video_file' not in st.session_state
+            and media_base_url() is not None):
+        st.session_state.video_file = job['entry']
+        st.rerun()
     
-    # Sidebar
-    with st.sidebar:
+    if job['status'] == 'done':
+        # Keep the live entry a progressive player is already on; its name now resolves to the finished file
+        st.session_state.setdefault('video_file', job['entry'])
+        del st.session_state.download_job
+        st.rerun()
+    elif job['status'] == 'failed':
+        st.session_state.download_error = job['error']
+        del st.session_state.download_job
+        st.rerun()
+    elif job['total']:
+        speed = f" at {job['speed']/1024/1024:.1f} MB/s" if job['speed'] else ""
+        st.progress(min(job['downloaded'] / job['total'], 1.0),
+                    text=f"Downloading {job['downloaded']/1024/1024:.1f} of {job['total']/1024/1024:.1f} MB{speed}")
+    else:
+        st.progress(0.0, text="Waiting for a download slot..." if job['status'] == 'queued' else "Starting download...")
+
+
+@st.fragment(run_every=1.0)
+def render_audio_progress():
+    """Poll this session's audio job; the player appears as soon as the first bytes exist"""
+    # As with downloads, a tick can arrive after the job was dropped
+    job_id = st.session_state.get('audio_job')
+    if job_id is None:
+        return
+    job = get_download_jobs().status(job_id)
+    if job is None:
+        del st.session_state.audio_job
+        st.rerun()
+    
+    if job['status'] == 'failed':
+        st.session_state.audio_error = job['error']
+        del st.session_state.audio_job
+        st.rerun()
+    
+    if job['entry'] and 'audio_file' not in st.session_state:
+        st.session_state.audio_file = job['entry']
+        if job['status'] != 'done':
+            st.rerun()
+    
+    if job['status'] == 'done':
+        del st.session_state.audio_job
+        st.rerun()
+    elif job['total']:
+        st.progress(min(job['downloaded'] / job['total'], 1.0),
+                    text=f"Extracting audio {job['downloaded']/1024/1024:.1f} of ~{job['total']/1024/1024:.1f} MB")
+    else:
+        st.progress(0.0, text="Waiting for a worker..." if job['status'] == 'queued' else "Extracting audio...")
+
+
+@st.fragment
+def render_sidebar():
+    """Settings and system status; changing a setting reruns only this fragment"""
+    with fragment_scope('sidebar'):
+        rerun_app_if_requested()
+        capabilities = get_capabilities().get()
+        yt_dlp_available = capabilities['yt_dlp']
+        
         st.header("🎛️ Settings")
         
-        # Quality selection
-        quality = st.selectbox(
+        # Settings are read from session state by the other fragments when they next run
+        st.selectbox(
             "Video Quality",
             ["1080p", "720p", "480p", "360p", "240p"],
-            index=1
+            index=1,
+            key='quality'
         )
         
-        # Processing mode
-        processing_mode = st.radio(
+        # Processing mode decides which buttons the selected-video panel shows
+        st.radio(
             "Processing Mode",
             ["Stream URL", "Download Video", "Audio Only"] if yt_dlp_available else ["YouTube Embed"],
-            help="Choose how to handle the video"
+            help="Choose how to handle the video",
+            key='processing_mode',
+            on_change=request_app_rerun
         )
         
         # Search settings
         st.subheader("🔍 Search Settings")
-        max_results = st.slider("Max Search Results", 5, 20, 10)
+        st.slider("Results per page", 5, 20, 10, key='page_size',
+                  help=f'"Load more" adds further pages, up to {SEARCH_MAX_RESULTS} results per search')
+        st.checkbox(
+            "⚡ Pre-resolve top results",
+            value=PREFETCH_TOP_K > 0,
+            disabled=not yt_dlp_available or PREFETCH_TOP_K == 0,
+            help=f"Resolve stream URLs for the top {PREFETCH_TOP_K} results in the background",
+            key='prefetch'
+        )
         
-        if processing_mode == "Download Video":
-            max_size = st.slider("Max Download Size (MB)", 10, 100, 50)
+        if st.session_state.processing_mode == "Download Video":
+            st.slider("Max Download Size (MB)", 10, 100, 50, key='max_size')
         
         st.markdown("---")
         
@@ -326,88 +3772,442 @@ def main():
         
         st.markdown("---")
         
-        # System status
-        st.subheader("🔧 System Status")
-        st.write(f"**yt-dlp:** {'✅ Available' if yt_dlp_available else '❌ Not available'}")
-        st.write(f"**Search:** {'✅ Full Search' if yt_dlp_available else '⚠️ Limited'}")
-        st.write(f"**Download:** {'✅ Available' if yt_dlp_available else '❌ Not available'}")
+        render_system_status(capabilities)
 
-    # Main content
-    col1, col2 = st.columns([2, 1])
-    
-    with col1:
-        # Search section
-        st.markdown('<div class="search-section">', unsafe_allow_html=True)
+
+def render_system_status(capabilities):
+    yt_dlp_available = capabilities['yt_dlp']
+    st.subheader("🔧 System Status")
+    st.write(f"**yt-dlp:** {'✅ Available' if yt_dlp_available else '❌ Not available'}")
+    st.write(f"**Search:** {'✅ Full Search' if yt_dlp_available else '⚠️ Limited'}")
+    st.write(f"**Download:** {'✅ Available' if yt_dlp_available else '❌ Not available'}")
+    breaker = get_backend().backend.breaker
+    if breaker.is_open:
+        st.write(f"**Upstream:** ⚠️ Failing, next attempt in {breaker.retry_in():.0f}s")
+    else:
+        st.write(f"**Upstream:** ✅ Healthy ({breaker.stats['failures']} failures, "
+                 f"{get_backend().backend.stats['retries']} retries)")
+    st.write(f"**Offline index:** {get_search_index().size():,} videos")
+    search_stats = get_search_cache().stats
+    st.write(f"**Search cache:** {search_stats['hits'] + search_stats['disk_hits'] + search_stats['stale_hits']} hits / "
+             f"{search_stats['misses']} misses")
+    first_result = get_metrics().summary('search_first_result')
+    if first_result:
+        st.write(f"**Time to first result:** {first_result['p50'] * 1000:.0f} ms p50 / "
+                 f"{first_result['p95'] * 1000:.0f} ms p95")
+    flight_stats = get_backend().flight.stats
+    st.write(f"**Coalesced calls:** {flight_stats['coalesced']} saved of "
+             f"{flight_stats['coalesced'] + flight_stats['executed']}")
+    st.write(f"**Active downloads:** {get_download_jobs().active_count()}")
+    metrics = get_metrics()
+    session_bytes, sessions = metrics.session_bytes()
+    st.write(f"**Child processes:** {get_subprocess_executor().running} running")
+    st.write(f"**Session state:** {session_bytes / 1024:.0f} KB across {sessions} session(s)")
+    blobs = get_session_blobs()
+    st.write(f"**Session blobs:** {blobs.memory_bytes / 1024 / 1024:.1f} of {blobs.budget / 1024 / 1024:.0f} MB "
+             f"in memory, {blobs.disk_bytes() / 1024 / 1024:.1f} MB spilled")
+    rerun = metrics.summary('rerun')
+    if rerun:
+        st.write(f"**Rerun time:** {rerun['p50'] * 1000:.0f} ms p50 / {rerun['p95'] * 1000:.0f} ms p95")
+    with st.expander("⏱️ Timings"):
+        rows = [f"| {name} | {s['count']} | {s['p50'] * 1000:.1f} | {s['p95'] * 1000:.1f} |"
+                for name, s in metrics.spans().items()]
+        if rows:
+            st.markdown("| Span | Count | p50 ms | p95 ms |\n|---|---:|---:|---:|\n" + "\n".join(rows))
+        else:
+            st.caption("No timings recorded yet")
+        cache_rows = {}
+        for labels, count in metrics.collect('cache_events_total'):
+            cache_rows.setdefault(labels['cache'], {})[labels['event']] = count
+        for cache, events in cache_rows.items():
+            st.caption(f"{cache}: " + ", ".join(f"{event} {count}" for event, count in events.items()))
+        if media_base_url():
+            st.caption(f"Prometheus metrics at {media_base_url()}/metrics")
+    st.write(f"**ffmpeg:** {'✅ Available' if capabilities['ffmpeg'] else '❌ Not available'}")
+    if capabilities['version']:
+        st.caption(f"yt-dlp {capabilities['version']} ({capabilities['backend']}), "
+                   f"checked {int(time.time() - capabilities['probed_at'])}s ago")
+
+
+@st.fragment
+def render_search_results():
+    """Search form and result cards; searching reruns only this fragment"""
+    with fragment_scope('results'):
+        rerun_app_if_requested()
+        yt_dlp_available = get_capabilities().get()['yt_dlp']
         
-        # Tab selection
-        search_tab, url_tab = st.tabs(["🔍 Search Videos", "🔗 Direct URL"])
+        st.subheader("Search YouTube Videos")
         
-        with search_tab:
-            st.subheader("Search YouTube Videos")
+        # Search input
+        search_query = st.text_input(
+            "Search for videos:",
+            value=st.session_state.get('search_query', ''),
+            placeholder="Enter keywords, artist name, song title, etc.",
+            help="Search for any video by keywords"
+        )
+        
+        col_search1, col_search2 = st.columns(2)
+        
+        with col_search1:
+            search_btn = st.button("🔍 Search Videos", type="primary") or st.session_state.pop('search_requested', False)
+        
+        with col_search2:
+            clear_btn = st.button("🗑️ Clear Results")
+        
+        if clear_btn:
+            get_stream_prefetcher().cancel(session_key())
+            drop_session_blob('search_results')
+            st.session_state.pop('search_paging', None)
+            st.session_state.selected_video = None
+            st.rerun()
+        
+        # Autocomplete from the offline index: the word being typed, completed with words seen before
+        if search_query and not search_btn:
+            suggestions = [text for text in get_search_index().suggest(search_query, 4)
+                           if text != normalize_query(search_query)]
+            for column, suggestion in zip(st.columns(4), suggestions):
+                if column.button(f"🔎 {suggestion}", key=f"suggest_{suggestion}"):
+                    st.session_state.search_query = suggestion
+                    st.session_state.search_requested = True
+                    st.rerun()
+        
+        page_size = st.session_state.page_size
+        
+        # Perform search
+        streamed = False
+        if search_btn and search_query:
+            if yt_dlp_available:
+                # Render each result card as soon as yt-dlp emits it
+                status = st.empty()
+                header = st.empty()
+                status.info("🔍 Searching YouTube...")
+                results = stream_video_cards(iter_search_youtube_videos(search_query, page_size), header=header)
+                streamed = True
+                
+                set_session_blob('search_results', results)
+                st.session_state.search_paging = {
+                    'query': search_query,
+                    'page_size': page_size,
+                    'next_start': len(results) + 1,
+                    'exhausted': len(results) < page_size,
+                }
+                if results:
+                    prefetch_search_page(search_query, page_size, len(results) + 1)
+                if st.session_state.prefetch:
+                    # A new result list supersedes whatever the previous search queued
+                    get_stream_prefetcher().schedule(
+                        session_key(), [v['url'] for v in results[:PREFETCH_TOP_K]], st.session_state.quality
+                    )
+                if results:
+                    status.success(f"✅ Found {len(results)} videos!")
+                else:
+                    status.error("❌ No videos found. Try different keywords.")
+            else:
+                with st.spinner("Searching YouTube..."):
+                    results = search_youtube_fallback(search_query, page_size)
+                    st.warning("⚠️ Searching only videos seen before. Install yt-dlp for full search capabilities.")
+                    
+                    set_session_blob('search_results', results)
+                    st.session_state.pop('search_paging', None)
+                    if results:
+                        st.success(f"✅ Found {len(results)} videos!")
+                    else:
+                        st.error("❌ No videos found. Try different keywords.")
+        
+        # Display search results
+        search_results = results if streamed else session_blob('search_results', [])
+        if not streamed:
+            header = st.empty()
+        if not search_results:
+            # The result list was dropped or expired; paging on from its end would skip the first pages
+            st.session_state.pop('search_paging', None)
+            st.session_state.pop('load_more_requested', None)
+        elif not streamed:
+            header.subheader(f"📺 Search Results ({len(search_results)} videos)")
             
-            # Search input
-            search_query = st.text_input(
-                "Search for videos:",
-                value=st.session_state.get('search_query', ''),
-                placeholder="Enter keywords, artist name, song title, etc.",
-                help="Search for any video by keywords"
+            thumbnails = get_thumbnail_service().prefetch(v.get('thumbnail') for v in search_results)
+            for i, video in enumerate(search_results):
+                url = video.get('thumbnail')
+                render_video_card(i, video, (thumbnails.get(url) or url) if url else None)
+        
+        # Load more: fetch only the next window, usually already sitting in the cache from the prefetch
+        paging = st.session_state.get('search_paging')
+        if paging and st.session_state.pop('load_more_requested', False) and not paging['exhausted']:
+            size = min(paging['page_size'], SEARCH_MAX_RESULTS - paging['next_start'] + 1)
+            errors = []
+            page = stream_video_cards(
+                iter_search_youtube_videos(paging['query'], size, paging['next_start'], errors),
+                offset=len(search_results), header=header
             )
+            search_results = search_results + page
+            set_session_blob('search_results', search_results)
+            paging['next_start'] += len(page)
+            # A page cut short by an error is not the end of the results; keep the button to try again
+            paging['exhausted'] = (len(page) < size and not errors) or paging['next_start'] > SEARCH_MAX_RESULTS
+            if not paging['exhausted']:
+                prefetch_search_page(paging['query'], paging['page_size'], paging['next_start'])
+        
+        if paging and not paging['exhausted'] and search_results:
+            st.button(f"⬇️ Load {paging['page_size']} more", on_click=request_load_more)
+
+
+@st.fragment
+def render_selected_video():
+    """Selected-video panel; its processing buttons rerun only this fragment"""
+    with fragment_scope('selected'):
+        rerun_app_if_requested()
+        video = st.session_state.selected_video
+        if not video:
+            return
+        capabilities = get_capabilities().get()
+        yt_dlp_available = capabilities['yt_dlp']
+        processing_mode = st.session_state.processing_mode
+        quality = st.session_state.quality
+        max_size = st.session_state.get('max_size', 50)
+        
+        st.subheader("🎬 Selected Video")
+        
+        # Display selected video info
+        col_vid1, col_vid2 = st.columns([1, 2])
+        
+        with col_vid1:
+            if video.get('thumbnail'):
+                st.image(thumbnail_image(video['thumbnail']), width=200)
+        
+        with col_vid2:
+            st.write(f"**Title:** {video['title']}")
+            st.write(f"**Channel:** {video['uploader']}")
+            if video.get('duration'):
+                st.write(f"**Duration:** {format_duration(video['duration'])}")
+            st.write(f"**URL:** {video['url']}")
+        
+        # Processing buttons
+        st.subheader("🔧 Process Video")
+        
+        col_proc1, col_proc2, col_proc3 = st.columns(3)
+        
+        with col_proc1:
+            if st.button("📋 Get Full Info"):
+                with st.spinner("Getting detailed video information..."):
+                    if yt_dlp_available:
+                        detailed_info = get_video_info(video['url'], fallback=video)
+                        if detailed_info:
+                            set_session_blob('detailed_info', detailed_info)
+                            st.success("✅ Detailed info retrieved!")
+                        else:
+                            st.error("❌ Failed to get detailed info")
+                    else:
+                        st.error("❌ yt-dlp not available")
+        
+        with col_proc2:
+            if processing_mode == "Stream URL":
+                if st.button("🔗 Get Stream URL"):
+                    with st.spinner("Getting stream URL..."):
+                        if yt_dlp_available:
+                            stream_url = get_video_stream_url(video['url'], quality)
+                            if stream_url:
+                                st.session_state.stream_url = stream_url
+                                st.success("✅ Stream URL obtained!")
+                            else:
+                                st.error("❌ Failed to get stream URL")
+                        else:
+                            st.error("❌ yt-dlp not available")
             
-            col_search1, col_search2 = st.columns(2)
-            
-            with col_search1:
-                search_btn = st.button("🔍 Search Videos", type="primary")
+            elif processing_mode == "Download Video":
+                if st.button("📥 Download Video"):
+                    if yt_dlp_available:
+                        st.session_state.pop('video_file', None)
+                        st.session_state.download_job = get_download_jobs().submit(video['url'], max_size)
+                    else:
+                        st.error("❌ yt-dlp not available")
+                
+                if 'download_job' in st.session_state:
+                    render_download_progress()
+                elif 'download_error' in st.session_state:
+                    st.error(f"❌ Download failed: {st.session_state.pop('download_error')}")
             
-            with col_search2:
-                clear_btn = st.button("🗑️ Clear Results")
+            elif processing_mode == "Audio Only":
+                if st.button("🎵 Extract Audio"):
+                    if capabilities['audio']:
+                        st.session_state.pop('audio_file', None)
+                        st.session_state.audio_job = get_download_jobs().submit_audio(video['url'])
+                    else:
+                        st.error("❌ ffmpeg not available")
+                
+                if 'audio_job' in st.session_state:
+                    render_audio_progress()
+                elif 'audio_error' in st.session_state:
+                    st.error(f"❌ Audio extraction failed: {st.session_state.pop('audio_error')}")
             
-            if clear_btn:
-                st.session_state.search_results = []
+            else:  # YouTube Embed
+                if st.button("🎥 Embed Video"):
+                    video_id = extract_video_id(video['url'])
+                    if video_id:
+                        st.session_state.embed_id = video_id
+                        st.success("✅ Video embedded!")
+        
+        with col_proc3:
+            if st.button("🗑️ Clear Selection"):
                 st.session_state.selected_video = None
+                drop_session_blob('detailed_info')
+                if 'stream_url' in st.session_state:
+                    del st.session_state.stream_url
+                if 'video_file' in st.session_state:
+                    del st.session_state.video_file
+                if 'download_job' in st.session_state:
+                    del st.session_state.download_job
+                if 'audio_job' in st.session_state:
+                    del st.session_state.audio_job
+                if 'audio_file' in st.session_state:
+                    del st.session_state.audio_file
                 st.rerun()
+        
+        # Display results
+        info = session_blob('detailed_info')
+        if info:
+            st.subheader("📊 Detailed Information")
             
-            # Perform search
-            if search_btn and search_query:
-                with st.spinner("Searching YouTube..."):
-                    if yt_dlp_available:
-                        results = search_youtube_videos(search_query, max_results)
-                    else:
-                        results = search_youtube_fallback(search_query, max_results)
-                        st.warning("⚠️ Using limited search. Install yt-dlp for full search capabilities.")
-                    
-                    st.session_state.search_results = results
-                    if results:
-                        st.success(f"✅ Found {len(results)} videos!")
-                    else:
-                        st.error("❌ No videos found. Try different keywords.")
+            col_det1, col_det2 = st.columns(2)
+            with col_det1:
+                st.write(f"**Title:** {info['title']}")
+                st.write(f"**Channel:** {info['uploader']}")
+                st.write(f"**Duration:** {format_duration(info['duration'])}")
+            
+            with col_det2:
+                st.write(f"**Views:** {info['view_count']:,}" if info['view_count'] else "**Views:** Unknown")
+                st.write(f"**Upload Date:** {info['upload_date']}")
+                st.write(f"**Available Formats:** {info['formats_count']}")
+            
+            with st.expander("Description"):
+                st.write(info['description'])
+        
+        render_player(video)
+
+
+@st.fragment
+def read_media_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def render_inline_media(entry, mime, label, file_name):
+    """Player and download button served by Streamlit itself, for browsers the media endpoint is hidden from"""
+    if entry['size'] > MEDIA_INLINE_MAX_BYTES:
+        st.info("This file is too large to play through the app. Set MEDIA_BASE_URL to the media endpoint's "
+                "public address to play it.")
+    elif mime.startswith('video/'):
+        st.video(entry['path'])
+    else:
+        st.audio(entry['path'], format=mime)
+    # Read only when clicked, so reruns don't hold another copy of the file per session
+    st.download_button(label, lambda: read_media_file(entry['path']), file_name=file_name, mime=mime)
+
+
+def render_player(video):
+    """Players for whatever the panel has produced for the selected video"""
+    with fragment_scope('player'):
+        if 'stream_url' in st.session_state:
+            st.subheader("🔗 Stream URL")
+            stream_url = st.session_state.stream_url
+            st.code(stream_url)
+            st.markdown(f"[🎬 Open in External Player]({stream_url})")
             
-            # Display search results
-            if st.session_state.search_results:
-                st.subheader(f"📺 Search Results ({len(st.session_state.search_results)} videos)")
+            # Try to embed stream
+            try:
+                st.video(stream_url)
+            except:
+                st.warning("⚠️ Cannot embed this stream. Use the URL above in VLC or another video player.")
+        
+        if 'video_file' in st.session_state:
+            st.subheader("🎬 Video Player")
+            video_file = st.session_state.video_file
+            entry = get_media_cache().entry(video_file['name'])
+            if entry is None:
+                st.warning("⚠️ This video has been evicted from the cache. Download it again.")
+            elif media_base_url() is not None:
+                video_html = create_video_player(video_file)
+                st.markdown(video_html, unsafe_allow_html=True)
                 
-                for i, video in enumerate(st.session_state.search_results):
-                    with st.container():
-                        col_thumb, col_info, col_action = st.columns([1, 3, 1])
-                        
-                        with col_thumb:
-                            # Display thumbnail
-                            if video.get('thumbnail'):
-                                st.image(video['thumbnail'], width=120)
-                        
-                        with col_info:
-                            st.write(f"**{video['title']}**")
-                            st.write(f"👤 {video['uploader']}")
-                            if video.get('duration'):
-                                st.write(f"⏱️ {format_duration(video['duration'])}")
-                            if video.get('view_count'):
-                                st.write(f"👁️ {video['view_count']:,} views")
-                        
-                        with col_action:
-                            if st.button("▶️ Select", key=f"select_{i}"):
-                                st.session_state.selected_video = video
-                                st.success(f"Selected: {video['title'][:30]}...")
-                        
-                        st.divider()
+                # Download button, once the file is complete
+                if 'download_job' not in st.session_state:
+                    st.link_button(
+                        "📥 Download Video File",
+                        media_url(video_file, download_name=f"{video['title'][:30]}.mp4")
+                    )
+            elif entry.get('live'):
+                st.info("The video can be played once the download finishes.")
+            else:
+                # The browser cannot reach the media endpoint; let Streamlit serve the cached file
+                render_inline_media(entry, "video/mp4", "📥 Download Video File", f"{video['title'][:30]}.mp4")
+        
+        if 'audio_file' in st.session_state:
+            st.subheader("🎵 Audio Player")
+            audio_file = st.session_state.audio_file
+            audio_type = 'audio/webm' if audio_file['ext'] == 'webm' else 'audio/mp4'
+            entry = get_media_cache().entry(audio_file['name'])
+            if entry is None:
+                st.warning("⚠️ This audio has been evicted from the cache. Extract it again.")
+            elif media_base_url() is not None:
+                st.markdown(f"""
+                <audio controls preload="auto" style="width: 100%">
+                    <source src="{media_url(audio_file)}" type="{audio_type}">
+                    Your browser does not support the audio tag.
+                </audio>
+                """, unsafe_allow_html=True)
+                if 'audio_job' not in st.session_state:
+                    st.link_button(
+                        "📥 Download Audio File",
+                        media_url(audio_file, download_name=f"{video['title'][:30]}.{audio_file['ext']}")
+                    )
+            elif entry.get('live'):
+                st.info("The audio can be played once extraction finishes.")
+            else:
+                # The browser cannot reach the media endpoint; let Streamlit serve the cached file
+                render_inline_media(entry, audio_type, "📥 Download Audio File",
+                                    f"{video['title'][:30]}.{audio_file['ext']}")
+        
+        if 'embed_id' in st.session_state:
+            st.subheader("🎥 Embedded Video")
+            embed_id = st.session_state.embed_id
+            
+            embed_html = f"""
+            <iframe width="100%" height="400" 
+                    src="https://www.youtube.com/embed/{embed_id}" 
+                    frameborder="0" allowfullscreen>
+            </iframe>
+            """
+            
+            st.markdown(embed_html, unsafe_allow_html=True)
+            st.warning("⚠️ This will only work if YouTube is not blocked in your network.")
+
+
+def main():
+    st.markdown('<h1 class="main-header">🎬 YouTube Search & Player</h1>', unsafe_allow_html=True)
+    
+    # Initialize session state; result lists live in the session blob store, see SessionBlobStore
+    if 'selected_video' not in st.session_state:
+        st.session_state.selected_video = None
+    
+    # Check if yt-dlp is available (probed once per process, see CapabilityRegistry)
+    capabilities = get_capabilities().get()
+    yt_dlp_available = capabilities['yt_dlp']
+    
+    # Sidebar
+    with st.sidebar:
+        render_sidebar()
+
+    # Main content
+    col1, col2 = st.columns([2, 1])
+    
+    with col1:
+        # Search section
+        st.markdown('<div class="search-section">', unsafe_allow_html=True)
+        
+        # Tab selection
+        search_tab, url_tab = st.tabs(["🔍 Search Videos", "🔗 Direct URL"])
+        
+        with search_tab:
+            render_search_results()
         
         with url_tab:
             st.subheader("Enter Direct YouTube URL")
@@ -439,147 +4239,7 @@ def main():
         
         # Video processing section
         if st.session_state.selected_video:
-            video = st.session_state.selected_video
-            
-            st.subheader("🎬 Selected Video")
-            
-            # Display selected video info
-            col_vid1, col_vid2 = st.columns([1, 2])
-            
-            with col_vid1:
-                if video.get('thumbnail'):
-                    st.image(video['thumbnail'], width=200)
-            
-            with col_vid2:
-                st.write(f"**Title:** {video['title']}")
-                st.write(f"**Channel:** {video['uploader']}")
-                if video.get('duration'):
-                    st.write(f"**Duration:** {format_duration(video['duration'])}")
-                st.write(f"**URL:** {video['url']}")
-            
-            # Processing buttons
-            st.subheader("🔧 Process Video")
-            
-            col_proc1, col_proc2, col_proc3 = st.columns(3)
-            
-            with col_proc1:
-                if st.button("📋 Get Full Info"):
-                    with st.spinner("Getting detailed video information..."):
-                        if yt_dlp_available:
-                            detailed_info = get_video_info(video['url'])
-                            if detailed_info:
-                                st.session_state.detailed_info = detailed_info
-                                st.success("✅ Detailed info retrieved!")
-                            else:
-                                st.error("❌ Failed to get detailed info")
-                        else:
-                            st.error("❌ yt-dlp not available")
-            
-            with col_proc2:
-                if processing_mode == "Stream URL":
-                    if st.button("🔗 Get Stream URL"):
-                        with st.spinner("Getting stream URL..."):
-                            if yt_dlp_available:
-                                stream_url = get_video_stream_url(video['url'], quality)
-                                if stream_url:
-                                    st.session_state.stream_url = stream_url
-                                    st.success("✅ Stream URL obtained!")
-                                else:
-                                    st.error("❌ Failed to get stream URL")
-                            else:
-                                st.error("❌ yt-dlp not available")
-                
-                elif processing_mode == "Download Video":
-                    if st.button("📥 Download Video"):
-                        with st.spinner(f"Downloading video (max {max_size}MB)..."):
-                            if yt_dlp_available:
-                                video_data = download_small_video(video['url'], max_size)
-                                if video_data:
-                                    st.session_state.video_data = video_data
-                                    st.success(f"✅ Video downloaded! ({len(video_data)/1024/1024:.1f} MB)")
-                                else:
-                                    st.error("❌ Download failed")
-                            else:
-                                st.error("❌ yt-dlp not available")
-                
-                else:  # YouTube Embed
-                    if st.button("🎥 Embed Video"):
-                        video_id = extract_video_id(video['url'])
-                        if video_id:
-                            st.session_state.embed_id = video_id
-                            st.success("✅ Video embedded!")
-            
-            with col_proc3:
-                if st.button("🗑️ Clear Selection"):
-                    st.session_state.selected_video = None
-                    if 'detailed_info' in st.session_state:
-                        del st.session_state.detailed_info
-                    if 'stream_url' in st.session_state:
-                        del st.session_state.stream_url
-                    if 'video_data' in st.session_state:
-                        del st.session_state.video_data
-                    st.rerun()
-            
-            # Display results
-            if 'detailed_info' in st.session_state:
-                st.subheader("📊 Detailed Information")
-                info = st.session_state.detailed_info
-                
-                col_det1, col_det2 = st.columns(2)
-                with col_det1:
-                    st.write(f"**Title:** {info['title']}")
-                    st.write(f"**Channel:** {info['uploader']}")
-                    st.write(f"**Duration:** {format_duration(info['duration'])}")
-                
-                with col_det2:
-                    st.write(f"**Views:** {info['view_count']:,}" if info['view_count'] else "**Views:** Unknown")
-                    st.write(f"**Upload Date:** {info['upload_date']}")
-                    st.write(f"**Available Formats:** {info['formats_count']}")
-                
-                with st.expander("Description"):
-                    st.write(info['description'])
-            
-            if 'stream_url' in st.session_state:
-                st.subheader("🔗 Stream URL")
-                stream_url = st.session_state.stream_url
-                st.code(stream_url)
-                st.markdown(f"[🎬 Open in External Player]({stream_url})")
-                
-                # Try to embed stream
-                try:
-                    st.video(stream_url)
-                except:
-                    st.warning("⚠️ Cannot embed this stream. Use the URL above in VLC or another video player.")
-            
-            if 'video_data' in st.session_state:
-                st.subheader("🎬 Video Player")
-                video_data = st.session_state.video_data
-                video_html = create_video_player(video_data)
-                
-                if video_html:
-                    st.markdown(video_html, unsafe_allow_html=True)
-                
-                # Download button
-                st.download_button(
-                    label="📥 Download Video File",
-                    data=video_data,
-                    file_name=f"{video['title'][:30]}.mp4",
-                    mime="video/mp4"
-                )
-            
-            if 'embed_id' in st.session_state:
-                st.subheader("🎥 Embedded Video")
-                embed_id = st.session_state.embed_id
-                
-                embed_html = f"""
-                <iframe width="100%" height="400" 
-                        src="https://www.youtube.com/embed/{embed_id}" 
-                        frameborder="0" allowfullscreen>
-                </iframe>
-                """
-                
-                st.markdown(embed_html, unsafe_allow_html=True)
-                st.warning("⚠️ This will only work if YouTube is not blocked in your network.")
+            render_selected_video()
     
     with col2:
         # Help and tips
@@ -633,7 +4293,7 @@ def main():
             st.write(f"Channel: {video['uploader']}")
             
             if video.get('thumbnail'):
-                st.image(video['thumbnail'], width=150)
+                st.image(thumbnail_image(video['thumbnail']), width=150)
 
     # Footer
     st.markdown("---")
@@ -644,5 +4304,14 @@ def main():
     </div>
     """, unsafe_allow_html=True)
 
+if BATCH_MODE:
+    sys.exit(batch_main(sys.argv[2:]))
+
 if __name__ == "__main__":
-    main()
+    metrics = get_metrics()
+    try:
+        # Child processes started by this run are killed once Streamlit preempts it
+        with cancel_scope(script_run_cancelled), metrics.span('rerun', trace=True):
+            main()
+    finally:
+        metrics.set_session_bytes(session_key(), estimate_size(st.session_state.to_dict()))
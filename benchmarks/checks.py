@@ -0,0 +1,506 @@
+"""Behaviour checks for app.py.
+
+Runs against the same offline environment as run.py (the yt-dlp stub, a scratch cache and a local
+media server) and covers the concurrency helpers whose failure modes the benchmarks would not notice.
+
+    python benchmarks/checks.py            # run every check; exit 1 if any fails
+    python benchmarks/checks.py NAME...    # run only the named checks
+"""
+import argparse
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import types
+
+from run import APP_PATH, REPO_DIR, prepare_environment
+
+CHECKS = {}
+
+
+def check(fn):
+    CHECKS[fn.__name__] = fn
+    return fn
+
+
+def expect(condition, message):
+    if not condition:
+        raise AssertionError(message)
+
+
+# Appended to app.py: on the second run, ask the executor singleton (created by the first run) to
+# start a child under a scope that is already cancelled
+RERUN_CANCEL_PROBE = '''
+if st.session_state.get('probe_runs', 0) == 1:
+    _started = time.monotonic()
+    try:
+        with cancel_scope(lambda: True):
+            get_subprocess_executor().run([sys.executable, '-c', 'import time; time.sleep(5)'])
+        st.session_state.probe_result = 'finished'
+    except CancelledError:
+        st.session_state.probe_result = 'cancelled'
+    st.session_state.probe_seconds = time.monotonic() - _started
+st.session_state.probe_runs = st.session_state.get('probe_runs', 0) + 1
+'''
+
+
+@check
+def rerun_can_cancel_child(app):
+    from streamlit.testing.v1 import AppTest
+
+    with open(APP_PATH) as f:
+        source = f.read()
+    at = AppTest.from_string(source + RERUN_CANCEL_PROBE, default_timeout=60)
+    at.run()
+    at.run()
+    expect(at.session_state.probe_result == 'cancelled',
+           f"child started on the second run was {at.session_state.probe_result}, not cancelled")
+    expect(at.session_state.probe_seconds < 2, f"cancelling took {at.session_state.probe_seconds:.1f}s")
+
+
+def wait_for_job(jobs, job_id, timeout=30):
+    deadline = time.monotonic() + timeout
+    while True:
+        job = jobs.status(job_id)
+        if job['status'] in ('done', 'failed'):
+            return job
+        expect(time.monotonic() < deadline, f"job {job_id} still {job['status']} after {timeout}s")
+        time.sleep(0.05)
+
+
+@check
+def evicted_download_is_fetched_again(app):
+    jobs = app.DownloadJobManager(workers=1)
+    url = 'https://www.youtube.com/watch?v=checkevict1'
+    first = wait_for_job(jobs, jobs.submit(url))
+    expect(first['status'] == 'done', f"first download {first['status']}: {first['error']}")
+    os.unlink(first['entry']['path'])
+
+    again = wait_for_job(jobs, jobs.submit(url))
+    expect(again['status'] == 'done', f"second download {again['status']}: {again['error']}")
+    expect(os.path.exists(again['entry']['path']), 'job for an evicted file was reused instead of rerun')
+
+
+@check
+def finished_live_file_stays_reachable(app):
+    cache = app.MediaCache(directory=tempfile.mkdtemp(prefix='media-'))
+    misses = []
+    for round_ in range(50):
+        entry = cache.start_live(f'check-live-{round_}', 'mp4')
+        with open(entry['path'], 'wb') as f:
+            f.write(os.urandom(64 * 1024))
+        finished = threading.Event()
+
+        def poll():
+            while not finished.is_set():
+                try:
+                    if cache.entry(entry['name']) is None:
+                        misses.append(round_)
+                except OSError:
+                    misses.append(round_)
+
+        poller = threading.Thread(target=poll)
+        poller.start()
+        cache.finish_live(entry['name'])
+        finished.set()
+        poller.join()
+        expect(cache.entry(entry['name']) is not None, 'finished file is not reachable under its live name')
+    expect(not misses, f"live name resolved to nothing while finishing in rounds {sorted(set(misses))}")
+
+
+@check
+def orphan_reaping_spares_reused_pids(app):
+    sleeper = [sys.executable, '-c', 'import time; time.sleep(30)']
+    dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+    dead.wait()
+    orphan = subprocess.Popen(sleeper, start_new_session=True)
+    # Stands in for an unrelated process that was given a recorded child's PID after that child exited
+    bystander = subprocess.Popen(sleeper, start_new_session=True)
+    try:
+        os.makedirs(app.CACHE_DIR, exist_ok=True)
+        with open(os.path.join(app.CACHE_DIR, f'children-{dead.pid}.pids'), 'w') as f:
+            f.write(f'{orphan.pid} {app.process_start_time(orphan.pid)}\n'
+                    f'{bystander.pid} {app.process_start_time(bystander.pid) + 1}\n')
+        app.SubprocessExecutor._reap_orphans(types.SimpleNamespace(stats={'orphans_killed': 0}))
+        expect(orphan.wait(timeout=5) == -signal.SIGKILL, 'recorded child was not killed')
+        expect(bystander.poll() is None, 'a process reusing a recorded PID was killed')
+    finally:
+        for process in (orphan, bystander):
+            process.kill()
+            process.wait()
+
+
+@check
+def download_bandwidth_is_shared(app):
+    from concurrent.futures import CancelledError
+
+    bandwidth = app.DownloadBandwidth(rate=3_000_000, slots=2)
+    lock = threading.Lock()
+    running, peak, rates = [0], [0], []
+
+    def download():
+        with bandwidth.share() as rate:
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+                rates.append(rate)
+            time.sleep(0.2)
+            with lock:
+                running[0] -= 1
+
+    threads = [threading.Thread(target=download) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    expect(peak[0] == 2, f"{peak[0]} downloads ran at once with 2 shares")
+    expect(rates == [1_500_000] * 5, f"shares were {rates}")
+
+    with bandwidth.share(), bandwidth.share():
+        started = time.monotonic()
+        try:
+            with app.cancel_scope(lambda: time.monotonic() - started > 0.2), bandwidth.share():
+                raise AssertionError('a third share was handed out')
+        except CancelledError:
+            pass
+
+
+def in_thread(fn):
+    """Start fn on a thread; the returned join() gives back its result or raises its error"""
+    outcome = {}
+
+    def target():
+        try:
+            outcome['result'] = fn()
+        except BaseException as e:
+            outcome['error'] = e
+
+    thread = threading.Thread(target=target)
+    thread.start()
+
+    def join():
+        thread.join(10)
+        expect(not thread.is_alive(), 'thread did not finish')
+        if 'error' in outcome:
+            raise outcome['error']
+        return outcome['result']
+    return join
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        expect(time.monotonic() < deadline, 'timed out waiting')
+        time.sleep(0.01)
+
+
+@check
+def single_flight_shares_errors(app):
+    flight = app.SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def failing():
+        calls.append(1)
+        release.wait(5)
+        raise ValueError('upstream said no')
+
+    leader = in_thread(lambda: flight.do('key', failing))
+    wait_until(lambda: calls)
+    follower = in_thread(lambda: flight.do('key', failing))
+    wait_until(lambda: flight.stats['coalesced'] == 1)
+    release.set()
+    for join in (leader, follower):
+        try:
+            join()
+            raise AssertionError('a caller did not see the error')
+        except ValueError:
+            pass
+    expect(len(calls) == 1, f"failing call ran {len(calls)} times")
+
+
+@check
+def single_flight_survives_abandoned_leader(app):
+    from concurrent.futures import CancelledError
+
+    flight = app.SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def cancelled_then_ok():
+        calls.append(1)
+        if len(calls) == 1:
+            release.wait(5)
+            raise CancelledError()
+        return 'result'
+
+    leader = in_thread(lambda: flight.do('key', cancelled_then_ok))
+    wait_until(lambda: calls)
+    follower = in_thread(lambda: flight.do('key', cancelled_then_ok))
+    wait_until(lambda: flight.stats['coalesced'] == 1)
+    release.set()
+    try:
+        leader()
+        raise AssertionError('the cancelled leader returned')
+    except CancelledError:
+        pass
+    expect(follower() == 'result', 'follower did not take over from the cancelled leader')
+
+    # Streams: a follower replays what the leader had yielded, then continues on its own from there
+    release.clear()
+    streamed = []
+
+    def iterate():
+        streamed.append(1)
+        yield from 'ab'
+        release.wait(5)
+        yield from 'cd'
+
+    stream = flight.stream('stream', iterate)
+    expect(next(stream) + next(stream) == 'ab', 'leader stream yielded the wrong items')
+    follower = in_thread(lambda: ''.join(flight.stream('stream', iterate)))
+    wait_until(lambda: flight.stats['coalesced'] == 2)
+    stream.close()
+    release.set()
+    expect(follower() == 'abcd', 'follower lost or repeated items after the leader stopped')
+    expect(len(streamed) == 2, f"stream ran {len(streamed)} times")
+
+
+@check
+def single_flight_stream_shares_errors(app):
+    flight = app.SingleFlight()
+    release = threading.Event()
+
+    def iterate():
+        yield 'a'
+        release.wait(5)
+        raise ValueError('upstream said no')
+
+    stream = flight.stream('key', iterate)
+    expect(next(stream) == 'a', 'leader stream yielded the wrong item')
+    items = []
+
+    def follow():
+        for item in flight.stream('key', iterate):
+            items.append(item)
+
+    follower = in_thread(follow)
+    wait_until(lambda: flight.stats['coalesced'] == 1)
+    release.set()
+    for join in (lambda: list(stream), follower):
+        try:
+            join()
+            raise AssertionError('a stream did not see the error')
+        except ValueError:
+            pass
+    expect(items == ['a'], f"follower saw {items}")
+
+
+def raises(error_type, fn):
+    try:
+        fn()
+    except error_type:
+        return True
+    return False
+
+
+@check
+def circuit_breaker_trial_and_reopen(app):
+    breaker = app.CircuitBreaker(threshold=2, reset_timeout=0.2)
+    expect(breaker.allow() is False, 'closed circuit treated a call as a trial')
+    breaker.record(False)
+    expect(not breaker.is_open, 'circuit opened before reaching its threshold')
+    breaker.record(False)
+    expect(breaker.is_open and raises(ConnectionError, breaker.allow), 'circuit did not open at its threshold')
+
+    time.sleep(0.25)
+    expect(breaker.allow() is True, 'no trial call was let through after reset_timeout')
+    expect(raises(ConnectionError, breaker.allow), 'a second trial ran alongside the first')
+    breaker.record(None, trial=True)
+    expect(breaker.allow() is True, 'a cancelled trial did not free the trial slot')
+
+    breaker.record(False, trial=True)
+    expect(breaker.is_open and breaker.retry_in() > 0.1, 'a failed trial did not reopen the circuit for reset_timeout')
+    expect(raises(ConnectionError, breaker.allow), 'calls went through right after a failed trial')
+
+    time.sleep(0.25)
+    expect(breaker.allow() is True, 'no trial call after the circuit reopened')
+    breaker.record(True, trial=True)
+    expect(not breaker.is_open and breaker.allow() is False, 'a successful trial did not close the circuit')
+    breaker.record(False)
+    expect(not breaker.is_open, 'failures from before the circuit closed were still counted')
+
+
+@check
+def token_bucket_paces_calls(app):
+    bucket = app.TokenBucket(rate=20, burst=2)
+    started = time.monotonic()
+    for _ in range(2):
+        bucket.take()
+    expect(time.monotonic() - started < 0.05, 'the burst was throttled')
+    for _ in range(4):
+        bucket.take()
+    elapsed = time.monotonic() - started
+    expect(0.15 < elapsed < 0.5, f"4 calls past the burst at 20/s took {elapsed:.2f}s")
+    expect(bucket.stats == {'taken': 6, 'throttled': 4}, f"stats were {bucket.stats}")
+
+    unlimited = app.TokenBucket(rate=0, burst=1)
+    started = time.monotonic()
+    for _ in range(100):
+        unlimited.take()
+    expect(time.monotonic() - started < 0.05, 'a rate of 0 still throttled')
+
+
+def interrupted_download(app, source):
+    """Start a chunked download of the stub media server's file and cancel it halfway; returns its manifest"""
+    from concurrent.futures import CancelledError
+
+    halfway = threading.Event()
+
+    def progress(downloaded, total, speed):
+        if downloaded >= total // 2:
+            halfway.set()
+
+    fmt = {'url': os.environ['BENCH_MEDIA_URL']}
+    with app.cancel_scope(halfway.is_set):
+        expect(raises(CancelledError, lambda: app.ChunkedDownload(source, fmt, 'mp4', progress).run()),
+               'download finished before it could be interrupted')
+    with open(app.ChunkedDownload(source, fmt, 'mp4').manifest_path) as f:
+        return json.load(f)
+
+
+@check
+def chunked_download_resumes(app):
+    import requests
+
+    source = f'check-resume-{time.time_ns()}'
+    manifest = interrupted_download(app, source)
+    kept = sum(manifest['done'])
+    expect(0 < kept < manifest['size'], f"manifest kept {kept} of {manifest['size']} bytes")
+
+    download = app.ChunkedDownload(source, {'url': os.environ['BENCH_MEDIA_URL']}, 'mp4')
+    entry = download.run()
+    expect(download._fetched == manifest['size'] - kept,
+           f"resume fetched {download._fetched} bytes, expected the {manifest['size'] - kept} missing")
+    with open(entry['path'], 'rb') as f:
+        expect(f.read() == requests.get(os.environ['BENCH_MEDIA_URL'], timeout=10).content,
+               'resumed file differs from the original')
+    expect(not os.path.exists(download.directory), 'partial download was left behind')
+
+
+@check
+def chunked_download_discards_corrupt_partial(app):
+    source = f'check-verify-{time.time_ns()}'
+    interrupted_download(app, source)
+    fmt = {'url': os.environ['BENCH_MEDIA_URL']}
+    download = app.ChunkedDownload(source, fmt, 'mp4')
+    # Bytes the manifest counts as done but that no longer hold the container signature
+    with open(download.data_path, 'r+b') as f:
+        f.write(b'\0' * 16)
+    expect(raises(RuntimeError, download.run), 'a corrupt file passed verification')
+    expect(not os.path.exists(download.directory), 'the corrupt partial download was kept for resuming')
+    expect(app.ChunkedDownload(source, fmt, 'mp4').run() is not None, 'download did not start over')
+
+
+def media_format(format_id, ext='mp4', **fields):
+    return {'format_id': format_id, 'url': f'https://example.invalid/{format_id}', 'ext': ext,
+            'vcodec': 'avc1', 'acodec': 'mp4a', **fields}
+
+
+@check
+def plan_download_respects_budget(app):
+    mb = 1000 * 1000
+    small, medium = media_format('18', filesize=10 * mb), media_format('22', filesize_approx=40 * mb)
+    large = media_format('37', filesize=120 * mb)
+    # 1000 kbps for 10 minutes is 75 MB
+    estimated = media_format('59', tbr=1000)
+    video_only = media_format('137', acodec='none', filesize=mb)
+
+    def plan(formats, duration=600):
+        return app.plan_download({'formats': formats, 'duration': duration}, 50)
+
+    expect(plan([small, medium, estimated, large, video_only]) == (medium, False),
+           'the best format within budget was not chosen')
+    unknown = media_format('43')
+    expect(plan([large, unknown]) == (unknown, False), 'a format of unknown size was not tried')
+    expect(plan([media_format('43', ext='webm')]) == (None, False), 'a plan was made without any MP4 format')
+
+    capabilities, fit_to_budget = app.get_capabilities, app.FIT_TO_BUDGET
+    try:
+        app.get_capabilities = lambda: types.SimpleNamespace(get=lambda: {'ffmpeg': True})
+        app.FIT_TO_BUDGET = True
+        expect(plan([large, estimated]) == (estimated, True), 'the smallest oversized format was not fitted')
+        app.FIT_TO_BUDGET = False
+        expect(raises(ValueError, lambda: plan([large, estimated])), 'an oversized format was planned without fitting')
+    finally:
+        app.get_capabilities, app.FIT_TO_BUDGET = capabilities, fit_to_budget
+
+
+@check
+def search_index_matches_completes_and_corrects(app):
+    index = app.SearchIndex(os.path.join(tempfile.mkdtemp(prefix='index-'), 'index.sqlite3'))
+    videos = [
+        ('lofi1', 'Lofi hip hop radio', 'Chillhop Music', 5_000_000),
+        ('lofi2', 'Lofi hip hop beats to study to', 'Lofi Girl', 90_000_000),
+        ('jazz1', 'Jazz piano for studying', 'Cafe Music', 200_000),
+        ('hotel', 'Hotel lobby jazz', 'Ambience', 1_000),
+        ('chill', 'Evening playlist', 'Chillhop Music', 10_000),
+    ]
+    index.add({'id': id, 'title': title, 'uploader': uploader, 'view_count': views, 'upload_date': '20240101'}
+              for id, title, uploader, views in videos)
+    index.flush()
+    expect(index.size() == len(videos), f"index holds {index.size()} of {len(videos)} videos")
+
+    def ids(query):
+        return [video.id for video in index.search(query)]
+
+    expect(ids('lofi hip hop') == ['lofi2', 'lofi1'], f"'lofi hip hop' found {ids('lofi hip hop')}")
+    expect(ids('jazz')[0] == 'jazz1', 'the most viewed of equal title matches was not ranked first')
+    expect(ids('lofi hip ho') == ids('lofi hip hop'), 'the last word was not completed')
+    expect(ids('pianno jazz') == ['jazz1'], f"a misspelt word found {ids('pianno jazz')}")
+    expect(ids('lofi qqqqzzzz') == ids('lofi'), 'a word matching nothing was not left out')
+    expect(ids('chillhop')[-1] == 'chill', 'a title match did not outrank an uploader-only match')
+
+    suggestions = index.suggest('lofi h')
+    expect(set(suggestions[:2]) == {'lofi hip', 'lofi hop'} and suggestions[2:] == ['lofi hotel'],
+           f"suggested {suggestions}")
+    expect(index.suggest('hotel ') == [], 'a finished word was completed')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('names', nargs='*', metavar='NAME', help=f"one of: {', '.join(CHECKS)}")
+    args = parser.parse_args()
+    unknown = set(args.names) - set(CHECKS)
+    if unknown:
+        parser.error(f"unknown checks: {', '.join(sorted(unknown))}")
+
+    logging.getLogger('streamlit').setLevel(logging.ERROR)
+    sys.path.insert(0, REPO_DIR)
+    failures = []
+    with tempfile.TemporaryDirectory(prefix='app-checks-') as work_dir:
+        prepare_environment(work_dir)
+        import app
+
+        for name in args.names or CHECKS:
+            started = time.monotonic()
+            try:
+                CHECKS[name](app)
+            except Exception:
+                failures.append(name)
+                print(f'FAIL {name}')
+                traceback.print_exc()
+            else:
+                print(f'ok   {name} ({time.monotonic() - started:.2f}s)')
+    if failures:
+        sys.exit(f"Failed: {', '.join(failures)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,431 @@
+"""Offline benchmark suite for app.py.
+
+Replaces the yt-dlp executable with benchmarks/stub_yt_dlp.py, which replays recorded
+fixtures, then measures the backend paths and full Streamlit reruns (via AppTest).
+Rerun scenarios also report the script-side time of each page fragment, which is what
+an interaction scoped to that fragment costs. Nothing touches the network.
+
+    python benchmarks/run.py                      # run and print a report
+    python benchmarks/run.py --check              # exit 1 if a p95 regressed against the baseline
+    python benchmarks/run.py --update-baseline    # record the current numbers as the baseline
+
+Stub latency and payload size are set with the BENCH_* variables documented in
+stub_yt_dlp.py; the defaults below are used when they are not set.
+"""
+import argparse
+import collections
+import io
+import itertools
+import json
+import logging
+import os
+import random
+import re
+import resource
+import socket
+import stat
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import CancelledError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+APP_PATH = os.path.join(REPO_DIR, 'app.py')
+BASELINE_PATH = os.path.join(BENCH_DIR, 'baseline.json')
+# Size of the synthetic catalog the offline search scenarios query, and of the made-up vocabulary it draws on
+INDEX_VIDEOS = 50000
+INDEX_VOCABULARY = 300000
+
+STUB_DEFAULTS = {
+    'BENCH_STARTUP_MS': '50',
+    'BENCH_LATENCY_MS': '100',
+    'BENCH_RESULT_LATENCY_MS': '20',
+    'BENCH_DOWNLOAD_BYTES': str(5 * 1024 * 1024),
+    'BENCH_DOWNLOAD_RATE': str(50 * 1024 * 1024),
+}
+
+# A 1x1 JPEG served to the app in place of YouTube thumbnails
+PIXEL_JPEG = bytes.fromhex(
+    'ffd8ffe000104a46494600010100000100010000ffdb004300080606070605080707070909080a0c140d0c0b0b0c1912130f'
+    '141d1a1f1e1d1a1c1c20242e2720222c231c1c2837292c30313434341f27393d38323c2e333432ffc0000b080001000101011100'
+    'ffc4001f0000010501010101010100000000000000000102030405060708090a0bffc400b5100002010303020403050504040000'
+    '017d01020300041105122131410613516107227114328191a1082342b1c11552d1f02433627282090a161718191a25262728292a'
+    '3435363738393a434445464748494a535455565758595a636465666768696a737475767778797a838485868788898a9293949596'
+    '9798999aa2a3a4a5a6a7a8a9aab2b3b4b5b6b7b8b9bac2c3c4c5c6c7c8c9cad2d3d4d5d6d7d8d9dae1e2e3e4e5e6e7e8e9eaf1f2'
+    'f3f4f5f6f7f8f9faffda0008010100003f00fbd3ffd9'
+)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def prepare_environment(work_dir):
+    """Point the app at the stub, a scratch cache, a local media server and free local ports"""
+    bin_dir = os.path.join(work_dir, 'bin')
+    os.makedirs(bin_dir)
+    launcher = os.path.join(bin_dir, 'yt-dlp')
+    with open(launcher, 'w') as f:
+        f.write(f'#!/bin/sh\nexec "{sys.executable}" "{os.path.join(BENCH_DIR, "stub_yt_dlp.py")}" "$@"\n')
+    os.chmod(launcher, os.stat(launcher).st_mode | stat.S_IEXEC)
+
+    for name, value in STUB_DEFAULTS.items():
+        os.environ.setdefault(name, value)
+    port = free_port()
+    os.environ.update({
+        'PATH': bin_dir + os.pathsep + os.environ['PATH'],
+        'YT_DLP_BACKEND': 'subprocess',
+        'CACHE_DIR': os.path.join(work_dir, 'cache'),
+        'MEDIA_SERVER_HOST': '127.0.0.1',
+        'MEDIA_SERVER_PORT': str(port),
+        'MEDIA_BASE_URL': f'http://127.0.0.1:{port}',
+        'PREFETCH_TOP_K': '0',
+        'BENCH_MEDIA_URL': start_media_server(int(os.environ['BENCH_DOWNLOAD_BYTES']),
+                                              float(os.environ['BENCH_DOWNLOAD_RATE'])),
+    })
+
+
+def start_thumbnail_server():
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/jpeg')
+            self.send_header('Content-Length', str(len(PIXEL_JPEG)))
+            self.send_header('ETag', '"pixel"')
+            self.end_headers()
+            self.wfile.write(PIXEL_JPEG)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def start_media_server(size, rate):
+    """Serve a file of size bytes, with byte ranges, at rate bytes per second per connection"""
+    payload = b'\x00\x00\x00\x18ftypmp42' + os.urandom(max(size - 12, 0))
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            start, end = 0, len(payload) - 1
+            match = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+            if match:
+                start = int(match.group(1))
+                end = min(int(match.group(2) or end), end)
+                self.send_response(206)
+                self.send_header('Content-Range', f'bytes {start}-{end}/{len(payload)}')
+            else:
+                self.send_response(200)
+            self.send_header('Content-Type', 'video/mp4')
+            self.send_header('Content-Length', str(end - start + 1))
+            self.end_headers()
+            block = 256 * 1024
+            try:
+                for offset in range(start, end + 1, block):
+                    chunk = payload[offset:min(offset + block, end + 1)]
+                    self.wfile.write(chunk)
+                    time.sleep(len(chunk) / rate)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def peak_rss_mb():
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(max(own, children) / 1024, 1)
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def measure(name, fn, iterations, results, warmup=False):
+    if warmup:
+        fn(-1)
+    samples = []
+    for i in range(iterations):
+        started = time.perf_counter()
+        fn(i)
+        samples.append(time.perf_counter() - started)
+    report(name, samples, results)
+
+
+def report(name, samples, results):
+    results[name] = {
+        'iterations': len(samples),
+        'p50_ms': round(percentile(samples, 0.5) * 1000, 2),
+        'p95_ms': round(percentile(samples, 0.95) * 1000, 2),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+    print(f"{name:<30} p50 {results[name]['p50_ms']:>9.2f} ms   p95 {results[name]['p95_ms']:>9.2f} ms   "
+          f"rss {results[name]['peak_rss_mb']:>7.1f} MB", flush=True)
+
+
+def run_benchmarks(iterations):
+    import app
+    import requests
+    from streamlit.testing.v1 import AppTest
+
+    ids = (f'bench{n:06d}' for n in itertools.count())
+    results = {}
+
+    # Script-side timings come from the app's span log: AppTest always reruns the whole script, while in
+    # the browser each fragment reruns on its own, so a fragment's span is the cost of interacting with it
+    spans = []
+
+    class SpanCollector(logging.Handler):
+        def emit(self, record):
+            event = json.loads(record.getMessage())
+            if event.get('event') == 'span':
+                spans.append(event)
+
+    span_log = logging.getLogger('youtube_player.metrics')
+    span_log.handlers = [SpanCollector()]
+    span_log.setLevel(logging.DEBUG)
+
+    def unique_url():
+        return f'https://www.youtube.com/watch?v={next(ids)}'
+
+    def checked(value):
+        if not value:
+            raise RuntimeError('benchmark call returned no data')
+        return value
+
+    measure('search_cold', lambda i: checked(app.search_youtube_videos(f'bench query {time.time_ns()}', 10)),
+            iterations, results)
+    measure('search_warm', lambda i: checked(app.search_youtube_videos('bench warm query', 10)), iterations, results,
+            warmup=True)
+
+    # Page 5 of a query costs one window of upstream results, not the 50 before it
+    measure('search_deep_page_cold',
+            lambda i: checked(app.search_youtube_videos(f'bench deep {time.time_ns()}', 10, start=41)),
+            iterations, results)
+
+    def first_result(i):
+        stream = app.iter_search_youtube_videos(f'bench first {time.time_ns()}', 20)
+        checked(next(stream, None))
+        stream.close()
+
+    measure('search_first_result', first_result, iterations, results)
+    measure('info_cold', lambda i: checked(app.get_video_info(unique_url())), iterations, results)
+
+    # An info document with hundreds of formats, where parse time and per-format memory show
+    multiplier = os.environ.get('BENCH_FORMAT_MULTIPLIER')
+    os.environ['BENCH_FORMAT_MULTIPLIER'] = '20'
+    spans.clear()
+    measure('info_cold_large', lambda i: checked(app.get_video_info(unique_url())), iterations, results)
+    report('info_parse_large', [e['seconds'] for e in spans if e['span'] == 'json_parse'], results)
+    if multiplier is None:
+        del os.environ['BENCH_FORMAT_MULTIPLIER']
+    else:
+        os.environ['BENCH_FORMAT_MULTIPLIER'] = multiplier
+    measure('stream_url_cold', lambda i: checked(app.get_video_stream_url(unique_url(), '720p')), iterations, results)
+    warm_url = unique_url()
+    measure('stream_url_warm', lambda i: checked(app.get_video_stream_url(warm_url, '720p')), iterations, results,
+            warmup=True)
+
+    # A batch of info lookups, paced by the upstream rate limit; malformed lines must fail on their own
+    batch_path = os.path.join(tempfile.mkdtemp(), 'batch.jsonl')
+
+    def batch_info(i):
+        with open(batch_path, 'w') as f:
+            f.writelines(json.dumps({'url': unique_url()}) + '\n' for _ in range(8))
+            f.write('42\n[1]\nnull\n{"url": \n')
+        counts = app.run_batch(app.read_batch_items([batch_path]), io.StringIO(), operations=('info',))
+        if counts != {'ok': 8, 'failed': 4, 'skipped': 0}:
+            raise RuntimeError(f'unexpected batch counts {counts}')
+
+    measure('batch_info', batch_info, max(3, iterations // 4), results)
+
+    # Every upstream call fails: after the first few retried searches the circuit opens and the rest fail fast
+    os.environ['BENCH_FAIL_RATE'] = '1'
+    measure('search_upstream_failing', lambda i: app.search_youtube_videos(f'bench failing {time.time_ns()}', 10),
+            iterations, results)
+    os.environ['BENCH_FAIL_RATE'] = '0'
+    app.get_backend().backend.breaker.record(True)
+
+    # Offline search and autocomplete over a synthetic catalog: fixture titles with Zipf-distributed frequencies,
+    # each followed by words from a long tail of made-up ones that gives every short prefix thousands of words
+    with open(os.path.join(BENCH_DIR, 'fixtures', 'search.jsonl')) as f:
+        fixture_titles = [json.loads(line)['title'] for line in f if line.strip()]
+    rng = random.Random(0)
+    common = rng.sample(fixture_titles, len(fixture_titles))
+    common_weights = list(itertools.accumulate(1 / (n + 1) for n in range(len(common))))
+    syllables = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'to', 'vi', 'ze', 'po', 'li', 'da', 'go', 'be', 'ha', 'fi', 'wu', 'ya']
+    tail = sorted({''.join(rng.choices(syllables, k=rng.randint(1, 5))) for _ in range(INDEX_VOCABULARY)})
+    rng.shuffle(tail)
+    tail_weights = list(itertools.accumulate(1 / (n + 1) for n in range(len(tail))))
+    index = app.get_search_index()
+    docs = collections.Counter()
+    for start in range(0, INDEX_VIDEOS, 10000):
+        videos = []
+        for n in range(start, min(start + 10000, INDEX_VIDEOS)):
+            title = ' '.join(rng.choices(common, cum_weights=common_weights)
+                             + rng.choices(tail, cum_weights=tail_weights, k=4))
+            uploader = rng.choice(tail).title()
+            docs.update(set(app.index_terms(f'{title} {uploader}')))
+            videos.append({'id': f'idx{n:08d}', 'title': title, 'uploader': uploader,
+                           'view_count': rng.randint(0, 10 ** 8), 'upload_date': f'{rng.randint(2010, 2025)}0101'})
+        index.add(videos)
+    index.flush()
+    print(f"offline index: {INDEX_VIDEOS} videos, {len(docs)} distinct words", flush=True)
+
+    queries = [' '.join(title.split()[:3]) for title in fixture_titles]
+    measure('offline_search', lambda i: checked(index.search(queries[i % len(queries)])), iterations, results)
+
+    # Each query with its longest word misspelled by a dropped, swapped or wrong letter
+    def misspell(query, kind):
+        words = app.index_terms(query)
+        longest = max(range(len(words)), key=lambda n: len(words[n]))
+        word = words[longest]
+        words[longest] = (word[:2] + word[3:], word[:2] + word[3] + word[2] + word[4:], word[:2] + 'q' + word[3:])[kind % 3]
+        return ' '.join(words)
+
+    typos = [misspell(q, n) for n, q in enumerate(queries) if max(map(len, app.index_terms(q))) >= 5]
+    measure('offline_search_typo', lambda i: checked(index.search(typos[i % len(typos)])), iterations, results)
+
+    prefixes = [q[:n].rstrip() for q in queries for n in (1, 2, 4)]
+    measure('offline_suggest', lambda i: checked(index.suggest(prefixes[i % len(prefixes)])), iterations, results)
+    for letter in sorted({term[0] for term in docs}):
+        best = max(count for term, count in docs.items() if term.startswith(letter))
+        top = index.suggest(letter, 1)
+        if not top or docs[top[0]] != best:
+            raise RuntimeError(f'suggest({letter!r}) returned {top}, not one of the most common words')
+
+    app.get_media_server()
+
+    def download_to_play(i):
+        jobs = app.get_download_jobs()
+        job_id = jobs.submit(unique_url(), 50)
+        while True:
+            job = jobs.status(job_id)
+            if job['status'] == 'failed':
+                raise RuntimeError(job['error'])
+            if job['entry']:
+                break
+            time.sleep(0.005)
+        response = requests.get(app.media_url(job['entry']), headers={'Range': 'bytes=0-65535'}, timeout=10)
+        response.raise_for_status()
+
+    measure('download_to_play', download_to_play, max(3, iterations // 4), results)
+
+    # Time to finish a download that was interrupted halfway; the chunks already fetched are kept
+    samples = []
+    for i in range(max(3, iterations // 4)):
+        url = unique_url()
+        halfway = threading.Event()
+
+        def progress(downloaded, total, speed):
+            if total and downloaded >= total // 2:
+                halfway.set()
+
+        try:
+            with app.cancel_scope(halfway.is_set):
+                app._download_to_cache(url, 50, progress)
+            raise RuntimeError('download finished before it could be interrupted')
+        except CancelledError:
+            pass
+        started = time.perf_counter()
+        checked(app._download_to_cache(url, 50))
+        samples.append(time.perf_counter() - started)
+    report('download_resume_halfway', samples, results)
+
+    thumbnail_base = start_thumbnail_server()
+    with open(os.path.join(BENCH_DIR, 'fixtures', 'search.jsonl')) as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+
+    for count in (5, 10, 20):
+        videos = []
+        for n, entry in enumerate(itertools.islice(itertools.cycle(entries), count)):
+            video = app._build_search_result(entry)
+            video['thumbnail'] = f'{thumbnail_base}/{n}.jpg'
+            videos.append(video)
+        # The result list lives in the app's session blob store; a zero budget writes it straight to disk,
+        # where the store inside the AppTest run finds it under the same session key
+        session = f'bench-rerun-{count}'
+        app.SessionBlobStore(budget=0).put(session, 'search_results', videos)
+        at = AppTest.from_file(APP_PATH, default_timeout=60)
+        at.session_state['session_key'] = session
+        at.session_state['selected_video'] = videos[0]
+        at.run()
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+        spans.clear()
+        measure(f'rerun_{count}_results', lambda i: at.run(), iterations, results, warmup=True)
+        for span, label in (('rerun', 'script'), ('fragment_results', 'results_fragment'),
+                            ('fragment_selected', 'selected_fragment'), ('fragment_sidebar', 'sidebar_fragment')):
+            # Skip the warmup run's sample
+            samples = [e['seconds'] for e in spans if e['span'] == span][1:]
+            report(f'{label}_{count}_results', samples, results)
+
+    return results
+
+
+def compare(results, baseline, threshold, floor_ms):
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        limit = max(previous['p95_ms'] * (1 + threshold), previous['p95_ms'] + floor_ms)
+        status = 'REGRESSED' if current['p95_ms'] > limit else 'ok'
+        print(f"{name:<30} p95 {previous['p95_ms']:>9.2f} -> {current['p95_ms']:>9.2f} ms   {status}")
+        if status != 'ok':
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--output', help='write results as JSON to this path')
+    parser.add_argument('--check', action='store_true', help='fail if any p95 regressed against the baseline')
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed relative p95 increase')
+    parser.add_argument('--floor-ms', type=float, default=5.0, help='ignore p95 increases smaller than this')
+    args = parser.parse_args()
+
+    logging.getLogger('streamlit').setLevel(logging.ERROR)
+    sys.path.insert(0, REPO_DIR)
+    with tempfile.TemporaryDirectory(prefix='app-bench-') as work_dir:
+        prepare_environment(work_dir)
+        results = run_benchmarks(args.iterations)
+
+    report = {'environment': {k: os.environ[k] for k in STUB_DEFAULTS}, 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.update_baseline:
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump(results, f, indent=2)
+            f.write('\n')
+        print(f'Baseline written to {BASELINE_PATH}')
+    if args.check:
+        if not os.path.exists(BASELINE_PATH):
+            sys.exit('No baseline recorded; run with --update-baseline first')
+        with open(BASELINE_PATH) as f:
+            regressions = compare(results, json.load(f), args.threshold, args.floor_ms)
+        if regressions:
+            sys.exit(f"Regressions: {', '.join(regressions)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+"""Offline stand-in for the yt-dlp executable used by the benchmark harness.
+
+Replays the recorded fixtures in benchmarks/fixtures with configurable latency and
+payload size, so benchmarks run without network access. Tuned through environment
+variables:
+
+    BENCH_STARTUP_MS          fixed cost per invocation, like interpreter and extractor startup
+    BENCH_LATENCY_MS          upstream wait before the first byte of output
+    BENCH_RESULT_LATENCY_MS   extra wait before each search entry
+    BENCH_FORMAT_MULTIPLIER   repeat the info fixture's format list to inflate the document
+    BENCH_DOWNLOAD_BYTES      size of the file written by downloads
+    BENCH_DOWNLOAD_RATE       simulated download speed in bytes per second
+    BENCH_FAIL_RATE           probability that an upstream call fails
+    BENCH_MEDIA_URL           serve format URLs from this local address instead of googlevideo.com
+"""
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import time
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def env_ms(name, default):
+    return float(os.environ.get(name, default)) / 1000
+
+
+def video_id_for(text, index=0):
+    alphabet = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-_'
+    digest = hashlib.sha1(f'{text}|{index}'.encode()).digest()
+    return ''.join(alphabet[b % 64] for b in digest[:11])
+
+
+def option(args, name, default=None):
+    return args[args.index(name) + 1] if name in args else default
+
+
+def fail(message):
+    print(f'ERROR: {message}', file=sys.stderr)
+    sys.exit(1)
+
+
+def upstream_wait():
+    time.sleep(env_ms('BENCH_LATENCY_MS', 100))
+    if random.random() < float(os.environ.get('BENCH_FAIL_RATE', '0')):
+        fail('[youtube] HTTP Error 429: Too Many Requests')
+
+
+def search(args, target):
+    prefix, query = target.split(':', 1)
+    count = int(prefix[len('ytsearch'):] or 1)
+    start = int(option(args, '--playlist-start', 1))
+    end = int(option(args, '--playlist-end', count))
+    with open(os.path.join(FIXTURES, 'search.jsonl')) as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+
+    templates = print_templates(args)
+    upstream_wait()
+    for index in range(start - 1, min(end, count)):
+        time.sleep(env_ms('BENCH_RESULT_LATENCY_MS', 20))
+        entry = dict(entries[index % len(entries)])
+        entry['id'] = video_id_for(query, index)
+        entry['url'] = entry['webpage_url'] = f"https://www.youtube.com/watch?v={entry['id']}"
+        entry['playlist_index'] = index + 1
+        if templates:
+            print_fields(entry, templates)
+        else:
+            print(json.dumps(entry), flush=True)
+
+
+def load_info(video_id):
+    with open(os.path.join(FIXTURES, 'info.json')) as f:
+        # Recorded URLs carry a long-past expiry; re-sign them six hours into the future
+        document = re.sub(r'expire=\d+', f'expire={int(time.time()) + 6 * 3600}', f.read())
+    if os.environ.get('BENCH_MEDIA_URL'):
+        document = re.sub(r'https://[\w.-]+\.googlevideo\.com', os.environ['BENCH_MEDIA_URL'], document)
+    info = json.loads(document)
+    info['id'] = info['display_id'] = video_id
+    info['webpage_url'] = info['original_url'] = f'https://www.youtube.com/watch?v={video_id}'
+    multiplier = int(os.environ.get('BENCH_FORMAT_MULTIPLIER', '1'))
+    if multiplier > 1:
+        info['formats'] = [dict(f, format_id=f"{f['format_id']}-{n}" if n else f['format_id'])
+                           for n in range(multiplier) for f in info['formats']]
+    return info
+
+
+TEMPLATE_FIELD = re.compile(r'%\((?P<path>[\w.:]*?)(?:\.\{(?P<subset>[^}]*)\})?(?:\|(?P<default>[^)]*))?\)(?P<fmt>[sj])')
+
+
+def print_templates(args):
+    return [args[i + 1] for i, a in enumerate(args) if a == '--print']
+
+
+def traverse(value, parts, subset):
+    for i, part in enumerate(parts):
+        if part == ':':
+            return [traverse(v, parts[i + 1:], subset) for v in value or []]
+        value = value.get(part) if isinstance(value, dict) else None
+    if subset and isinstance(value, dict):
+        return {k: value[k] for k in subset if value.get(k) is not None}
+    return value
+
+
+def print_fields(info, templates):
+    """Minimal support for --print templates: %(field)s, %(field)j, %(.{a,b})j and %(list.:.{a,b}|default)j"""
+    def render(match):
+        subset = match['subset'].split(',') if match['subset'] is not None else None
+        value = traverse(info, [p for p in match['path'].split('.') if p], subset)
+        if value is None:
+            return match['default'] if match['default'] is not None else 'NA'
+        return json.dumps(value) if match['fmt'] == 'j' else str(value)
+
+    for template in templates:
+        print(TEMPLATE_FIELD.sub(render, template), flush=True)
+
+
+def download(args, output_path):
+    total = int(os.environ.get('BENCH_DOWNLOAD_BYTES', str(5 * 1024 * 1024)))
+    rate = float(os.environ.get('BENCH_DOWNLOAD_RATE', str(50 * 1024 * 1024)))
+    chunk = 256 * 1024
+    written = 0
+    with open(output_path, 'wb') as f:
+        while written < total:
+            size = min(chunk, total - written)
+            f.write(os.urandom(size))
+            written += size
+            time.sleep(size / rate)
+            print(f'[download] {written * 100 / total:5.1f}% of {total / 1024 / 1024:8.2f}MiB at '
+                  f'{rate / 1024 / 1024:6.2f}MiB/s ETA 00:00', flush=True)
+
+
+def main(args):
+    time.sleep(env_ms('BENCH_STARTUP_MS', 0))
+    if '--version' in args:
+        print('2099.01.01-bench')
+        return
+
+    if '--load-info-json' in args:
+        with open(option(args, '--load-info-json')) as f:
+            json.load(f)
+        upstream_wait()
+        download(args, option(args, '-o'))
+        return
+
+    target = args[-1]
+    if target.startswith('ytsearch'):
+        search(args, target)
+        return
+
+    upstream_wait()
+    video_id = target.rsplit('v=', 1)[-1][:11] if 'v=' in target else target[-11:]
+    info = load_info(video_id)
+    if '-o' in args:
+        download(args, option(args, '-o'))
+    elif '--print' in args:
+        print_fields(info, print_templates(args))
+    else:
+        print(json.dumps(info), flush=True)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])